@@ -0,0 +1,314 @@
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from metrics import metrics
+
+log = logging.getLogger('aws_accounts')
+
+# ==============================================================================
+# CONFIGURATION
+# ==============================================================================
+
+# Where the accounts to sync come from: 'static' for the profiles listed in
+# inventory.AWS_ACCOUNTS, or 'organizations' for every active member account
+# of the AWS Organization, each reached by assuming AWS_ORG_ROLE_NAME in it.
+AWS_ACCOUNT_SOURCE = os.getenv("AWS_ACCOUNT_SOURCE", "static").lower()
+
+# Profile allowed to call organizations:ListAccounts (management or delegated
+# administrator account) and to assume the member roles; empty for boto3's
+# default credential chain (e.g. an instance role).
+AWS_ORG_PROFILE = os.getenv("AWS_ORG_PROFILE", "") or None
+AWS_ORG_ROLE_NAME = os.getenv("AWS_ORG_ROLE_NAME", "OrganizationAccountAccessRole")
+AWS_ORG_EXTERNAL_ID = os.getenv("AWS_ORG_EXTERNAL_ID", "")
+AWS_ORG_DEFAULT_REGION = os.getenv("AWS_ORG_DEFAULT_REGION", "us-east-1")
+# Account IDs to leave out, comma-separated - e.g. the management account,
+# which has no AWS_ORG_ROLE_NAME role unless one was created by hand
+AWS_ORG_EXCLUDE_ACCOUNTS = {account_id.strip() for account_id in os.getenv(
+    "AWS_ORG_EXCLUDE_ACCOUNTS", "").split(',') if account_id.strip()}
+
+# Assumed-role credentials are cached in memory and in AWS_CREDENTIAL_CACHE
+# (readable by the owner only) until AWS_CREDENTIAL_REFRESH_MARGIN seconds
+# before they expire, so back-to-back runs and the processes of a sharded run
+# reuse them instead of calling sts:AssumeRole for every account again. An
+# empty AWS_CREDENTIAL_CACHE keeps them in memory only.
+AWS_ROLE_SESSION_NAME = os.getenv("AWS_ROLE_SESSION_NAME", "snipeit-inventory")
+AWS_ROLE_SESSION_SECONDS = int(os.getenv("AWS_ROLE_SESSION_SECONDS", "3600"))
+AWS_CREDENTIAL_CACHE = os.getenv("AWS_CREDENTIAL_CACHE", ".aws_credential_cache.json")
+AWS_CREDENTIAL_REFRESH_MARGIN = int(os.getenv("AWS_CREDENTIAL_REFRESH_MARGIN", "900"))  # seconds
+AWS_CREDENTIAL_WORKERS = int(os.getenv("AWS_CREDENTIAL_WORKERS", "16"))
+
+# boto3 is imported where a session is first made, not at the top: it is most
+# of the start-up time of the commands that never reach AWS (see
+# benchmarks/bench_startup.py).
+
+# ==============================================================================
+# CREDENTIAL BROKER
+# ==============================================================================
+
+def org_session():
+    """Returns a boto3 Session for AWS_ORG_PROFILE."""
+
+    import boto3
+
+    return boto3.Session(profile_name=AWS_ORG_PROFILE)
+
+
+def expiry_of(credentials):
+    """Returns the epoch time at which cached credentials expire."""
+
+    return datetime.fromisoformat(credentials['expiry_time']).timestamp()
+
+
+class CredentialBroker:
+    """
+    Assumes roles through STS and caches their temporary credentials.
+
+    Thread-safe: concurrent requests for the same role wait for a single
+    AssumeRole call, while different roles are assumed in parallel. Pass
+    sts_client to use another (e.g. a stubbed) STS client; by default one is
+    created for AWS_ORG_PROFILE on first use.
+    """
+
+    def __init__(self, sts_client=None, cache_path=AWS_CREDENTIAL_CACHE, margin=AWS_CREDENTIAL_REFRESH_MARGIN,
+                 session_name=AWS_ROLE_SESSION_NAME, duration=AWS_ROLE_SESSION_SECONDS,
+                 external_id=AWS_ORG_EXTERNAL_ID):
+        self._sts_client = sts_client
+        self.cache_path = cache_path
+        self.margin = margin
+        self.session_name = session_name
+        self.duration = duration
+        self.external_id = external_id
+        self.lock = threading.Lock()
+        self.role_locks = {}
+        self.cached = None
+
+    @property
+    def sts_client(self):
+        with self.lock:
+            if self._sts_client is None:
+                self._sts_client = org_session().client('sts', region_name=AWS_ORG_DEFAULT_REGION)
+            return self._sts_client
+
+    def _usable(self, credentials):
+        return credentials is not None and expiry_of(credentials) - time.time() > self.margin
+
+    def _read_cache(self):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return {}
+        try:
+            with open(self.cache_path, encoding='utf-8') as handle:
+                return json.load(handle)
+        except (OSError, ValueError) as e:
+            log.warning("Ignoring unreadable credential cache %s: %s", self.cache_path, e)
+            return {}
+
+    def _cached(self, role_arn):
+        # Called with self.lock held
+        if self.cached is None:
+            self.cached = self._read_cache()
+        return self.cached.get(role_arn)
+
+    def _write_cache(self):
+        # Called with self.lock held. Merged with the file first: other
+        # processes of a sharded run may have added roles to it meanwhile.
+        if not self.cache_path:
+            return
+        merged = self._read_cache()
+        for role_arn, credentials in self.cached.items():
+            if role_arn not in merged or expiry_of(credentials) > expiry_of(merged[role_arn]):
+                merged[role_arn] = credentials
+        now = time.time()
+        merged = {role_arn: credentials for role_arn, credentials in merged.items() if expiry_of(credentials) > now}
+
+        temp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        descriptor = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(descriptor, 'w', encoding='utf-8') as handle:
+            json.dump(merged, handle)
+        os.replace(temp_path, self.cache_path)
+        self.cached = merged
+
+    def credentials(self, role_arn):
+        """
+        Returns credentials for role_arn as {'access_key', 'secret_key', 'token', 'expiry_time'}.
+
+        Cached ones are returned while they have more than margin seconds
+        left; otherwise the role is assumed again. Raises whatever
+        sts:AssumeRole raises.
+        """
+
+        with self.lock:
+            cached = self._cached(role_arn)
+            if self._usable(cached):
+                metrics.inc('aws_credentials_total', source='cache')
+                return cached
+            role_lock = self.role_locks.setdefault(role_arn, threading.Lock())
+
+        with role_lock:
+            with self.lock:
+                # Another thread may have assumed it while we waited
+                cached = self._cached(role_arn)
+                if self._usable(cached):
+                    metrics.inc('aws_credentials_total', source='cache')
+                    return cached
+
+            params = {'RoleArn': role_arn, 'RoleSessionName': self.session_name, 'DurationSeconds': self.duration}
+            if self.external_id:
+                params['ExternalId'] = self.external_id
+            with metrics.timer('aws_api_seconds', operation='AssumeRole'):
+                response = self.sts_client.assume_role(**params)
+            metrics.inc('aws_credentials_total', source='sts')
+
+            issued = response['Credentials']
+            expiration = issued['Expiration']
+            if expiration.tzinfo is None:
+                expiration = expiration.replace(tzinfo=timezone.utc)
+            credentials = {
+                'access_key': issued['AccessKeyId'],
+                'secret_key': issued['SecretAccessKey'],
+                'token': issued['SessionToken'],
+                'expiry_time': expiration.isoformat(),
+            }
+            with self.lock:
+                self.cached[role_arn] = credentials
+                try:
+                    self._write_cache()
+                except OSError as e:
+                    log.warning("Could not write credential cache %s: %s", self.cache_path, e)
+            return credentials
+
+    def session(self, role_arn):
+        """Returns a boto3 Session acting as role_arn, whose credentials the broker refreshes before they expire."""
+
+        import boto3
+        from botocore.session import get_session
+
+        botocore_session = get_session()
+        # Ahead of every other source, so that e.g. AWS_ACCESS_KEY_ID in the environment does not win
+        botocore_session.get_component('credential_provider').insert_before(
+            'env', BrokerCredentialProvider(self, role_arn))
+        return boto3.Session(botocore_session=botocore_session)
+
+    def prefetch(self, role_arns, workers=AWS_CREDENTIAL_WORKERS):
+        """
+        Makes sure every role has fresh credentials, assuming up to workers roles at a time.
+
+        Returns {role_arn: error} for the roles that could not be assumed.
+        """
+
+        errors = {}
+
+        def fetch(role_arn):
+            try:
+                self.credentials(role_arn)
+            except Exception as e:
+                errors[role_arn] = str(e)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(fetch, role_arns))
+        return errors
+
+
+class BrokerCredentialProvider:
+    """
+    botocore credential provider for one role, backed by a CredentialBroker.
+
+    Implements what botocore's CredentialResolver calls on a provider
+    (METHOD and load()), so it can be inserted into a session's provider
+    chain without importing botocore here. The credentials it loads ask the
+    broker again when botocore decides they are about to expire.
+    """
+
+    METHOD = 'credential-broker'
+    CANONICAL_NAME = 'customCredentialBroker'
+
+    def __init__(self, broker, role_arn):
+        self.broker = broker
+        self.role_arn = role_arn
+
+    def load(self):
+        from botocore.credentials import RefreshableCredentials
+
+        return RefreshableCredentials.create_from_metadata(
+            metadata=self.broker.credentials(self.role_arn),
+            refresh_using=lambda: self.broker.credentials(self.role_arn),
+            method='sts-assume-role',
+        )
+
+
+# Shared by every module of a run
+broker = CredentialBroker()
+
+# ==============================================================================
+# ACCOUNTS
+# ==============================================================================
+
+def organization_accounts(org_client=None, role_name=AWS_ORG_ROLE_NAME, exclude=AWS_ORG_EXCLUDE_ACCOUNTS,
+                          default_region=AWS_ORG_DEFAULT_REGION):
+    """
+    Returns an AWS_ACCOUNTS entry for every active account of the organization.
+
+    Their 'profile_name' is only a stable key ('org:<account ID>', used by the
+    state store and the journal); credentials come from assuming 'role_arn'.
+    Pass org_client to use another (e.g. a stubbed) Organizations client.
+    """
+
+    if org_client is None:
+        org_client = org_session().client('organizations', region_name=default_region)
+
+    accounts = []
+    with metrics.timer('aws_api_seconds', operation='ListAccounts'):
+        for page in org_client.get_paginator('list_accounts').paginate():
+            for account in page['Accounts']:
+                if account.get('State', account.get('Status')) != 'ACTIVE' or account['Id'] in exclude:
+                    continue
+                # The account ARN names the partition (aws, aws-us-gov, aws-cn)
+                partition = account['Arn'].split(':')[1]
+                accounts.append({
+                    'name': f"{account['Name']} ({account['Id']})",
+                    'profile_name': f"org:{account['Id']}",
+                    'account_id': account['Id'],
+                    'role_arn': f"arn:{partition}:iam::{account['Id']}:role/{role_name}",
+                    'default_region': default_region,
+                })
+    return accounts
+
+
+def load_accounts(static_accounts, source=AWS_ACCOUNT_SOURCE):
+    """
+    Returns the accounts to sync for AWS_ACCOUNT_SOURCE.
+
+    For 'organizations', every member role is assumed up front, concurrently,
+    so discovery finds their credentials cached instead of assuming them one
+    account at a time. Roles that cannot be assumed are logged here and
+    reported as failures by discovery. Raises ValueError for an unknown source
+    and botocore errors if the organization cannot be listed.
+    """
+
+    if source == 'static':
+        return static_accounts
+    if source != 'organizations':
+        raise ValueError(f"Unknown AWS_ACCOUNT_SOURCE '{source}' (known: static, organizations)")
+
+    accounts = organization_accounts()
+    log.info("Found %d active accounts in the organization", len(accounts))
+    with metrics.timer('phase_seconds', phase='assume_roles'):
+        errors = broker.prefetch([account['role_arn'] for account in accounts])
+    for role_arn, error in errors.items():
+        log.error("Could not assume %s: %s", role_arn, error)
+    return accounts
+
+
+def account_session(account):
+    """Returns a new boto3 Session for an AWS_ACCOUNTS entry: its 'role_arn' through the broker, else its profile."""
+
+    if account.get('role_arn'):
+        return broker.session(account['role_arn'])
+
+    import boto3
+
+    return boto3.Session(profile_name=account['profile_name'])
@@ -0,0 +1,53 @@
+"""
+One entry point for the AWS -> Snipe-IT tools.
+
+    python aws_inventory.py <command> [options]    (python aws_inventory.py <command> --help)
+
+Only the module of the command being run is imported, after .env has been
+loaded, so every module sees the same environment and `--help` or the
+Snipe-IT-only commands do not pay for loading the AWS SDK.
+"""
+import argparse
+import importlib
+import sys
+
+from dotenv import load_dotenv
+
+# ==============================================================================
+# COMMANDS
+# ==============================================================================
+
+# command -> (module, function taking argv, help)
+COMMANDS = {
+    'setup': ('setup_snipeit', 'main', "create the Snipe-IT category, fields, fieldset and models"),
+    'discover': ('inventory', 'discover_main', "discover AWS resources into a snapshot, without Snipe-IT"),
+    'sync': ('inventory', 'main', "discover AWS resources and sync them into Snipe-IT"),
+    'verify': ('check_assets', 'main', "report on the assets stored in Snipe-IT"),
+    'plan': ('sync_plan', 'plan_main', "work out what a sync would change in Snipe-IT, and save the plan"),
+    'apply': ('sync_plan', 'apply_main', "perform the changes of a saved plan"),
+    'reconcile': ('reconcile', 'main', "find (and archive) Snipe-IT assets whose instance is gone"),
+    'diff': ('snapshot', 'diff_main', "compare two inventory snapshots"),
+    'events': ('event_sync', 'main', "sync from EC2 state-change events as they arrive"),
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Sync AWS resources into Snipe-IT.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="commands:\n" + '\n'.join(f"  {name:<10} {command[2]}" for name, command in COMMANDS.items()),
+    )
+    parser.add_argument('command', choices=COMMANDS, metavar='command')
+    parser.add_argument('args', nargs=argparse.REMAINDER, help="the command's options")
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    module_name, function_name, _ = COMMANDS[args.command]
+    run = getattr(importlib.import_module(module_name), function_name)
+    # Usage messages then read "aws_inventory.py sync ..." rather than just "aws_inventory.py ..."
+    sys.argv[0] = f"{sys.argv[0]} {args.command}"
+    return run(args.args) or 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
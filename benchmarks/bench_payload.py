@@ -0,0 +1,129 @@
+"""
+Microbenchmark for building Snipe-IT payloads from EC2 instances.
+
+Compares the compiled, table-driven builder (field_mapping.compile_payload_builder),
+including the projection onto an InstanceRecord, with the hand-written dict
+it replaced, on synthetic instances with a realistic number of tags. Also
+reports how much of that is the projection, and the memory retained per
+instance by boto3's dicts and by the record.
+
+    python benchmarks/bench_payload.py [--instances 10000] [--repeat 5]
+"""
+import argparse
+import os
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_ec2 import make_instance  # noqa: E402
+from field_mapping import InstanceRecord, compile_payload_builder  # noqa: E402
+from inventory import CUSTOM_FIELD_MAP, DEFAULT_MODEL_ID, DEFAULT_STATUS_ID  # noqa: E402
+
+
+# ------------------------------------------------------------------------------
+# Reference: the hand-written builder the spec replaced
+# ------------------------------------------------------------------------------
+
+def _get_tag_value(tags, key):
+    if tags:
+        for tag in tags:
+            if tag['Key'] == key:
+                return tag['Value']
+    return None
+
+def reference_builder(instance, account_name, region_name):
+    asset_tag = instance.get('InstanceId')
+    tags = instance.get('Tags', [])
+    launch_time = instance.get('LaunchTime').strftime('%Y-%m-%d') if instance.get('LaunchTime') else None
+    security_groups = ', '.join([sg.get('GroupId', '') for sg in instance.get('SecurityGroups', [])])
+    network_interfaces = instance.get('NetworkInterfaces', [])
+    mac_address = network_interfaces[0].get('MacAddress', 'N/A') if network_interfaces else 'N/A'
+    payload = {
+        'asset_tag': asset_tag,
+        'serial': asset_tag,
+        'name': _get_tag_value(tags, 'Name') or asset_tag,
+        'status_id': DEFAULT_STATUS_ID,
+        'model_id': DEFAULT_MODEL_ID,
+        'purchase_date': launch_time,
+        'notes': f"AWS Account: {account_name}, Region: {region_name}",
+        '_snipeit_instance_type_3': instance.get('InstanceType', 'N/A'),
+        '_snipeit_description_4': _get_tag_value(tags, 'Description') or 'No description',
+        '_snipeit_private_ip_address_13': instance.get('PrivateIpAddress', 'N/A'),
+        '_snipeit_public_ip_address_14': instance.get('PublicIpAddress', 'N/A'),
+        '_snipeit_platform_7': instance.get('PlatformDetails', 'Linux/UNIX'),
+        '_snipeit_vpc_id_8': instance.get('VpcId', 'N/A'),
+        '_snipeit_dns_name_9': instance.get('PrivateDnsName', 'N/A'),
+        '_snipeit_mac_address_1': mac_address,
+        '_snipeit_vendor_support_end_date_15': _get_tag_value(tags, 'SupportEnd') or 'N/A',
+        '_snipeit_criticality_16': _get_tag_value(tags, 'Criticity') or 'Medium',
+        '_snipeit_asset_owner_12': _get_tag_value(tags, 'Owner') or 'Unassigned',
+        '_snipeit_aws_region_17': region_name,
+        '_snipeit_aws_account_18': account_name,
+        '_snipeit_availability_zone_19': instance.get('Placement', {}).get('AvailabilityZone', 'N/A'),
+        '_snipeit_subnet_id_20': instance.get('SubnetId', 'N/A'),
+        '_snipeit_security_groups_21': security_groups,
+        '_snipeit_instance_state_22': instance.get('State', {}).get('Name', 'unknown'),
+        '_snipeit_launch_time_23': launch_time or 'N/A',
+        '_snipeit_ami_id_24': instance.get('ImageId', 'N/A'),
+        '_snipeit_architecture_25': instance.get('Architecture', 'N/A'),
+        '_snipeit_root_device_type_26': instance.get('RootDeviceType', 'N/A'),
+        '_snipeit_virtualization_type_27': instance.get('VirtualizationType', 'N/A'),
+    }
+    return payload, asset_tag
+
+
+def retained_bytes(make, count):
+    """Bytes still allocated per object after building count objects with make(i)."""
+
+    tracemalloc.start()
+    kept = [make(i) for i in range(count)]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return size / count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--instances', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--tags', type=int, default=20, help="extra tags per instance besides Name/Owner/Criticity")
+    args = parser.parse_args(argv)
+
+    instances = [make_instance(i, args.tags) for i in range(args.instances)]
+    build_payload = compile_payload_builder(CUSTOM_FIELD_MAP, DEFAULT_STATUS_ID, DEFAULT_MODEL_ID)
+
+    def compiled(instance, account_name, region_name):
+        return build_payload(InstanceRecord(instance, account_name, region_name))
+
+    # Both builders must agree before their timings mean anything
+    assert compiled(instances[0], 'Account', 'eu-south-1') == reference_builder(instances[0], 'Account', 'eu-south-1')
+
+    results = {}
+    for label, build in (('reference', reference_builder), ('compiled', compiled)):
+        def run():
+            for instance in instances:
+                build(instance, 'Account', 'eu-south-1')
+        best = min(timeit.repeat(run, number=1, repeat=args.repeat))
+        results[label] = best
+        print(f"{label:>10}: {best * 1e6 / args.instances:7.2f} us/instance  ({best:.3f}s for {args.instances})")
+
+    print(f"{'speed-up':>10}: {results['reference'] / results['compiled']:.2f}x")
+
+    # How much of the compiled time is the projection alone
+    def project():
+        for instance in instances:
+            InstanceRecord(instance, 'Account', 'eu-south-1')
+    best = min(timeit.repeat(project, number=1, repeat=args.repeat))
+    print(f"{'projection':>10}: {best * 1e6 / args.instances:7.2f} us/instance of the compiled time")
+
+    sample = min(args.instances, 2000)
+    as_dict = retained_bytes(lambda i: make_instance(i, args.tags), sample)
+    as_record = retained_bytes(lambda i: InstanceRecord(instances[i], 'Account', 'eu-south-1'), sample)
+    print(f"{'retained':>10}: {as_dict:7.0f} B/instance as boto3 dicts, {as_record:.0f} B as InstanceRecord")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Start-up time of the aws_inventory.py commands.
+
+Each measurement is a fresh interpreter running `aws_inventory.py <command>
+--help`: everything a command loads before it does any work, which for the
+Snipe-IT-only commands should not include boto3 or botocore. The bare
+interpreter (`python -c pass`) is measured as the floor, and each command is
+run once more to see which of the two ended up in sys.modules.
+
+    python benchmarks/bench_startup.py [--repeat 10] [--output baseline.json] [--baseline baseline.json]
+
+The exit status is 1 if the top-level help or a Snipe-IT-only command loaded
+botocore, or, with --baseline, if a command got more than --tolerance slower
+than the baseline's.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from aws_inventory import COMMANDS  # noqa: E402
+
+CLI = os.path.join(REPO_DIR, 'aws_inventory.py')
+
+
+def run_seconds(command, repeat):
+    """Returns the median wall time of running command repeat times."""
+
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        subprocess.run(command, check=True, cwd=REPO_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+# Runs the command given as arguments, then reports which AWS modules it loaded
+PROBE = """
+import json, runpy, sys
+sys.argv = sys.argv[1:]
+try:
+    runpy.run_path(sys.argv[0], run_name='__main__')
+except SystemExit:
+    pass
+print(json.dumps({name: name in sys.modules for name in ('boto3', 'botocore')}), file=sys.stderr)
+"""
+
+# Commands that never call AWS, so must not even load botocore ('help' is the bare --help)
+SNIPEIT_ONLY = ('help', 'setup', 'verify', 'diff')
+
+
+def loaded_aws_modules(command):
+    """Returns {'boto3': bool, 'botocore': bool}: whether running command left them in sys.modules."""
+
+    stderr = subprocess.run([sys.executable, '-c', PROBE] + command[1:], check=True, cwd=REPO_DIR,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True).stderr
+    return json.loads(stderr.strip().splitlines()[-1])
+
+
+def measure(repeat):
+    results = {'interpreter': {'ms': round(run_seconds([sys.executable, '-c', 'pass'], repeat) * 1000, 1)}}
+    for name in [None] + list(COMMANDS):
+        command = [sys.executable, CLI] + ([name] if name else []) + ['--help']
+        results[name or 'help'] = dict(ms=round(run_seconds(command, repeat) * 1000, 1), **loaded_aws_modules(command))
+    return results
+
+
+def print_results(results):
+    floor = results['interpreter']['ms']
+    print(f"{'command':>12} {'start-up':>10} {'over python':>12} {'boto3':>6} {'botocore':>9}")
+    print('-' * 53)
+    for name, result in results.items():
+        loaded = [('' if module not in result else ('yes' if result[module] else 'no')) for module in ('boto3', 'botocore')]
+        print(f"{name:>12} {result['ms']:>7.1f} ms {result['ms'] - floor:>9.1f} ms {loaded[0]:>6} {loaded[1]:>9}")
+
+
+def check_snipeit_only(results):
+    """Prints the Snipe-IT-only commands that loaded botocore; returns how many did."""
+
+    offenders = [name for name in SNIPEIT_ONLY if results[name]['botocore']]
+    for name in offenders:
+        print(f"  FAIL {name}: loaded botocore")
+    return len(offenders)
+
+
+def compare(results, baseline, tolerance):
+    """Prints the commands whose start-up regressed against the baseline; returns how many did."""
+
+    regressions = 0
+    for name, result in results.items():
+        before = baseline['results'].get(name)
+        if before and result['ms'] > before['ms'] * (1 + tolerance):
+            regressions += 1
+            print(f"  REGRESSION {name}: {before['ms']} -> {result['ms']} ms (+{(result['ms'] / before['ms'] - 1) * 100:.0f}%)")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--repeat', type=int, default=10, help="runs per command; the median is reported")
+    parser.add_argument('--output', help="write the results to this JSON file (e.g. to use as a baseline)")
+    parser.add_argument('--baseline', help="compare against results previously written with --output")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed slowdown vs the baseline (default: 0.2)")
+    args = parser.parse_args(argv)
+
+    results = measure(args.repeat)
+    print_results(results)
+    failed = check_snipeit_only(results)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as handle:
+            json.dump({'options': {'repeat': args.repeat}, 'results': results}, handle, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as handle:
+            baseline = json.load(handle)
+        failed += compare(results, baseline, args.tolerance)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
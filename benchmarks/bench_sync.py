@@ -0,0 +1,260 @@
+"""
+End-to-end benchmark of inventory.py against a synthetic EC2 fleet and a local Snipe-IT stub.
+
+Needs no AWS account and no Snipe-IT: EC2 answers come from fake_ec2.FakeFleet
+and Snipe-IT is benchmarks/snipeit_stub.py, with optional latency and 429s.
+Each fleet size runs in a fresh process, so its peak RSS is its own, and goes
+through four measurements:
+
+    discovery  discover_aws_assets() alone, assets thrown away
+    initial    inventory.main() against an empty Snipe-IT (every asset created,
+               through CSV imports with --bulk-load)
+    cached     inventory.main() again (every asset skipped by the state store)
+    resync     inventory.main(['--full-resync']) (index pre-fetch, every asset unchanged)
+
+    python benchmarks/bench_sync.py [--instances 1000 10000 100000] [--latency 0.005]
+        [--throttle-every 200] [--bulk-load | --shards 4] [--output baseline.json] [--baseline baseline.json]
+
+With --shards, the three inventory.main() passes run as a sharded sync; the
+shard processes get the same fake fleet.
+
+With --baseline, timings that got more than --tolerance slower than the
+baseline's are reported and the exit status is 1.
+"""
+import argparse
+import functools
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+
+import snipeit_stub  # noqa: E402
+
+REGIONS = ['us-east-1', 'us-west-2', 'eu-west-1', 'eu-south-1', 'ap-southeast-2', 'sa-east-1']
+PASSES = (('initial', []), ('cached', []), ('resync', ['--full-resync']))
+
+# Compared against --baseline: (measurement, key), lower is better
+TIMINGS = [('discovery', 'seconds')] + [(name, 'seconds') for name, _ in PASSES]
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+# ------------------------------------------------------------------------------
+# One fleet size, in its own process
+# ------------------------------------------------------------------------------
+
+def install_fleet(inventory, fleet):
+    """Makes inventory's EC2 clients answer from the fake fleet."""
+
+    real_get_aws_client = inventory.get_aws_client
+
+    def get_aws_client(account_profile, region, service='ec2'):
+        client = real_get_aws_client(account_profile, region, service)
+        if service == 'ec2' and not getattr(client, '_fake_fleet', False):
+            fleet.install(client, account_profile['profile_name'])
+            client._fake_fleet = True
+        return client
+
+    inventory.get_aws_client = get_aws_client
+
+
+def run_fake_shard(fleet_options, *args):
+    """inventory.run_shard() in a spawned shard process, against the fake fleet."""
+
+    from fake_ec2 import FakeFleet
+    import inventory
+
+    install_fleet(inventory, FakeFleet(**fleet_options))
+    inventory.run_shard(*args)
+
+
+def run_child(args):
+    """Benchmarks one fleet size against the stub at args.snipeit_url and prints the results as JSON."""
+
+    workdir = tempfile.mkdtemp(prefix='bench_sync_')
+    os.environ.update({
+        'APP_URL': args.snipeit_url,
+        'APP_KEY': 'benchmark',
+        'SNIPEIT_METADATA_CACHE': os.path.join(workdir, 'metadata.json'),
+        'SNIPEIT_MAX_RPS': str(args.max_rps),
+        'SYNC_STATE_PATH': os.path.join(workdir, 'state.sqlite3'),
+        'SYNC_JOURNAL_PATH': os.path.join(workdir, 'journal.jsonl'),
+        'SYNC_SNAPSHOT_PATH': os.path.join(workdir, 'snapshot.jsonl.gz'),
+        'SYNC_LOCK_PATH': os.path.join(workdir, 'sync.lock'),
+        'SYNC_METRICS_JSON': os.path.join(workdir, 'metrics.json'),
+        'LOG_LEVEL': 'ERROR',
+        # The fake fleet only has EC2 instances
+        'AWS_COLLECTORS': 'ec2',
+    })
+
+    from fake_ec2 import FakeFleet, write_credentials
+
+    profiles = [f'bench{number}' for number in range(args.accounts)]
+    write_credentials(workdir, profiles)
+    fleet_options = {'instances': args.instances, 'profiles': profiles, 'regions': REGIONS[:args.regions],
+                     'tags': args.tags}
+    fleet = FakeFleet(**fleet_options)
+
+    # Imported only now: inventory reads its configuration at import time
+    import inventory
+    from metrics import metrics
+
+    inventory.AWS_ACCOUNTS = [
+        {'name': f'Benchmark {profile}', 'profile_name': profile, 'default_region': REGIONS[0]}
+        for profile in profiles
+    ]
+    install_fleet(inventory, fleet)
+    # Shards are spawned, fresh interpreters: they install the fleet themselves
+    inventory.run_shard = functools.partial(run_fake_shard, fleet_options)
+    results = {'instances': args.instances, 'startup_rss_mb': peak_rss_mb()}
+
+    discovered = []
+    started = time.perf_counter()
+    inventory.discover_aws_assets(inventory.AWS_ACCOUNTS, lambda batch: discovered.append(len(batch)))
+    seconds = time.perf_counter() - started
+    results['discovery'] = {
+        'seconds': round(seconds, 3),
+        'assets': sum(discovered),
+        'assets_per_second': round(sum(discovered) / seconds, 1),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+    del discovered
+
+    for name, argv in PASSES:
+        if name == 'initial' and args.bulk_load:
+            argv = argv + ['--bulk-load']
+        if args.shards > 1:
+            argv = argv + ['--shards', str(args.shards)]
+        metrics.reset()
+        started = time.perf_counter()
+        inventory.main(argv)
+        seconds = time.perf_counter() - started
+        with open(os.environ['SYNC_METRICS_JSON'], encoding='utf-8') as handle:
+            summary = json.load(handle)
+        counters = summary['counters']
+        results[name] = {
+            'seconds': round(seconds, 3),
+            'assets_per_second': round(summary['discovered'] / seconds, 1),
+            'outcomes': {outcome: count for outcome, count in summary['outcomes'].items() if count},
+            'snipeit_requests': sum(value for series, value in counters.items()
+                                    if series.startswith('snipeit_requests_total')),
+            'throttled': counters.get('snipeit_throttled_total', 0),
+            'peak_rss_mb': peak_rss_mb(),
+        }
+
+    print(json.dumps(results))
+
+# ------------------------------------------------------------------------------
+# Driver
+# ------------------------------------------------------------------------------
+
+def run_size(args, instances):
+    server = snipeit_stub.start(latency=args.latency, throttle_every=args.throttle_every,
+                                retry_after=args.retry_after, import_row_seconds=args.import_row_seconds)
+    try:
+        command = [
+            sys.executable, os.path.abspath(__file__), '--child',
+            '--snipeit-url', server.url,
+            '--instances', str(instances),
+            '--accounts', str(args.accounts),
+            '--regions', str(args.regions),
+            '--tags', str(args.tags),
+            '--max-rps', str(args.max_rps),
+            '--shards', str(args.shards),
+        ] + (['--bulk-load'] if args.bulk_load else [])
+        output = subprocess.run(command, check=True, stdout=subprocess.PIPE, text=True).stdout
+    finally:
+        server.shutdown()
+        server.server_close()
+    results = json.loads(output.strip().splitlines()[-1])
+    results['stub'] = dict(server.stats)
+    return results
+
+
+def print_results(all_results):
+    header = f"{'instances':>10} {'discovery':>16} {'initial':>16} {'cached':>16} {'resync':>16} {'429s':>6} {'peak RSS':>9}"
+    print(header)
+    print('-' * len(header))
+    for results in all_results:
+        cells = []
+        for name in ('discovery',) + tuple(name for name, _ in PASSES):
+            cells.append(f"{results[name]['seconds']:6.2f}s {results[name]['assets_per_second']:6.0f}/s")
+        throttled = sum(results[name]['throttled'] for name, _ in PASSES)
+        peak = max(results[name]['peak_rss_mb'] for name, _ in PASSES)
+        print(f"{results['instances']:>10} {' '.join(f'{cell:>16}' for cell in cells)} {throttled:>6} {peak:>6.0f} MB")
+
+
+def compare(all_results, baseline, tolerance):
+    """Prints the timings that regressed against the baseline; returns how many did."""
+
+    previous = {results['instances']: results for results in baseline['results']}
+    regressions = 0
+    for results in all_results:
+        before = previous.get(results['instances'])
+        if before is None:
+            continue
+        for measurement, key in TIMINGS + [(name, 'peak_rss_mb') for name, _ in PASSES[-1:]]:
+            old, new = before[measurement][key], results[measurement][key]
+            if old and new > old * (1 + tolerance):
+                regressions += 1
+                print(f"  REGRESSION {results['instances']} instances, {measurement} {key}: "
+                      f"{old} -> {new} (+{(new / old - 1) * 100:.0f}%)")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--instances', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help="fleet sizes to benchmark (default: 1000 10000 100000)")
+    parser.add_argument('--accounts', type=int, default=2)
+    parser.add_argument('--regions', type=int, default=4, choices=range(1, len(REGIONS) + 1))
+    parser.add_argument('--tags', type=int, default=20, help="extra tags per instance")
+    parser.add_argument('--latency', type=float, default=0.0, help="Snipe-IT stub latency per request, in seconds")
+    parser.add_argument('--throttle-every', type=int, default=0, help="the stub answers every Nth request with 429")
+    parser.add_argument('--retry-after', type=float, default=0.5, help="Retry-After of the injected 429s, in seconds")
+    parser.add_argument('--import-row-seconds', type=float, default=0.0,
+                        help="the stub's processing time per row of a CSV import, in seconds")
+    parser.add_argument('--bulk-load', action='store_true', help="run the initial sync with --bulk-load")
+    parser.add_argument('--shards', type=int, default=1, help="run the inventory.main() passes with --shards N")
+    parser.add_argument('--max-rps', type=float, default=2000, help="SNIPEIT_MAX_RPS for the benchmarked runs")
+    parser.add_argument('--output', help="write the results to this JSON file (e.g. to use as a baseline)")
+    parser.add_argument('--baseline', help="compare against results previously written with --output")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed slowdown vs the baseline (default: 0.2)")
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--snipeit-url', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        args.instances = args.instances[0]
+        return run_child(args)
+
+    all_results = []
+    for instances in args.instances:
+        all_results.append(run_size(args, instances))
+    print_results(all_results)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as handle:
+            json.dump({'options': {key: value for key, value in vars(args).items()
+                                   if key not in ('child', 'snipeit_url', 'output', 'baseline')},
+                       'results': all_results}, handle, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as handle:
+            baseline = json.load(handle)
+        if compare(all_results, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
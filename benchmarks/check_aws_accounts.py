@@ -0,0 +1,181 @@
+"""
+Offline checks of aws_accounts.py against stubbed Organizations and STS clients.
+
+Needs no AWS account: the clients are real boto3 clients whose answers are
+queued with botocore.stub.Stubber, so request and response shapes are still
+validated against the service models. Checks that
+
+    organization_accounts  keeps ACTIVE, non-excluded accounts and builds
+                           their role ARN in the account's partition
+    CredentialBroker       reuses cached credentials until they are within
+                           margin of expiring, then assumes the role again
+    concurrent callers     of one role share a single AssumeRole call
+    session()              hands the broker's credentials to boto3
+
+    python benchmarks/check_aws_accounts.py
+
+Prints one line per check; the exit status is 1 if any failed.
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+
+# Nothing from the local AWS configuration may leak into the checks
+os.environ['AWS_CONFIG_FILE'] = os.devnull
+os.environ['AWS_SHARED_CREDENTIALS_FILE'] = os.devnull
+
+import boto3  # noqa: E402
+from botocore.stub import Stubber  # noqa: E402
+
+from aws_accounts import CredentialBroker, organization_accounts  # noqa: E402
+
+ROLE_ARN = 'arn:aws:iam::222222222222:role/OrganizationAccountAccessRole'
+
+
+def stubbed_client(service):
+    client = boto3.client(service, region_name='us-east-1', aws_access_key_id='stub', aws_secret_access_key='stub')
+    return client, Stubber(client)
+
+
+def account(account_id, status='ACTIVE', partition='aws'):
+    return {
+        'Id': account_id,
+        'Arn': f'arn:{partition}:organizations::111111111111:account/o-example/{account_id}',
+        'Name': f'account-{account_id}',
+        'Email': f'{account_id}@example.com',
+        'Status': status,
+    }
+
+
+def assume_role_response(access_key, expires_in):
+    return {'Credentials': {
+        'AccessKeyId': access_key,
+        'SecretAccessKey': 'secret-key-of-' + access_key,
+        'SessionToken': 'session-token-of-' + access_key,
+        'Expiration': datetime.now(timezone.utc) + expires_in,
+    }}
+
+
+def assume_role_params(broker):
+    return {'RoleArn': ROLE_ARN, 'RoleSessionName': broker.session_name, 'DurationSeconds': broker.duration}
+
+# ------------------------------------------------------------------------------
+# Checks
+# ------------------------------------------------------------------------------
+
+def check_organization_accounts():
+    client, stubber = stubbed_client('organizations')
+    stubber.add_response('list_accounts', {
+        'Accounts': [account('000000000001'), account('000000000002', status='SUSPENDED')],
+        'NextToken': 'page-2',
+    })
+    stubber.add_response('list_accounts', {
+        'Accounts': [account('000000000003', partition='aws-us-gov'), account('000000000004')],
+    }, {'NextToken': 'page-2'})
+    with stubber:
+        accounts = organization_accounts(client, role_name='Audit', exclude={'000000000004'})
+    stubber.assert_no_pending_responses()
+
+    assert [entry['account_id'] for entry in accounts] == ['000000000001', '000000000003'], accounts
+    assert accounts[0]['profile_name'] == 'org:000000000001'
+    assert accounts[0]['role_arn'] == 'arn:aws:iam::000000000001:role/Audit'
+    assert accounts[1]['role_arn'] == 'arn:aws-us-gov:iam::000000000003:role/Audit'
+
+
+def check_cache_and_refresh(cache_path):
+    client, stubber = stubbed_client('sts')
+    broker = CredentialBroker(client, cache_path=cache_path, margin=900)
+    stubber.add_response('assume_role', assume_role_response('AKIAFIRSTEXAMPLE000', timedelta(hours=1)),
+                         assume_role_params(broker))
+    with stubber:
+        first = broker.credentials(ROLE_ARN)
+        # An hour left is more than the margin: no second call (the Stubber would raise)
+        again = broker.credentials(ROLE_ARN)
+    stubber.assert_no_pending_responses()
+    assert first['access_key'] == again['access_key'] == 'AKIAFIRSTEXAMPLE000'
+
+    # A new broker (the next run) finds them in the cache file
+    client, stubber = stubbed_client('sts')
+    with stubber:
+        cached = CredentialBroker(client, cache_path=cache_path, margin=900).credentials(ROLE_ARN)
+    assert cached['access_key'] == 'AKIAFIRSTEXAMPLE000'
+
+    # With a margin longer than the hour left, they are due for refresh
+    client, stubber = stubbed_client('sts')
+    broker = CredentialBroker(client, cache_path=cache_path, margin=2 * 3600)
+    stubber.add_response('assume_role', assume_role_response('AKIASECONDEXAMPLE000', timedelta(hours=1)),
+                         assume_role_params(broker))
+    with stubber:
+        refreshed = broker.credentials(ROLE_ARN)
+    stubber.assert_no_pending_responses()
+    assert refreshed['access_key'] == 'AKIASECONDEXAMPLE000'
+
+
+def check_single_flight(threads=8):
+    client, stubber = stubbed_client('sts')
+    broker = CredentialBroker(client, cache_path='')
+    stubber.add_response('assume_role', assume_role_response('AKIAONCEEXAMPLE000', timedelta(hours=1)),
+                         assume_role_params(broker))
+    # Hold the one call open long enough for every caller to be waiting on it
+    client.meta.events.register('before-parameter-build.sts.AssumeRole', lambda **kwargs: time.sleep(0.2))
+
+    start = threading.Event()
+    results, errors = [], []
+
+    def call():
+        start.wait()
+        try:
+            results.append(broker.credentials(ROLE_ARN)['access_key'])
+        except Exception as e:  # a second AssumeRole finds no stubbed response
+            errors.append(e)
+
+    workers = [threading.Thread(target=call) for _ in range(threads)]
+    with stubber:
+        for worker in workers:
+            worker.start()
+        start.set()
+        for worker in workers:
+            worker.join()
+    assert not errors, errors
+    assert results == ['AKIAONCEEXAMPLE000'] * threads, results
+
+
+def check_session():
+    client, stubber = stubbed_client('sts')
+    broker = CredentialBroker(client, cache_path='')
+    stubber.add_response('assume_role', assume_role_response('AKIASESSIONEXAMPLE000', timedelta(hours=1)),
+                         assume_role_params(broker))
+    with stubber:
+        credentials = broker.session(ROLE_ARN).get_credentials().get_frozen_credentials()
+    assert credentials.access_key == 'AKIASESSIONEXAMPLE000'
+    assert credentials.token == 'session-token-of-AKIASESSIONEXAMPLE000'
+
+
+def main():
+    cache_path = os.path.join(tempfile.mkdtemp(prefix='check_aws_accounts_'), 'credentials.json')
+    checks = [
+        ('organization accounts', check_organization_accounts),
+        ('credential cache and refresh', lambda: check_cache_and_refresh(cache_path)),
+        ('one AssumeRole for concurrent callers', check_single_flight),
+        ('boto3 session from the broker', check_session),
+    ]
+    failed = 0
+    for name, check in checks:
+        try:
+            check()
+        except Exception as e:
+            failed += 1
+            print(f"FAIL  {name}: {type(e).__name__}: {e}")
+        else:
+            print(f"ok    {name}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,127 @@
+"""
+Synthetic EC2 fleet for the offline benchmarks.
+
+Answers describe_regions and describe_instances on real boto3 clients through
+botocore's before-call hook, the same one botocore.stub.Stubber uses, so
+inventory.py's paginators, filters and page sizes run unchanged. Unlike a
+Stubber, pages are generated when they are asked for instead of being queued
+up front, so a 100k-instance fleet does not sit in memory and skew the peak
+RSS being measured.
+"""
+import base64
+import datetime
+import os
+
+from botocore.awsrequest import AWSResponse
+
+# describe_instances returns at most this many instances per page
+EC2_MAX_PAGE_SIZE = 1000
+
+
+def make_instance(i, extra_tags=20):
+    tags = [{'Key': f'team:{k}', 'Value': f'value-{k}'} for k in range(extra_tags)]
+    tags += [
+        {'Key': 'Name', 'Value': f'server-{i}'},
+        {'Key': 'Owner', 'Value': 'platform'},
+        {'Key': 'Criticity', 'Value': 'High'},
+    ]
+    return {
+        'InstanceId': f'i-{i:017x}',
+        'InstanceType': 't3.medium',
+        'ImageId': 'ami-0123456789abcdef0',
+        'LaunchTime': datetime.datetime(2024, 1, 1, 12, 0, 0),
+        'State': {'Name': 'running'},
+        'PrivateIpAddress': '10.0.0.1',
+        'PrivateDnsName': 'ip-10-0-0-1.ec2.internal',
+        'VpcId': 'vpc-0123456789',
+        'SubnetId': 'subnet-0123456789',
+        'Placement': {'AvailabilityZone': 'eu-south-1a'},
+        'SecurityGroups': [{'GroupId': 'sg-1', 'GroupName': 'a'}, {'GroupId': 'sg-2', 'GroupName': 'b'}],
+        'NetworkInterfaces': [{'MacAddress': '0a:00:00:00:00:01'}],
+        'PlatformDetails': 'Linux/UNIX',
+        'Architecture': 'x86_64',
+        'RootDeviceType': 'ebs',
+        'VirtualizationType': 'hvm',
+        'Tags': tags,
+    }
+
+
+class FakeFleet:
+    """
+    instances EC2 instances spread evenly over every (account, region) pair.
+
+    Each pair owns a contiguous range of instance numbers, so instance IDs are
+    unique across the fleet and stable from one run to the next.
+    """
+
+    def __init__(self, instances, profiles, regions, tags=20):
+        self.profiles = list(profiles)
+        self.regions = list(regions)
+        self.tags = tags
+
+        pairs = [(profile, region) for profile in self.profiles for region in self.regions]
+        per_pair, extra = divmod(instances, len(pairs))
+        self.ranges = {}
+        start = 0
+        for position, pair in enumerate(pairs):
+            count = per_pair + (1 if position < extra else 0)
+            self.ranges[pair] = (start, start + count)
+            start += count
+
+    def page(self, profile, region, token, page_size):
+        """Returns one describe_instances response, with a NextToken if more pages follow."""
+
+        first, last = self.ranges.get((profile, region), (0, 0))
+        offset = int(base64.b64decode(token)) if token else first
+        end = min(last, offset + min(page_size or EC2_MAX_PAGE_SIZE, EC2_MAX_PAGE_SIZE))
+
+        instances = []
+        for number in range(offset, end):
+            instance = make_instance(number, self.tags)
+            instance['Placement'] = {'AvailabilityZone': f'{region}a'}
+            instances.append(instance)
+
+        response = {'Reservations': [{'Instances': instances}] if instances else []}
+        if end < last:
+            response['NextToken'] = base64.b64encode(str(end).encode()).decode()
+        return response
+
+    def install(self, client, profile):
+        """Makes an EC2 client answer from the fleet instead of AWS."""
+
+        region = client.meta.region_name
+
+        def capture_params(params, context, **kwargs):
+            context['fake_ec2_params'] = params
+
+        def respond(model, context, **kwargs):
+            params = context.get('fake_ec2_params', {})
+            if model.name == 'DescribeRegions':
+                parsed = {'Regions': [{'RegionName': name} for name in self.regions]}
+            elif model.name == 'DescribeInstances':
+                parsed = self.page(profile, region, params.get('NextToken'), params.get('MaxResults'))
+            else:
+                return None
+            parsed['ResponseMetadata'] = {'HTTPStatusCode': 200}
+            return AWSResponse(None, 200, {}, None), parsed
+
+        client.meta.events.register('before-parameter-build.ec2.*', capture_params)
+        client.meta.events.register_first('before-call.ec2.*', respond)
+        return client
+
+
+def write_credentials(directory, profiles):
+    """
+    Writes dummy credentials for the profiles and points boto3 at them.
+
+    boto3.Session(profile_name=...) then works as it would with real
+    profiles; no request ever leaves the process.
+    """
+
+    path = os.path.join(directory, 'credentials')
+    with open(path, 'w', encoding='utf-8') as handle:
+        for profile in profiles:
+            handle.write(f"[{profile}]\naws_access_key_id = AKIAFAKE\naws_secret_access_key = fake\n\n")
+    os.environ['AWS_SHARED_CREDENTIALS_FILE'] = path
+    os.environ['AWS_CONFIG_FILE'] = os.path.join(directory, 'config')
+    return path
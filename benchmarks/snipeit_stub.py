@@ -0,0 +1,361 @@
+"""
+Local stand-in for the Snipe-IT hardware API, for the offline benchmarks.
+
+Implements what inventory.py uses of /api/v1/hardware: paginated listing
+(sorted by id), search by asset tag, POST and PATCH. Rows look like Snipe-IT's
+transformer output, so the sync's diffing sees what we pushed as unchanged.
+Also serves the custom fields (one per field_mapping.FIELD_SPECS entry), the
+EC2 model and its category, status labels, and the CSV import endpoints used
+by --bulk-load. Every response can be delayed by a fixed latency, and every
+Nth request can be answered with HTTP 429 to exercise the rate limiter.
+
+    python benchmarks/snipeit_stub.py [--port 8000] [--latency 0.02] [--throttle-every 50]
+"""
+import argparse
+import csv
+import io
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from field_mapping import FIELD_SPECS, snipeit_db_column  # noqa: E402
+
+# Snipe-IT caps 'limit' at MAX_RESULTS
+MAX_RESULTS = 500
+
+CATEGORY = {'id': 1, 'name': 'Cloud Infrastructure'}
+MANUFACTURER = {'id': 1, 'name': 'Amazon Web Services'}
+MODEL = {'id': 1, 'name': 'EC2 Instance', 'category': CATEGORY, 'manufacturer': MANUFACTURER,
+         'fieldset': {'id': 1, 'name': 'AWS EC2 Instance'}}
+STATUS_LABELS = {1: 'Pending', 2: 'Ready to Deploy', 3: 'Archived'}
+ARCHIVED_STATUS_ID = 3
+CUSTOM_FIELDS = [
+    {'id': field_id, 'name': spec.name, 'db_column_name': snipeit_db_column(spec.name, field_id)}
+    for field_id, spec in enumerate(FIELD_SPECS, 1)
+]
+
+
+class HardwareStore:
+    """The stub's assets, by id. Shared by all request threads."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.assets = {}
+        self.by_tag = {}
+        self.ids = itertools.count(1)
+
+    def create(self, payload):
+        with self.lock:
+            return self._create_locked(payload)
+
+    def create_many(self, payloads):
+        """Creates every payload whose tag is new, in one critical section; returns the tags that were not."""
+
+        with self.lock:
+            return [payload.get('asset_tag') for payload in payloads if self._create_locked(payload) is None]
+
+    def _create_locked(self, payload):
+        if payload.get('asset_tag') in self.by_tag:
+            return None
+        asset_id = next(self.ids)
+        self.assets[asset_id] = dict(payload, id=asset_id)
+        self.by_tag[payload.get('asset_tag')] = asset_id
+        return asset_id
+
+    def update(self, asset_id, payload):
+        with self.lock:
+            asset = self.assets.get(asset_id)
+            if asset is None:
+                return False
+            asset.update(payload)
+            return True
+
+    def page(self, offset, limit, search=None, status_id=None):
+        with self.lock:
+            if search is not None:
+                asset_id = self.by_tag.get(search)
+                rows = [self.assets[asset_id]] if asset_id else []
+            elif status_id is not None:
+                rows = [asset for asset in self.assets.values() if asset.get('status_id') == status_id]
+            else:
+                # Like Snipe-IT (without show_archived_in_list), archived assets are left out
+                rows = [asset for asset in self.assets.values()  # insertion order is id order
+                        if asset.get('status_id') != ARCHIVED_STATUS_ID]
+            return len(rows), [hardware_row(asset) for asset in rows[offset:offset + limit]]
+
+
+def hardware_row(asset):
+    """Renders a stored asset the way Snipe-IT's hardware transformer does."""
+
+    row = {
+        'id': asset['id'],
+        'asset_tag': asset.get('asset_tag'),
+        'serial': asset.get('serial'),
+        'name': asset.get('name'),
+        'status_label': {'id': asset.get('status_id'), 'name': STATUS_LABELS.get(asset.get('status_id'))},
+        'model': {'id': asset.get('model_id'), 'name': 'EC2 Instance'},
+        'purchase_date': {'date': asset['purchase_date'], 'formatted': asset['purchase_date']}
+        if asset.get('purchase_date') else None,
+        'notes': asset.get('notes'),
+        'custom_fields': {},
+    }
+    for key, value in asset.items():
+        if key.startswith('_snipeit_'):
+            row['custom_fields'][key] = {'field': key, 'value': value, 'field_format': 'ANY'}
+    return row
+
+
+def imported_payloads(text, mappings):
+    """
+    Turns an uploaded CSV into hardware payloads, the way Snipe-IT's AssetImporter reads it.
+
+    mappings is the process request's column-mappings ({header: importer field});
+    any other header is matched to a custom field by name, ignoring case.
+    """
+
+    by_field = {field: header.lower() for header, field in mappings.items()}
+    columns = {field['name'].lower(): field['db_column_name'] for field in CUSTOM_FIELDS}
+    statuses = {name.lower(): status_id for status_id, name in STATUS_LABELS.items()}
+
+    payloads = []
+    for row in csv.DictReader(io.StringIO(text)):
+        row = {header.lower(): value for header, value in row.items()}
+
+        def value(field):
+            return (row.get(by_field.get(field, field)) or '').strip()
+
+        payload = {
+            'asset_tag': value('asset_tag'),
+            'name': value('item_name'),
+            'serial': value('serial'),
+            'status_id': statuses.get(value('status').lower(), 2),
+            'model_id': MODEL['id'],
+            'purchase_date': value('purchase_date') or None,
+            'notes': value('asset_notes'),
+        }
+        for header, cell in row.items():
+            if header in columns:
+                payload[columns[header]] = cell
+        payloads.append(payload)
+    return payloads
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0, throttle_every=0, retry_after=0.5, rate_limit=0,
+                 import_row_seconds=0.0):
+        super().__init__(address, StubHandler)
+        self.store = HardwareStore()
+        self.imports = {}
+        self.import_ids = itertools.count(1)
+        self.latency = latency
+        self.throttle_every = throttle_every
+        self.retry_after = retry_after
+        self.rate_limit = rate_limit  # advertised in X-RateLimit-Limit, per minute
+        self.import_row_seconds = import_row_seconds  # processing time per imported row
+        self.requests = itertools.count(1)
+        self.stats_lock = threading.Lock()
+        self.stats = {'GET': 0, 'POST': 0, 'PATCH': 0, 'DELETE': 0, 'throttled': 0, 'imported': 0}
+
+    @property
+    def url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def count(self, key, value=1):
+        with self.stats_lock:
+            self.stats[key] += value
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # Keep-alive, as a real Snipe-IT behind nginx would. Headers and body go
+    # out in separate writes, so without TCP_NODELAY every response would
+    # wait out the client's delayed ACK.
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, code, body, headers=()):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        if self.server.rate_limit:
+            self.send_header('X-RateLimit-Limit', str(self.server.rate_limit))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length)
+
+    def read_json(self):
+        return json.loads(self.read_body() or b'{}')
+
+    def read_upload(self):
+        """Returns (filename, text) of the first file in a multipart/form-data body."""
+
+        head = f"Content-Type: {self.headers.get('Content-Type')}\r\n\r\n".encode('utf-8')
+        message = BytesParser(policy=HTTP).parsebytes(head + self.read_body())
+        for part in message.iter_parts():
+            if part.get_filename():
+                return part.get_filename(), part.get_payload(decode=True).decode('utf-8')
+        return None, None
+
+    def admit(self, method):
+        """Applies the latency and the 429 injection; False if the request was throttled."""
+
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+        if server.throttle_every and next(server.requests) % server.throttle_every == 0:
+            if method in ('POST', 'PATCH'):
+                self.read_body()  # drain the body so the connection can be reused
+            server.count('throttled')
+            self.send_json(429, {'status': 'error', 'messages': 'Too Many Requests'},
+                           [('Retry-After', str(server.retry_after))])
+            return False
+        server.count(method)
+        return True
+
+    def route(self):
+        """Returns the /api/v1 path as a list of segments, e.g. ['hardware', '12']."""
+
+        path = urlparse(self.path).path.rstrip('/')
+        return path[len('/api/v1/'):].split('/') if path.startswith('/api/v1/') else []
+
+    def hardware_id(self, path):
+        parts = path.rstrip('/').split('/')
+        if len(parts) == 5 and parts[:4] == ['', 'api', 'v1', 'hardware'] and parts[4].isdigit():
+            return int(parts[4])
+        return None
+
+    def do_GET(self):
+        if not self.admit('GET'):
+            return
+        url = urlparse(self.path)
+        route = self.route()
+        listings = {'fields': CUSTOM_FIELDS, 'models': [MODEL], 'categories': [CATEGORY],
+                    'manufacturers': [MANUFACTURER]}
+        if len(route) == 1 and route[0] in listings:
+            return self.send_json(200, {'total': len(listings[route[0]]), 'rows': listings[route[0]]})
+        if len(route) == 2 and route[0] == 'statuslabels' and int(route[1]) in STATUS_LABELS:
+            return self.send_json(200, {'id': int(route[1]), 'name': STATUS_LABELS[int(route[1])]})
+        if url.path.rstrip('/') != '/api/v1/hardware':
+            return self.send_json(404, {'status': 'error', 'messages': 'Not found'})
+
+        query = parse_qs(url.query)
+        offset = int(query.get('offset', ['0'])[0])
+        limit = min(int(query.get('limit', ['50'])[0]), MAX_RESULTS)
+        search = query.get('search', [None])[0]
+        status_id = int(query['status_id'][0]) if 'status_id' in query else None
+        total, rows = self.server.store.page(offset, limit, search, status_id)
+        self.send_json(200, {'total': total, 'rows': rows})
+
+    def do_POST(self):
+        if not self.admit('POST'):
+            return
+        route = self.route()
+        if route == ['imports']:
+            return self.upload_import()
+        if len(route) == 3 and route[:2] == ['imports', 'process']:
+            return self.process_import(int(route[2]))
+
+        payload = self.read_json()
+        if urlparse(self.path).path.rstrip('/') != '/api/v1/hardware':
+            return self.send_json(404, {'status': 'error', 'messages': 'Not found'})
+
+        asset_id = self.server.store.create(payload)
+        if asset_id is None:
+            # Snipe-IT answers 200 with an error status on validation failures
+            return self.send_json(200, {'status': 'error',
+                                        'messages': {'asset_tag': ['The asset tag must be unique.']}})
+        self.send_json(200, {'status': 'success', 'messages': 'Asset created', 'payload': {'id': asset_id}})
+
+    def do_PATCH(self):
+        if not self.admit('PATCH'):
+            return
+        payload = self.read_json()
+        asset_id = self.hardware_id(urlparse(self.path).path)
+        if asset_id is None or not self.server.store.update(asset_id, payload):
+            return self.send_json(404, {'status': 'error', 'messages': 'Asset not found'})
+        self.send_json(200, {'status': 'success', 'messages': 'Asset updated', 'payload': {'id': asset_id}})
+
+    def do_DELETE(self):
+        if not self.admit('DELETE'):
+            return
+        route = self.route()
+        if len(route) == 2 and route[0] == 'imports' and self.server.imports.pop(int(route[1]), None) is not None:
+            return self.send_json(200, {'status': 'success', 'messages': 'Import deleted'})
+        self.send_json(200, {'status': 'warning', 'messages': 'Import not found'})
+
+    def upload_import(self):
+        filename, text = self.read_upload()
+        if text is None:
+            return self.send_json(422, {'status': 'error', 'messages': 'No file uploaded'})
+        import_id = next(self.server.import_ids)
+        self.server.imports[import_id] = text
+        self.send_json(200, {'files': [{'id': import_id, 'file_path': filename, 'filesize': len(text)}]})
+
+    def process_import(self, import_id):
+        options = self.read_json()
+        text = self.server.imports.get(import_id)
+        if text is None:
+            return self.send_json(500, {'status': 'import-errors', 'messages': [['The selected file is invalid.']]})
+
+        payloads = imported_payloads(text, options.get('column-mappings') or {})
+        if self.server.import_row_seconds:
+            time.sleep(self.server.import_row_seconds * len(payloads))
+        duplicates = self.server.store.create_many(payloads)
+        self.server.count('imported', len(payloads) - len(duplicates))
+        if duplicates:
+            errors = {tag: {'asset_tag': {'asset_tag': [f'An asset with the tag {tag} already exists']}}
+                      for tag in duplicates}
+            return self.send_json(500, {'status': 'import-errors', 'messages': errors})
+        self.send_json(200, {'status': 'success', 'messages': {'redirect_url': '/hardware'}})
+
+
+def start(port=0, **options):
+    """Starts a stub server on a background thread; see StubServer for the options."""
+
+    server = StubServer(('127.0.0.1', port), **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument('--throttle-every', type=int, default=0, help="answer every Nth request with HTTP 429")
+    parser.add_argument('--retry-after', type=float, default=0.5, help="Retry-After sent with a 429, in seconds")
+    parser.add_argument('--rate-limit', type=int, default=0, help="X-RateLimit-Limit to advertise, per minute")
+    parser.add_argument('--import-row-seconds', type=float, default=0.0,
+                        help="processing time per row of a CSV import, in seconds")
+    args = parser.parse_args(argv)
+
+    server = StubServer(('127.0.0.1', args.port), latency=args.latency, throttle_every=args.throttle_every,
+                        retry_after=args.retry_after, rate_limit=args.rate_limit,
+                        import_row_seconds=args.import_row_seconds)
+    print(f"Snipe-IT stub listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
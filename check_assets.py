@@ -1,75 +1,122 @@
 # verify_assets.py
+import argparse
+import time
+from collections import Counter
+
 import requests
-import os
-from dotenv import load_dotenv
-
-load_dotenv()
-
-SNIPEIT_API_TOKEN = os.getenv("APP_KEY", "")
-SNIPEIT_BASE_URL = "http://localhost:8000"
-
-headers = {
-    'Authorization': f'Bearer {SNIPEIT_API_TOKEN}',
-    'Accept': 'application/json',
-}
-
-print("Checking all assets in Snipe-IT...\n")
-
-# Get all assets with pagination
-offset = 0
-limit = 500
-all_assets = []
-
-response = requests.get(
-    f"{SNIPEIT_BASE_URL}/api/v1/hardware",
-    headers=headers,
-    params={'limit': limit, 'offset': offset}
-)
-
-if response.status_code == 200:
-    data = response.json()
-    total = data.get('total', 0)
-    all_assets = data.get('rows', [])
-    
-    print(f"✅ Total assets in Snipe-IT: {total}")
-    print(f"✅ Assets retrieved: {len(all_assets)}\n")
-    
-    if total > 0:
-        print("Assets list:")
-        print("=" * 80)
-        for idx, asset in enumerate(all_assets, 1):
-            print(f"{idx}. Asset Tag: {asset.get('asset_tag')} | Name: {asset.get('name')} | Model: {asset.get('model', {}).get('name')}")
-        
-        # Check for AWS instances specifically
-        aws_instances = [a for a in all_assets if a.get('asset_tag', '').startswith('i-')]
-        print(f"\n✅ AWS EC2 Instances found: {len(aws_instances)}")
-        
-        if len(aws_instances) > 0:
-            print("\nFirst 5 AWS instances:")
-            for asset in aws_instances[:5]:
-                print(f"  - {asset.get('asset_tag')} | {asset.get('name')}")
-    else:
+from snipeit_client import ARCHIVED_STATUS_ID, SnipeITClient
+
+# APP_URL / APP_KEY are read from .env by the shared client
+client = SnipeITClient.from_env()
+
+
+def verify_assets(workers=8, list_assets=False):
+    """
+    Reads every page of the Snipe-IT hardware list and reports on it in one pass.
+
+    Pages after the first are fetched concurrently once the total is known,
+    and rows are consumed as they stream in, so only a handful of pages are
+    ever held in memory. Archived assets are counted separately, with one
+    status_id query. Returns the collected statistics.
+    """
+
+    stats = {
+        'total': 0,
+        'retrieved': 0,
+        'by_status': Counter(),
+        'aws_instances': 0,
+        'aws_by_status': Counter(),
+        'aws_sample': [],
+        'archived': 0,
+        'archived_listed': 0,
+    }
+
+    # Snipe-IT leaves archived assets out of the hardware list (unless
+    # show_archived_in_list is on), so they are counted with a query of their
+    # own, of which only the total is needed
+    stats['archived'] = client.get('hardware', {'status_id': ARCHIVED_STATUS_ID, 'limit': 1}).get('total', 0)
+
+    for page_number, page in enumerate(client.iter_pages('hardware', workers=workers)):
+        if page_number == 0:
+            stats['total'] = page.get('total', 0)
+
+        for asset in page.get('rows', []):
+            stats['retrieved'] += 1
+            status = (asset.get('status_label') or {}).get('name') or 'No status'
+            stats['by_status'][status] += 1
+            if (asset.get('status_label') or {}).get('id') == ARCHIVED_STATUS_ID:
+                stats['archived_listed'] += 1
+
+            if list_assets:
+                print(f"{stats['retrieved']}. Asset Tag: {asset.get('asset_tag')} | Name: {asset.get('name')} | Model: {(asset.get('model') or {}).get('name')}")
+
+            # Check for AWS instances specifically
+            if (asset.get('asset_tag') or '').startswith('i-'):
+                stats['aws_instances'] += 1
+                stats['aws_by_status'][status] += 1
+                if len(stats['aws_sample']) < 5:
+                    stats['aws_sample'].append(asset)
+
+    return stats
+
+
+def print_report(stats, elapsed):
+    # With show_archived_in_list on, the list already includes them
+    archived_unlisted = stats['archived'] if not stats['archived_listed'] else 0
+    print(f"✅ Total assets in Snipe-IT: {stats['total'] + archived_unlisted}")
+    print(f"✅ Assets retrieved: {stats['retrieved']} in {elapsed:.1f}s\n")
+
+    if stats['retrieved'] != stats['total']:
+        print(f"⚠️  Retrieved count differs from the reported total by {stats['total'] - stats['retrieved']} "
+              "(assets were probably added or removed while reading)\n")
+
+    if stats['total'] + archived_unlisted == 0:
         print("❌ No assets found in Snipe-IT!")
         print("\nPossible reasons:")
         print("1. Assets were created but with errors")
         print("2. Assets are in a different status")
         print("3. Database issue")
-else:
-    print(f"❌ Error: {response.status_code}")
-    print(response.text)
-
-# Check if there are archived assets
-print("\n" + "="*80)
-print("Checking for archived/pending assets...")
-for status_id in [1, 3]:  # Pending and Archived
-    response = requests.get(
-        f"{SNIPEIT_BASE_URL}/api/v1/hardware",
-        headers=headers,
-        params={'status_id': status_id}
-    )
-    if response.status_code == 200:
-        data = response.json()
-        count = data.get('total', 0)
-        status_name = "Pending" if status_id == 1 else "Archived"
-        if count > 0:
-            print(f"  Found {count} assets with status: {status_name}")
\ No newline at end of file
+        return
+
+    print("Assets by status:")
+    print("=" * 80)
+    for status, count in stats['by_status'].most_common():
+        print(f"  {status}: {count}")
+    if archived_unlisted:
+        print(f"  Archived (not in the hardware list, not read): {archived_unlisted}")
+
+    print(f"\n✅ AWS EC2 Instances found: {stats['aws_instances']}")
+    for status, count in stats['aws_by_status'].most_common():
+        print(f"  {status}: {count}")
+
+    if stats['aws_sample']:
+        print("\nFirst 5 AWS instances:")
+        for asset in stats['aws_sample']:
+            print(f"  - {asset.get('asset_tag')} | {asset.get('name')}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Verify the assets stored in Snipe-IT.")
+    parser.add_argument('--workers', type=int, default=8, help="concurrent page fetches (default: 8)")
+    parser.add_argument('--list', action='store_true', help="print every asset as it is read")
+    args = parser.parse_args(argv)
+
+    print("Checking all assets in Snipe-IT...\n")
+
+    started = time.monotonic()
+    try:
+        stats = verify_assets(workers=args.workers, list_assets=args.list)
+    except requests.exceptions.HTTPError as e:
+        print(f"❌ Error: {e.response.status_code}")
+        print(e.response.text)
+        return 1
+    except requests.exceptions.RequestException as e:
+        print(f"❌ Error: {e}")
+        return 1
+
+    print_report(stats, time.monotonic() - started)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
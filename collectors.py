@@ -0,0 +1,176 @@
+import os
+from collections import namedtuple
+
+from field_mapping import FIELD_SPECS, RESOURCE_FIELD_SPECS, InstanceRecord, ResourceRecord
+from snipeit_metadata import SNIPEIT_MODEL_NAME
+
+# ==============================================================================
+# CONFIGURATION
+# ==============================================================================
+
+# Resource types to discover, comma-separated, out of COLLECTORS below. Each
+# type becomes its own Snipe-IT model (created by setup_snipeit.py) sharing
+# the EC2 fieldset; reconcile.py only ever looks at EC2.
+AWS_COLLECTORS = os.getenv("AWS_COLLECTORS", "ec2")
+
+# describe_instances page size (MaxResults); 1000 is the most EC2 allows
+EC2_PAGE_SIZE = int(os.getenv("EC2_PAGE_SIZE", "1000"))
+
+# ==============================================================================
+# COLLECTORS
+# ==============================================================================
+
+# One kind of AWS resource discovery knows how to list.
+#   name          - what AWS_COLLECTORS, metrics and the journal call it
+#   service       - boto3 service the listing goes to
+#   paginator     - boto3 paginator (operation) that lists the resources
+#   page_size     - PaginationConfig PageSize; the most the operation allows
+#   params        - callable(states, include_tags) -> extra paginate() arguments
+#   items         - callable(page) -> the resources in one page
+#   record        - callable(item, account_name, region_name) -> InstanceRecord or ResourceRecord
+#   model_name    - the Snipe-IT model its assets get
+#   specs         - the field specs its records can fill
+#   tag_filtering - 'server' if params() applies the include tag filters, 'client'
+#                   if they have to be checked on each record, None if the
+#                   listing returns no tags (no tag filtering at all)
+Collector = namedtuple('Collector', 'name service paginator page_size params items record model_name specs tag_filtering')
+
+
+def build_tag_filters(include_tags):
+    """Returns EC2-style Filters for the include tag filters (tag:Key for values, tag-key for any value)."""
+
+    filters = []
+    for key, values in include_tags:
+        if values:
+            filters.append({'Name': f'tag:{key}', 'Values': list(values)})
+        else:
+            filters.append({'Name': 'tag-key', 'Values': [key]})
+    return filters
+
+
+def build_ec2_filters(states, include_tags=()):
+    """Returns the describe_instances Filters for the given states and include tag filters."""
+
+    return [{'Name': 'instance-state-name', 'Values': list(states)}] + build_tag_filters(include_tags)
+
+
+def date_of(value):
+    """Formats a datetime (or an ISO 8601 string, as Lambda returns) as YYYY-MM-DD; None stays None."""
+
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return value[:10]
+    return value.strftime('%Y-%m-%d')
+
+
+def tag_dict(tags):
+    return {tag['Key']: tag['Value'] for tag in tags or ()}
+
+
+def volume_record(volume, account_name, region_name):
+    tags = tag_dict(volume.get('Tags'))
+    return ResourceRecord(
+        volume['VolumeId'], account_name, region_name,
+        name=tags.get('Name'),
+        instance_type=volume.get('VolumeType'),
+        state=volume.get('State'),
+        launch_date=date_of(volume.get('CreateTime')),
+        availability_zone=volume.get('AvailabilityZone'),
+        tags=tags,
+    )
+
+
+def db_instance_record(db_instance, account_name, region_name):
+    # DBInstanceIdentifier is only unique per account and region; DbiResourceId everywhere
+    return ResourceRecord(
+        db_instance['DbiResourceId'], account_name, region_name,
+        name=db_instance.get('DBInstanceIdentifier'),
+        instance_type=db_instance.get('DBInstanceClass'),
+        state=db_instance.get('DBInstanceStatus'),
+        launch_date=date_of(db_instance.get('InstanceCreateTime')),
+        private_dns_name=(db_instance.get('Endpoint') or {}).get('Address'),
+        vpc_id=(db_instance.get('DBSubnetGroup') or {}).get('VpcId'),
+        availability_zone=db_instance.get('AvailabilityZone'),
+        tags=tag_dict(db_instance.get('TagList')),
+    )
+
+
+def function_record(function, account_name, region_name):
+    return ResourceRecord(
+        function['FunctionArn'], account_name, region_name,
+        name=function.get('FunctionName'),
+        instance_type=function.get('Runtime') or function.get('PackageType'),
+        state=function.get('State'),
+        launch_date=date_of(function.get('LastModified')),
+        vpc_id=(function.get('VpcConfig') or {}).get('VpcId') or None,
+    )
+
+
+def load_balancer_record(load_balancer, account_name, region_name):
+    zones = [zone.get('ZoneName', '') for zone in load_balancer.get('AvailabilityZones') or ()]
+    return ResourceRecord(
+        load_balancer['LoadBalancerArn'], account_name, region_name,
+        name=load_balancer.get('LoadBalancerName'),
+        instance_type=load_balancer.get('Type'),
+        state=(load_balancer.get('State') or {}).get('Code'),
+        launch_date=date_of(load_balancer.get('CreatedTime')),
+        private_dns_name=load_balancer.get('DNSName'),
+        vpc_id=load_balancer.get('VpcId'),
+        availability_zone=', '.join(zones) or None,
+    )
+
+
+EC2 = Collector(
+    'ec2', 'ec2', 'describe_instances', EC2_PAGE_SIZE,
+    lambda states, include_tags: {'Filters': build_ec2_filters(states, include_tags)},
+    lambda page: (instance for reservation in page['Reservations'] for instance in reservation['Instances']),
+    InstanceRecord, SNIPEIT_MODEL_NAME, FIELD_SPECS, 'server',
+)
+
+# Volumes, databases, functions and load balancers are synced whatever their
+# state; states only applies to EC2 instances.
+EBS = Collector(
+    'ebs', 'ec2', 'describe_volumes', 500,
+    lambda states, include_tags: {'Filters': build_tag_filters(include_tags)},
+    lambda page: page['Volumes'],
+    volume_record, 'EBS Volume', RESOURCE_FIELD_SPECS, 'server',
+)
+
+RDS = Collector(
+    'rds', 'rds', 'describe_db_instances', 100,
+    lambda states, include_tags: {},
+    lambda page: page['DBInstances'],
+    db_instance_record, 'RDS DB Instance', RESOURCE_FIELD_SPECS, 'client',
+)
+
+LAMBDA = Collector(
+    'lambda', 'lambda', 'list_functions', 50,
+    lambda states, include_tags: {},
+    lambda page: page['Functions'],
+    function_record, 'Lambda Function', RESOURCE_FIELD_SPECS, None,
+)
+
+ELB = Collector(
+    'elb', 'elbv2', 'describe_load_balancers', 400,
+    lambda states, include_tags: {},
+    lambda page: page['LoadBalancers'],
+    load_balancer_record, 'Load Balancer', RESOURCE_FIELD_SPECS, None,
+)
+
+COLLECTORS = {collector.name: collector for collector in (EC2, EBS, RDS, LAMBDA, ELB)}
+
+
+def enabled_collectors(names=AWS_COLLECTORS):
+    """Returns the collectors named in a comma-separated list; raises ValueError for unknown names."""
+
+    selected = []
+    for name in names.split(','):
+        name = name.strip().lower()
+        if not name:
+            continue
+        if name not in COLLECTORS:
+            raise ValueError(f"Unknown collector '{name}' (known: {', '.join(COLLECTORS)})")
+        if COLLECTORS[name] not in selected:
+            selected.append(COLLECTORS[name])
+    return selected
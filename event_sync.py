@@ -0,0 +1,495 @@
+import argparse
+import calendar
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+import inventory
+from inventory import (
+    ARCHIVED_STATUS_ID,
+    AWS_ACCOUNTS,
+    AWS_DISCOVERY_WORKERS,
+    SNIPEIT_WRITE_WORKERS,
+    SYNC_INSTANCE_STATES,
+    configure_payload_builder,
+    create_or_update_snipeit_asset,
+    find_snipeit_asset_by_tag,
+    get_aws_client,
+    sync_asset,
+)
+from aws_accounts import load_accounts
+from field_mapping import InstanceRecord
+from log_config import LOG_FORMAT, LOG_LEVEL, configure_logging, fields
+from metrics import metrics, write_atomically, write_json
+from run_lock import RunLock, RunLockHeld
+from sync_state import SyncStateStore
+
+log = logging.getLogger('event_sync')
+
+# ==============================================================================
+# CONFIGURATION
+# ==============================================================================
+
+# Where EC2 Instance State-change Notification events come from: an SQS queue
+# (an EventBridge rule targeting it, directly or through SNS), or a local
+# JSON-lines spool file with one event per line.
+EVENT_SQS_QUEUE_URL = os.getenv("EVENT_SQS_QUEUE_URL", "")
+EVENT_SQS_PROFILE = os.getenv("EVENT_SQS_PROFILE", "")  # default: the default AWS credentials
+EVENT_SPOOL_PATH = os.getenv("EVENT_SPOOL_PATH", "")
+
+# Events are collected for EVENT_COALESCE_SECONDS after the first one arrives
+# (or until EVENT_MAX_BATCH of them), then reduced to the latest event per
+# instance, so a burst of pending -> running -> stopping -> stopped costs one
+# describe and at most one write.
+EVENT_COALESCE_SECONDS = float(os.getenv("EVENT_COALESCE_SECONDS", "5"))
+EVENT_MAX_BATCH = int(os.getenv("EVENT_MAX_BATCH", "1000"))
+EVENT_POLL_SECONDS = int(os.getenv("EVENT_POLL_SECONDS", "20"))  # SQS long-poll wait, at most 20
+
+# Instance IDs per describe_instances call; an instance-id filter takes at most 200 values
+EVENT_DESCRIBE_CHUNK = int(os.getenv("EVENT_DESCRIBE_CHUNK", "200"))
+
+# Each batch is processed under inventory.py's run lock (SYNC_LOCK_PATH), so it
+# never writes the same assets and state store as a full or sharded sync. While
+# a sync holds the lock, the batch waits, retrying every EVENT_LOCK_RETRY_SECONDS.
+# SQS may redeliver its messages meanwhile; applying an event twice is harmless.
+EVENT_LOCK_RETRY_SECONDS = float(os.getenv("EVENT_LOCK_RETRY_SECONDS", "10"))
+
+STATE_CHANGE_DETAIL_TYPE = 'EC2 Instance State-change Notification'
+
+# States that mean the instance is gone for good
+TERMINATED_STATES = {'shutting-down', 'terminated'}
+
+# ==============================================================================
+# EVENT SOURCES
+# ==============================================================================
+
+def parse_event(body):
+    """
+    Returns {'account_id', 'region', 'instance_id', 'state', 'time'} for a state-change event, else None.
+
+    body is the event as EventBridge delivers it, either as is or wrapped
+    in an SNS notification; anything else is not an event we handle.
+    """
+
+    try:
+        event = json.loads(body) if isinstance(body, str) else body
+        if event.get('Type') == 'Notification' and 'Message' in event:
+            event = json.loads(event['Message'])
+        if event.get('detail-type') != STATE_CHANGE_DETAIL_TYPE:
+            return None
+        detail = event['detail']
+        return {
+            'account_id': str(event['account']),
+            'region': event['region'],
+            'instance_id': detail['instance-id'],
+            'state': detail.get('state'),
+            'time': event.get('time') or '',
+        }
+    except (ValueError, TypeError, KeyError, AttributeError):
+        return None
+
+
+class SqsEventSource:
+    """
+    Long-polls an SQS queue. Messages are deleted once acknowledged; one that
+    is not (its sync failed) comes back after the queue's visibility timeout.
+    """
+
+    def __init__(self, queue_url, profile_name=None):
+        import boto3
+
+        match = re.match(r'https://sqs\.([a-z0-9-]+)\.', queue_url)
+        session = boto3.Session(profile_name=profile_name or None)
+        self.client = session.client('sqs', region_name=match.group(1) if match else None)
+        self.queue_url = queue_url
+
+    def receive(self, wait_seconds):
+        """Returns up to 10 messages as [(event or None, receipt handle)], waiting up to wait_seconds for one."""
+
+        response = self.client.receive_message(
+            QueueUrl=self.queue_url,
+            MaxNumberOfMessages=10,
+            WaitTimeSeconds=max(0, min(EVENT_POLL_SECONDS, int(wait_seconds))),
+        )
+        return [(parse_event(message['Body']), message['ReceiptHandle']) for message in response.get('Messages', ())]
+
+    def ack(self, handles):
+        handles = list(handles)
+        for start in range(0, len(handles), 10):
+            entries = [{'Id': str(number), 'ReceiptHandle': handle}
+                       for number, handle in enumerate(handles[start:start + 10])]
+            response = self.client.delete_message_batch(QueueUrl=self.queue_url, Entries=entries)
+            if response.get('Failed'):
+                log.warning("Could not delete %d message(s) from the queue; they will be processed again",
+                            len(response['Failed']))
+
+
+class SpoolEventSource:
+    """
+    Tails a JSON-lines spool file, e.g. written by a test harness or a log shipper.
+
+    How far it has been processed is kept in '<path>.offset'. Lines are
+    acknowledged in file order: the offset only moves past a line once it and
+    every line before it were acknowledged, so a failed event is read again
+    by the next run.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.offset_path = f"{path}.offset"
+        try:
+            with open(self.offset_path, encoding='utf-8') as handle:
+                self.committed = int(handle.read().strip() or 0)
+        except (OSError, ValueError):
+            self.committed = 0
+        self.position = self.committed
+        self.unacked = deque()  # line end offsets, in file order
+        self.acked = set()
+
+    def receive(self, wait_seconds):
+        messages = []
+        try:
+            with open(self.path, 'rb') as handle:
+                handle.seek(self.position)
+                for line in handle:
+                    if not line.endswith(b'\n'):
+                        break  # still being written
+                    self.position += len(line)
+                    self.unacked.append(self.position)
+                    messages.append((parse_event(line.decode('utf-8')) if line.strip() else None, self.position))
+                    if len(messages) >= EVENT_MAX_BATCH:
+                        break
+        except FileNotFoundError:
+            pass
+        if not messages and wait_seconds > 0:
+            time.sleep(min(wait_seconds, 1.0))
+        return messages
+
+    def ack(self, handles):
+        self.acked.update(handles)
+        while self.unacked and self.unacked[0] in self.acked:
+            self.committed = self.unacked.popleft()
+            self.acked.discard(self.committed)
+        write_atomically(self.offset_path, f"{self.committed}\n")
+
+# ==============================================================================
+# EVENT PROCESSING
+# ==============================================================================
+
+# AWS account ID -> entry of AWS_ACCOUNTS, filled on first use
+_accounts_by_id = {}
+_accounts_lock = threading.Lock()
+
+
+def account_for_id(account_id, accounts=AWS_ACCOUNTS):
+    """
+    Returns the AWS_ACCOUNTS entry for an account ID, or None.
+
+    Entries may carry their 'account_id'; for the others it is looked up once
+    with sts:GetCallerIdentity on their profile.
+    """
+
+    with _accounts_lock:
+        if not _accounts_by_id:
+            for account in accounts:
+                number = account.get('account_id')
+                if not number:
+                    try:
+                        sts = get_aws_client(account, account['default_region'] or 'us-east-1', 'sts')
+                        number = sts.get_caller_identity()['Account']
+                    except Exception as e:
+                        log.error("Could not read the account ID of profile '%s': %s", account['profile_name'], e)
+                        continue
+                _accounts_by_id[str(number)] = account
+        return _accounts_by_id.get(account_id)
+
+
+def collect_batch(source, window=EVENT_COALESCE_SECONDS, max_events=EVENT_MAX_BATCH):
+    """
+    Waits for messages, then keeps collecting for window seconds (or until max_events).
+
+    Returns [] if nothing arrived within one poll.
+    """
+
+    messages = []
+    deadline = None
+    while len(messages) < max_events:
+        wait_seconds = EVENT_POLL_SECONDS if deadline is None else deadline - time.monotonic()
+        if wait_seconds <= 0:
+            break
+        received = source.receive(wait_seconds)
+        if received:
+            messages.extend(received)
+            if deadline is None:
+                deadline = time.monotonic() + window
+        elif deadline is None:
+            break
+    return messages
+
+
+def coalesce(events):
+    """Keeps the latest event per (account, region, instance); returns {(account_id, region, instance_id): event}."""
+
+    latest = {}
+    for event in events:
+        key = (event['account_id'], event['region'], event['instance_id'])
+        if key not in latest or event['time'] >= latest[key]['time']:
+            latest[key] = event
+    return latest
+
+
+def describe_instances(account, region, instance_ids):
+    """
+    Returns {instance_id: InstanceRecord} for the given instances of one account and region.
+
+    Uses an instance-id filter rather than InstanceIds, so an instance that
+    no longer exists is simply missing instead of failing the whole call.
+    """
+
+    client = get_aws_client(account, region, 'ec2')
+    paginator = client.get_paginator('describe_instances')
+    records = {}
+    for start in range(0, len(instance_ids), EVENT_DESCRIBE_CHUNK):
+        chunk = instance_ids[start:start + EVENT_DESCRIBE_CHUNK]
+        with metrics.timer('aws_api_seconds', operation='DescribeInstances', region=region):
+            pages = list(paginator.paginate(Filters=[{'Name': 'instance-id', 'Values': chunk}]))
+        for page in pages:
+            for reservation in page['Reservations']:
+                for instance in reservation['Instances']:
+                    records[instance['InstanceId']] = InstanceRecord(instance, account['name'], region)
+    return records
+
+
+def archive_instance(instance_id, state):
+    """Moves a terminated instance's asset to ARCHIVED_STATUS_ID; returns (outcome, snipeit_id)."""
+
+    known = state.get(instance_id) if state is not None else None
+    snipeit_id = known['snipeit_id'] if known else find_snipeit_asset_by_tag(instance_id)
+    if not snipeit_id:
+        return 'absent', None
+    if not create_or_update_snipeit_asset({'status_id': ARCHIVED_STATUS_ID}, asset_id=snipeit_id, asset_tag=instance_id):
+        return 'failed', snipeit_id
+    if state is not None:
+        state.forget(instance_id)
+    return 'archived', snipeit_id
+
+
+def apply_change(record, event, state, archive_terminated):
+    """
+    Pushes one instance's latest state to Snipe-IT; returns its outcome.
+
+    record is what describe_instances says now (None if the instance is gone),
+    which wins over the event since it is more recent.
+    """
+
+    instance_id = event['instance_id']
+    current_state = record.state if record is not None else 'terminated'
+    if current_state in SYNC_INSTANCE_STATES:
+        payload, asset_tag = inventory.build_payload(record)
+        outcome, snipeit_id = sync_asset({'payload': payload, 'asset_tag': asset_tag}, lambda: None, state)
+    elif current_state in TERMINATED_STATES:
+        if not archive_terminated:
+            return 'terminated'
+        outcome, snipeit_id = archive_instance(instance_id, state)
+    else:
+        # pending / stopping: another event follows once it settles
+        return 'transient'
+
+    log.info("Instance is %s: %s", current_state, outcome,
+             extra=fields(asset_tag=instance_id, snipeit_id=snipeit_id, region=event['region']))
+    return outcome
+
+
+def process_batch(messages, state=None, archive_terminated=False, accounts=AWS_ACCOUNTS, describers=None,
+                  writers=None):
+    """
+    Coalesces a batch of messages, describes the affected instances and applies the deltas.
+
+    describers and writers are the thread pools to describe and write with;
+    run() passes the same ones for every batch, so their threads keep their
+    boto3 sessions and clients (see inventory.get_aws_client). Pools are
+    created for this batch only when they are not given.
+
+    Returns (outcomes, handles to acknowledge): every message is acknowledged
+    except those whose instance could not be synced, so they are retried.
+    """
+
+    events = [event for event, _ in messages if event is not None]
+    metrics.inc('events_received_total', len(messages))
+    metrics.inc('events_ignored_total', len(messages) - len(events))
+    changes = coalesce(events)
+    metrics.inc('events_coalesced_total', len(events) - len(changes))
+
+    now = time.time()
+    for event in changes.values():
+        lag = event_lag(event, now)
+        if lag is not None:
+            metrics.observe('event_lag_seconds', lag)
+
+    groups = {}
+    for (account_id, region, instance_id), event in changes.items():
+        groups.setdefault((account_id, region), []).append(event)
+
+    outcomes = {}
+
+    def describe(group):
+        (account_id, region), group_events = group
+        account = account_for_id(account_id, accounts)
+        if account is None:
+            log.warning("Ignoring %d event(s) from unknown account %s", len(group_events), account_id)
+            return [(event, None, 'unknown_account') for event in group_events]
+        try:
+            records = describe_instances(account, region, [event['instance_id'] for event in group_events])
+        except Exception as e:
+            log.error("Failed to describe instances: %s", e, extra=fields(account=account['name'], region=region))
+            return [(event, None, 'failed') for event in group_events]
+        return [(event, records.get(event['instance_id']), None) for event in group_events]
+
+    def apply(item):
+        event, record, outcome = item
+        if outcome is None:
+            try:
+                outcome = apply_change(record, event, state, archive_terminated)
+            except Exception:
+                log.exception("Unexpected error applying event", extra=fields(asset_tag=event['instance_id']))
+                outcome = 'failed'
+        metrics.inc('sync_assets_total', outcome=outcome)
+        return event, outcome
+
+    if describers is None or writers is None:
+        with ThreadPoolExecutor(max_workers=AWS_DISCOVERY_WORKERS) as describers, \
+                ThreadPoolExecutor(max_workers=SNIPEIT_WRITE_WORKERS) as writers:
+            return process_batch(messages, state, archive_terminated, accounts, describers, writers)
+
+    applied = [writers.submit(apply, item) for items in describers.map(describe, groups.items()) for item in items]
+    for future in applied:
+        event, outcome = future.result()
+        outcomes[(event['account_id'], event['region'], event['instance_id'])] = outcome
+
+    acknowledged = []
+    for event, handle in messages:
+        key = (event['account_id'], event['region'], event['instance_id']) if event is not None else None
+        if key is None or outcomes.get(key) != 'failed':
+            acknowledged.append(handle)
+    return outcomes, acknowledged
+
+
+def event_lag(event, now):
+    """Seconds between an event's time (ISO 8601, UTC) and now, or None if it has none."""
+
+    try:
+        return now - calendar.timegm(time.strptime(event['time'][:19], '%Y-%m-%dT%H:%M:%S'))
+    except (ValueError, TypeError):
+        return None
+
+# ==============================================================================
+# MAIN
+# ==============================================================================
+
+def run(source, state=None, once=False, archive_terminated=False, metrics_json='', prometheus_textfile='',
+        accounts=AWS_ACCOUNTS):
+    """
+    Processes batches until interrupted, or with once until the source has nothing more.
+
+    One pool of describer and one of writer threads serves every batch. Each
+    batch holds the run lock while it is processed; if a sync holds it, the
+    batch waits for it.
+    """
+
+    totals = {}
+    with ThreadPoolExecutor(max_workers=AWS_DISCOVERY_WORKERS) as describers, \
+            ThreadPoolExecutor(max_workers=SNIPEIT_WRITE_WORKERS) as writers:
+        while True:
+            messages = collect_batch(source)
+            if not messages:
+                if once:
+                    return totals
+                continue
+
+            started = time.monotonic()
+            while True:
+                try:
+                    with RunLock(), metrics.timer('event_batch_seconds'):
+                        outcomes, acknowledged = process_batch(messages, state, archive_terminated, accounts,
+                                                               describers, writers)
+                        if state is not None:
+                            state.commit()
+                    break
+                except RunLockHeld as e:
+                    log.info("Waiting for the sync to finish: %s", e)
+                    metrics.inc('event_lock_waits_total')
+                    time.sleep(EVENT_LOCK_RETRY_SECONDS)
+            source.ack(acknowledged)
+
+            counts = {}
+            for outcome in outcomes.values():
+                counts[outcome] = counts.get(outcome, 0) + 1
+                totals[outcome] = totals.get(outcome, 0) + 1
+            log.info("Processed %d event(s) for %d instance(s)", len(messages), len(outcomes),
+                     extra=fields(seconds=round(time.monotonic() - started, 3), **counts))
+
+            if metrics_json:
+                write_json(metrics_json, metrics.summary())
+            if prometheus_textfile:
+                write_atomically(prometheus_textfile, metrics.to_prometheus())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sync EC2 instances into Snipe-IT as their state-change events arrive.")
+    parser.add_argument('--sqs-queue-url', default=EVENT_SQS_QUEUE_URL, metavar='URL',
+                        help="SQS queue receiving EC2 Instance State-change Notification events")
+    parser.add_argument('--sqs-profile', default=EVENT_SQS_PROFILE, help="AWS profile to read the queue with")
+    parser.add_argument('--spool', default=EVENT_SPOOL_PATH, metavar='PATH',
+                        help="read events from this JSON-lines file instead of SQS")
+    parser.add_argument('--once', action='store_true', help="exit once no more events are waiting")
+    parser.add_argument('--archive-terminated', action='store_true',
+                        help=f"move the assets of terminated instances to status {ARCHIVED_STATUS_ID}")
+    parser.add_argument('--no-state', action='store_true', help="do not read or write the local sync-state cache")
+    parser.add_argument('--refresh-metadata', action='store_true',
+                        help="re-read custom fields and models from Snipe-IT instead of the local cache")
+    parser.add_argument('--metrics-json', default='', metavar='PATH', help="rewrite a metrics summary after each batch")
+    parser.add_argument('--prometheus-textfile', default='', metavar='PATH',
+                        help="rewrite the metrics in Prometheus text format after each batch")
+    parser.add_argument('--log-level', default=LOG_LEVEL, help=f"DEBUG, INFO, WARNING or ERROR (default: {LOG_LEVEL})")
+    parser.add_argument('--log-format', default=LOG_FORMAT, choices=('text', 'json'),
+                        help=f"log as plain text or one JSON object per line (default: {LOG_FORMAT})")
+    args = parser.parse_args(argv)
+    if bool(args.sqs_queue_url) == bool(args.spool):
+        parser.error("give exactly one of --sqs-queue-url and --spool")
+
+    configure_logging(args.log_level, args.log_format)
+    configure_payload_builder(refresh=args.refresh_metadata)
+    from botocore.exceptions import BotoCoreError, ClientError
+
+    try:
+        accounts = load_accounts(AWS_ACCOUNTS)
+    except (BotoCoreError, ClientError, ValueError) as e:
+        log.error("Could not load the AWS accounts: %s", e)
+        return 1
+    source = SpoolEventSource(args.spool) if args.spool else SqsEventSource(args.sqs_queue_url, args.sqs_profile)
+    state = None if args.no_state else SyncStateStore()
+
+    log.info("Waiting for EC2 state-change events")
+    try:
+        totals = run(source, state, once=args.once, archive_terminated=args.archive_terminated,
+                     metrics_json=args.metrics_json, prometheus_textfile=args.prometheus_textfile, accounts=accounts)
+    except KeyboardInterrupt:
+        totals = None
+    finally:
+        if state is not None:
+            state.close()
+
+    if totals is not None:
+        log.info("No more events", extra=fields(**totals))
+        return 1 if totals.get('failed') else 0
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,236 @@
+import re
+import unicodedata
+from collections import namedtuple
+from operator import attrgetter
+
+# ==============================================================================
+# FIELD SPECIFICATION
+# ==============================================================================
+
+# One entry per Snipe-IT custom field filled in from AWS.
+#   key      - the key used in CUSTOM_FIELD_MAP (inventory.py)
+#   name     - the custom field's name in Snipe-IT; its db column is derived from it
+#   element  - Snipe-IT form element, used when the field is created
+#   format   - Snipe-IT validation format, used when the field is created
+#   extract  - callable(InstanceRecord) -> value; see RESOURCE_FIELD_SPECS for ResourceRecord
+FieldSpec = namedtuple('FieldSpec', 'key name element format extract')
+
+
+class InstanceRecord:
+    """
+    The parts of a describe_instances entry the field spec reads, and nothing else.
+
+    boto3 returns a deep tree of dicts per instance (block devices, network
+    interfaces, CPU options, ...). Projecting it onto a slotted record as
+    soon as a page arrives lets that tree be freed with the page. The Tags
+    list is turned into a dict and the launch date formatted once here, no
+    matter how many fields use them. Attributes EC2 did not return are None.
+    """
+
+    __slots__ = (
+        'instance_id', 'instance_type', 'image_id', 'state', 'launch_date',
+        'private_ip', 'public_ip', 'private_dns_name', 'vpc_id', 'subnet_id',
+        'availability_zone', 'security_group_ids', 'mac_address', 'platform_details',
+        'architecture', 'root_device_type', 'virtualization_type', 'tags',
+        'account_name', 'region_name',
+    )
+
+    def __init__(self, instance, account_name, region_name):
+        get = instance.get
+        self.instance_id = get('InstanceId')
+        self.instance_type = get('InstanceType')
+        self.image_id = get('ImageId')
+        self.state = (get('State') or {}).get('Name')
+        launch_time = get('LaunchTime')
+        # Same as strftime('%Y-%m-%d'), at a quarter of the cost
+        self.launch_date = launch_time.date().isoformat() if launch_time else None
+        self.private_ip = get('PrivateIpAddress')
+        self.public_ip = get('PublicIpAddress')
+        self.private_dns_name = get('PrivateDnsName')
+        self.vpc_id = get('VpcId')
+        self.subnet_id = get('SubnetId')
+        self.availability_zone = (get('Placement') or {}).get('AvailabilityZone')
+        self.security_group_ids = tuple(sg.get('GroupId', '') for sg in get('SecurityGroups') or ())
+        network_interfaces = get('NetworkInterfaces')
+        self.mac_address = network_interfaces[0].get('MacAddress') if network_interfaces else None
+        self.platform_details = get('PlatformDetails')
+        self.architecture = get('Architecture')
+        self.root_device_type = get('RootDeviceType')
+        self.virtualization_type = get('VirtualizationType')
+        self.tags = {tag['Key']: tag['Value'] for tag in get('Tags') or ()}
+        self.account_name = account_name
+        self.region_name = region_name
+
+    @property
+    def asset_tag(self):
+        return self.instance_id
+
+    @property
+    def name(self):
+        return self.tags.get('Name')
+
+
+class ResourceRecord:
+    """
+    A non-EC2 resource (volume, database, function, load balancer) projected for the field spec.
+
+    Filled by the collectors in collectors.py. Attributes share InstanceRecord's
+    names where they mean the same thing, so the specs in RESOURCE_FIELD_SPECS
+    work on both: instance_type holds the resource's size or kind (volume type,
+    DB instance class, runtime, load balancer type) and private_dns_name its
+    endpoint. asset_tag is the resource's unique ID or ARN.
+    """
+
+    __slots__ = (
+        'asset_tag', 'name', 'instance_type', 'state', 'launch_date', 'private_dns_name',
+        'vpc_id', 'availability_zone', 'tags', 'account_name', 'region_name',
+    )
+
+    def __init__(self, asset_tag, account_name, region_name, name=None, instance_type=None, state=None,
+                 launch_date=None, private_dns_name=None, vpc_id=None, availability_zone=None, tags=None):
+        self.asset_tag = asset_tag
+        self.name = name
+        self.instance_type = instance_type
+        self.state = state
+        self.launch_date = launch_date
+        self.private_dns_name = private_dns_name
+        self.vpc_id = vpc_id
+        self.availability_zone = availability_zone
+        self.tags = tags or {}
+        self.account_name = account_name
+        self.region_name = region_name
+
+
+def attribute(name, default='N/A'):
+    """
+    Extractor for a record attribute, falling back to default when EC2 did not return it.
+
+    The compiled builder does not call it: it reads all such attributes with
+    one attrgetter, using the name and default set on the extractor.
+    """
+    def extract(record):
+        value = getattr(record, name)
+        return default if value is None else value
+    extract.attribute, extract.default = name, default
+    return extract
+
+def tag(key, default):
+    """Extractor for an instance tag, falling back to default when missing or empty."""
+    def extract(record):
+        return record.tags.get(key) or default
+    extract.tag, extract.default = key, default
+    return extract
+
+
+FIELD_SPECS = [
+    FieldSpec('instance_type', 'Instance Type', 'text', 'ANY', attribute('instance_type')),
+    FieldSpec('description', 'Description', 'textarea', 'ANY', tag('Description', 'No description')),
+    FieldSpec('private_ip', 'Private IP Address', 'text', 'IP', attribute('private_ip')),
+    FieldSpec('public_ip', 'Public IP Address', 'text', 'IP', attribute('public_ip')),
+    FieldSpec('platform', 'Platform', 'text', 'ANY', attribute('platform_details', 'Linux/UNIX')),
+    FieldSpec('vpc_id', 'VPC ID', 'text', 'ANY', attribute('vpc_id')),
+    FieldSpec('dns_name', 'DNS Name', 'text', 'ANY', attribute('private_dns_name')),
+    FieldSpec('mac_address', 'MAC Address', 'text', 'MAC', attribute('mac_address')),
+    FieldSpec('vendor_support_end', 'Vendor Support End Date', 'text', 'ANY', tag('SupportEnd', 'N/A')),
+    FieldSpec('criticity', 'Criticality', 'text', 'ANY', tag('Criticity', 'Medium')),
+    FieldSpec('asset_owner', 'Asset Owner', 'text', 'ANY', tag('Owner', 'Unassigned')),
+    FieldSpec('aws_region', 'AWS Region', 'text', 'ANY', attribute('region_name')),
+    FieldSpec('aws_account', 'AWS Account', 'text', 'ANY', attribute('account_name')),
+    FieldSpec('availability_zone', 'Availability Zone', 'text', 'ANY', attribute('availability_zone')),
+    FieldSpec('subnet_id', 'Subnet ID', 'text', 'ANY', attribute('subnet_id')),
+    FieldSpec('security_groups', 'Security Groups', 'textarea', 'ANY', lambda record: ', '.join(record.security_group_ids)),
+    FieldSpec('instance_state', 'Instance State', 'text', 'ANY', attribute('state', 'unknown')),
+    FieldSpec('launch_time', 'Launch Time', 'text', 'ANY', attribute('launch_date')),
+    FieldSpec('ami_id', 'AMI ID', 'text', 'ANY', attribute('image_id')),
+    FieldSpec('architecture', 'Architecture', 'text', 'ANY', attribute('architecture')),
+    FieldSpec('root_device_type', 'Root Device Type', 'text', 'ANY', attribute('root_device_type')),
+    FieldSpec('virtualization_type', 'Virtualization Type', 'text', 'ANY', attribute('virtualization_type')),
+]
+
+# The specs whose extractors only read attributes ResourceRecord has as well
+RESOURCE_FIELD_KEYS = {
+    'instance_type', 'description', 'vpc_id', 'dns_name', 'vendor_support_end', 'criticity', 'asset_owner',
+    'aws_region', 'aws_account', 'availability_zone', 'instance_state', 'launch_time',
+}
+RESOURCE_FIELD_SPECS = [spec for spec in FIELD_SPECS if spec.key in RESOURCE_FIELD_KEYS]
+
+# ==============================================================================
+# COMPILATION
+# ==============================================================================
+
+def snipeit_db_column(field_name, field_id):
+    """
+    Returns the assets-table column Snipe-IT uses for a custom field.
+
+    Mirrors CustomField::convertUnicodeDbSlug(): '_snipeit_' plus the slugged
+    name, truncated to 50 characters, plus '_' and the field ID.
+    """
+
+    ascii_name = unicodedata.normalize('NFKD', field_name).encode('ascii', 'ignore').decode('ascii')
+    slug = re.sub(r'[^a-z0-9]+', '_', ascii_name.lower()).strip('_')
+    return f"{('_snipeit_' + slug)[:50]}_{field_id}"
+
+
+def compile_payload_builder(field_ids, status_id, model_id, field_columns=None, specs=FIELD_SPECS):
+    """
+    Compiles the field spec into a function building a Snipe-IT payload from an AWS resource.
+
+    field_ids maps spec keys to custom field IDs (CUSTOM_FIELD_MAP); specs
+    without an ID are left out. field_columns optionally gives the db column
+    per key when it is known from Snipe-IT; otherwise it is derived from the
+    field name and ID. The returned build(record) takes an InstanceRecord
+    (or a ResourceRecord, with specs=RESOURCE_FIELD_SPECS) and returns
+    (payload, asset_tag). Fields extracted with attribute() are read together
+    with the core asset fields by a single attrgetter, and their defaults
+    filled in only when some are missing; tag() fields are looked up in the
+    tags dict inline. Only the remaining extractors are called.
+    """
+
+    field_columns = field_columns or {}
+    columns, attributes, tags, extractors = [], [], [], []
+    for spec in specs:
+        field_id = field_ids.get(spec.key)
+        if field_id is None:
+            continue
+        column = field_columns.get(spec.key) or snipeit_db_column(spec.name, field_id)
+        columns.append(column)
+        if hasattr(spec.extract, 'attribute'):
+            attributes.append((column, spec.extract.attribute, spec.extract.default))
+        elif hasattr(spec.extract, 'tag'):
+            tags.append((column, spec.extract.tag, spec.extract.default))
+        else:
+            extractors.append((column, spec.extract))
+
+    read = attrgetter('asset_tag', 'name', 'launch_date', 'account_name', 'region_name', 'tags',
+                      *(name for _, name, _ in attributes))
+    attribute_columns = tuple(column for column, _, _ in attributes)
+    defaults = tuple(default for _, _, default in attributes)
+    tags = tuple(tags)
+    extractors = tuple(extractors)
+
+    def build(record):
+        asset_tag, name, launch_date, account_name, region_name, record_tags, *values = read(record)
+        payload = {
+            'asset_tag': asset_tag,
+            'serial': asset_tag,
+            'name': name or asset_tag,
+            'status_id': status_id,
+            'model_id': model_id,
+            'purchase_date': launch_date,
+            'notes': f"AWS Account: {account_name}, Region: {region_name}",
+        }
+        payload.update(zip(attribute_columns, values))
+        # Usually only one or two are missing (e.g. the public IP): find them in C
+        index = -1
+        for _ in range(values.count(None)):
+            index = values.index(None, index + 1)
+            payload[attribute_columns[index]] = defaults[index]
+        for column, key, default in tags:
+            payload[column] = record_tags.get(key) or default
+        for column, extract in extractors:
+            payload[column] = extract(record)
+        return payload, asset_tag
+
+    # The custom field columns it fills, in spec order, e.g. for the bulk loader's CSV header
+    build.columns = tuple(columns)
+    return build
@@ -1,40 +1,142 @@
-import boto3
+import argparse
 import requests
 import json
-from botocore.exceptions import ClientError
-from time import sleep
+import hashlib
+import html
+import logging
+import multiprocessing
+import queue
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from dotenv import load_dotenv
 import os
 
+from aws_accounts import account_session, load_accounts
+from collectors import AWS_COLLECTORS, COLLECTORS, EC2, EC2_PAGE_SIZE, enabled_collectors
+from field_mapping import InstanceRecord, compile_payload_builder
+from log_config import LOG_FORMAT, LOG_LEVEL, configure_logging, fields
+from metrics import metrics, write_atomically, write_json
+from rate_limiter import SharedRateLimiter
+from run_lock import RunLock, RunLockHeld
+from snipeit_client import ARCHIVED_STATUS_ID, SnipeITClient
+from snipeit_import import BulkLoader
+from snipeit_metadata import resolve_snipeit_ids
+from snapshot import SYNC_SNAPSHOT_PATH, SnapshotWriter, merge_snapshots, read_snapshot, restore_record, variant_path
+from sync_journal import SYNC_JOURNAL_PATH, SyncJournal, load_journal
+from sync_state import SyncStateStore, payload_fingerprint
+
 # Load environment variables from .env file
 load_dotenv()
 
+log = logging.getLogger('inventory')
+
 # ==============================================================================
 # 1. CONFIGURATION (MANDATORY)
 # ==============================================================================
 
 # Snipe-IT API Settings
-SNIPEIT_API_URL = os.getenv("APP_URL", "https://your-snipeit-domain.com") + "/api/v1/hardware"
-SNIPEIT_API_KEY = os.getenv("APP_KEY", "YourSnipeITApiTokenHere")
-SNIPEIT_HEADERS = {
-    'Authorization': f'Bearer {SNIPEIT_API_KEY}',
-    'Accept': 'application/json',
-    'Content-Type': 'application/json'
-}
+# APP_URL / APP_KEY and the connection settings are read by snipeit_client.py.
+# One pooled client is shared by every thread of the run.
+snipeit = SnipeITClient.from_env()
+
+# Bulk pre-fetch of the Snipe-IT hardware list. When enabled, the whole list is
+# read once (in parallel pages) and every existing-or-new decision is made from
+# an in-memory index instead of one search request per instance.
+SNIPEIT_BULK_PREFETCH = os.getenv("SNIPEIT_BULK_PREFETCH", "true").lower() in ("1", "true", "yes")
+SNIPEIT_PREFETCH_WORKERS = int(os.getenv("SNIPEIT_PREFETCH_WORKERS", "4"))
 
 # AWS Account Settings
-# Use AWS Profile names configured in your ~/.aws/credentials file.
+# Use AWS Profile names configured in your ~/.aws/credentials file. An entry
+# with a 'role_arn' assumes that role instead (see aws_accounts.py), and with
+# AWS_ACCOUNT_SOURCE=organizations this list is replaced by the accounts of
+# the AWS Organization.
+# event_sync.py matches events to accounts by their 'account_id', which is
+# looked up with sts:GetCallerIdentity when an entry does not set one.
 AWS_ACCOUNTS = [
     {'name': 'Account 1 - Internal', 'profile_name': 'profile1', 'default_region': 'eu-south-1'},
     {'name': 'Account 2 - Customers', 'profile_name': 'profile2', 'default_region': 'eu-south-1'},
 ]
 
+# Discovery concurrency. Every (account, region, collector) scan runs on one
+# shared thread pool; each account is additionally capped so a single account
+# cannot trip its own API throttling. Set 'max_concurrency' on an account entry
+# to override the per-account default.
+AWS_DISCOVERY_WORKERS = int(os.getenv("AWS_DISCOVERY_WORKERS", "16"))
+AWS_MAX_WORKERS_PER_ACCOUNT = int(os.getenv("AWS_MAX_WORKERS_PER_ACCOUNT", "4"))
+
+# Streaming pipeline between discovery and Snipe-IT writes. Discovered assets
+# flow through a bounded queue (backpressure) to a pool of writer threads.
+SNIPEIT_WRITE_WORKERS = int(os.getenv("SNIPEIT_WRITE_WORKERS", "4"))
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "1000"))
+
+# Sharded runs (--shards). Each shard is a process of its own, with its own
+# Snipe-IT connection pool, discovering its share of the (account, region,
+# collector) scans and writing the assets whose asset_tag hashes to it; they
+# share one SNIPEIT_MAX_RPS budget. Discovered assets travel between shards
+# in batches, at most SHARD_QUEUE_BATCHES waiting per shard.
+SYNC_SHARDS = int(os.getenv("SYNC_SHARDS", "1"))
+SHARD_QUEUE_BATCHES = int(os.getenv("SHARD_QUEUE_BATCHES", "16"))
+
+# End-of-run metrics: a JSON summary (latency percentiles per phase and
+# endpoint, outcome counts, per-region breakdown) and, if a path is set, a
+# Prometheus textfile for node_exporter's textfile collector.
+SYNC_METRICS_JSON = os.getenv("SYNC_METRICS_JSON", ".sync_metrics.json")
+SYNC_PROMETHEUS_TEXTFILE = os.getenv("SYNC_PROMETHEUS_TEXTFILE", "")
+
+# Custom field IDs and db columns, and the model IDs, are looked up by name
+# in Snipe-IT at startup (cached locally, see snipeit_metadata.py). The IDs
+# below and CUSTOM_FIELD_MAP are only used when this is turned off or
+# Snipe-IT's metadata cannot be read.
+SNIPEIT_AUTO_RESOLVE = os.getenv("SNIPEIT_AUTO_RESOLVE", "true").lower() in ("1", "true", "yes")
+
 # Snipe-IT IDs for Categories, Models, and Statuses
 # You MUST retrieve these numerical IDs from your Snipe-IT Admin interface.
 # The script assumes you have an Asset Model set up for AWS EC2 instances.
 DEFAULT_CATEGORY_ID = 2  # Cloud Infrastructure
 DEFAULT_MODEL_ID = 1     # EC2 Instance
 DEFAULT_STATUS_ID = 2    # Ready to Deploy
+# ARCHIVED_STATUS_ID, for terminated instances, is set in snipeit_client.py
+
+# Model IDs of the other resource types (see collectors.py), only used when
+# auto-resolution is off; a collector without a model ID cannot be synced.
+RESOURCE_MODEL_IDS = {
+    'ebs': None,     # EBS Volume
+    'rds': None,     # RDS DB Instance
+    'lambda': None,  # Lambda Function
+    'elb': None,     # Load Balancer
+}
+
+# Instance states that are synced, and the states that count as "still exists"
+# when reconciling Snipe-IT against EC2 (anything else has been terminated).
+SYNC_INSTANCE_STATES = ['running', 'stopped']
+LIVE_INSTANCE_STATES = ['pending', 'running', 'stopping', 'stopped']
+
+# Which resource types are discovered (AWS_COLLECTORS) and their page sizes
+# (EC2_PAGE_SIZE for describe_instances) are configured in collectors.py.
+
+# Optional tag filters, as 'Key=Value1|Value2;OtherKey'. A key without values
+# matches any value. Resources must match every include filter; EC2 instances
+# and EBS volumes are filtered by EC2 itself, RDS instances once listed.
+# Resources matching any exclude filter are dropped after the page arrives,
+# since EC2 filters cannot be negated. Lambda functions and load balancers are
+# listed without their tags, so tag filters do not apply to them.
+EC2_INCLUDE_TAGS = os.getenv("EC2_INCLUDE_TAGS", "")
+EC2_EXCLUDE_TAGS = os.getenv("EC2_EXCLUDE_TAGS", "")
+
+# Region pruning, using the sync-state store. Each account's region list is
+# cached for REGION_LIST_TTL. A region whose last REGION_EMPTY_RUNS scans found
+# nothing is skipped, and only rescanned once REGION_RECHECK_INTERVAL has passed
+# since its last scan (or on --all-regions).
+REGION_LIST_TTL = int(os.getenv("REGION_LIST_TTL", str(7 * 24 * 3600)))  # seconds
+REGION_EMPTY_RUNS = int(os.getenv("REGION_EMPTY_RUNS", "3"))
+REGION_RECHECK_INTERVAL = int(os.getenv("REGION_RECHECK_INTERVAL", str(24 * 3600)))  # seconds
+
+# Regions scanned when describe_regions fails (comma-separated)
+AWS_FALLBACK_REGIONS = [region.strip() for region in os.getenv(
+    "AWS_FALLBACK_REGIONS", "us-east-1,us-west-2,eu-west-1,eu-central-1,ap-southeast-1").split(',') if region.strip()]
 
 # ==============================================================================
 # 2. CUSTOM FIELD MAPPING (MANDATORY)
@@ -44,6 +146,8 @@ DEFAULT_STATUS_ID = 2    # Ready to Deploy
 # Custom Field ID in Snipe-IT (Values).
 # You MUST replace the placeholder numbers (e.g., 999) with the actual ID
 # of your custom fields in Snipe-IT.
+# What each key is filled with, and the Snipe-IT field name its db column is
+# derived from, is declared in field_mapping.FIELD_SPECS.
 CUSTOM_FIELD_MAP = {
     'instance_type': 3,
     'description': 4,
@@ -69,160 +173,475 @@ CUSTOM_FIELD_MAP = {
     'virtualization_type': 27,
 }
 
+def compile_payload_builders(field_ids, model_ids, field_columns=None):
+    """Compiles one payload builder per collector that has a model ID in model_ids (collector name -> ID)."""
+
+    return {
+        name: compile_payload_builder(field_ids, DEFAULT_STATUS_ID, model_id, field_columns=field_columns,
+                                      specs=COLLECTORS[name].specs)
+        for name, model_id in model_ids.items() if model_id is not None
+    }
+
+# Compiled once at startup into flat lists of (column, extractor) pairs;
+# recompiled by configure_payload_builder() with the IDs resolved from Snipe-IT
+payload_builders = compile_payload_builders(CUSTOM_FIELD_MAP, dict(RESOURCE_MODEL_IDS, ec2=DEFAULT_MODEL_ID))
+build_payload = payload_builders['ec2']
+
 # ==============================================================================
 # 3. CORE FUNCTIONS
 # ==============================================================================
 
-def get_tag_value(tags, key):
-    """Helper function to safely extract a value from the AWS Tags list."""
-    if tags:
-        for tag in tags:
-            if tag['Key'] == key:
-                return tag['Value']
-    return None
+# Per-thread boto3 sessions and clients (see get_aws_client)
+_thread_local = threading.local()
+
+def configure_payload_builder(refresh=False):
+    """
+    Recompiles the payload builders with the field IDs, db columns and model IDs resolved from Snipe-IT.
+
+    Keeps the static CUSTOM_FIELD_MAP / DEFAULT_MODEL_ID / RESOURCE_MODEL_IDS
+    builders when auto-resolution is off, Snipe-IT cannot be read, or none of
+    the fields exist there yet. Pass refresh=True to bypass the local metadata
+    cache.
+    """
+
+    global build_payload, payload_builders
+
+    if not SNIPEIT_AUTO_RESOLVE:
+        return
+
+    model_names = [collector.model_name for collector in COLLECTORS.values()]
+    try:
+        resolved = resolve_snipeit_ids(snipeit, refresh=refresh, model_names=model_names)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        log.error("Failed to read Snipe-IT metadata, using CUSTOM_FIELD_MAP: %s", e)
+        return
+
+    if not resolved['field_ids']:
+        log.warning("None of the custom fields exist in Snipe-IT, using CUSTOM_FIELD_MAP (run setup_snipeit.py)")
+        return
+    if resolved['missing_fields']:
+        log.warning("Custom fields not in Snipe-IT are left out of payloads: %s", ', '.join(resolved['missing_fields']))
+
+    model_ids = {}
+    for name, collector in COLLECTORS.items():
+        model_ids[name] = resolved['model_ids'].get(collector.model_name)
+        if model_ids[name] is None:
+            model_ids[name] = DEFAULT_MODEL_ID if collector is EC2 else RESOURCE_MODEL_IDS.get(name)
+            if collector is EC2:
+                log.warning("EC2 model not found in Snipe-IT, using DEFAULT_MODEL_ID (%s)", DEFAULT_MODEL_ID)
+
+    log.info("Resolved %d custom fields and model ID %s from Snipe-IT", len(resolved['field_ids']), model_ids['ec2'])
+    payload_builders = compile_payload_builders(resolved['field_ids'], model_ids,
+                                                field_columns=resolved['field_columns'])
+    build_payload = payload_builders['ec2']
+
+def payload_columns():
+    """Returns every custom field column the payload builders fill, in a stable order."""
+
+    columns = []
+    for build in payload_builders.values():
+        columns.extend(column for column in build.columns if column not in columns)
+    return columns
 
 def process_aws_instance(instance, account_name, region_name):
     """Extracts and formats key data points from a single AWS EC2 instance."""
     
-    instance_id = instance.get('InstanceId')
-    asset_tag = instance_id
-    tags = instance.get('Tags', [])
-    instance_name = get_tag_value(tags, 'Name') or asset_tag
-    
-    # Determine OS platform
-    platform_details = instance.get('PlatformDetails', 'Linux/UNIX')
-    
-    # Get launch time
-    launch_time = instance.get('LaunchTime').strftime('%Y-%m-%d') if instance.get('LaunchTime') else None
-    
-    # Get security groups
-    security_groups = ', '.join([sg.get('GroupId', '') for sg in instance.get('SecurityGroups', [])])
-    
-    # Get network interface details
-    network_interfaces = instance.get('NetworkInterfaces', [])
-    mac_address = network_interfaces[0].get('MacAddress', 'N/A') if network_interfaces else 'N/A'
-    
-    # Map AWS data to Snipe-IT structure - CORRECT FORMAT
-    snipeit_payload = {
-        'asset_tag': asset_tag,
-        'serial': asset_tag,
-        'name': instance_name,
-        'status_id': DEFAULT_STATUS_ID,
-        'model_id': DEFAULT_MODEL_ID,
-        'purchase_date': launch_time,
-        'notes': f"AWS Account: {account_name}, Region: {region_name}",
-        
-        # Custom Fields using the _snipeit_fieldname_ID format
-        '_snipeit_instance_type_3': instance.get('InstanceType', 'N/A'),
-        '_snipeit_description_4': get_tag_value(tags, 'Description') or 'No description',
-        '_snipeit_private_ip_address_13': instance.get('PrivateIpAddress', 'N/A'),
-        '_snipeit_public_ip_address_14': instance.get('PublicIpAddress', 'N/A'),
-        '_snipeit_platform_7': platform_details,
-        '_snipeit_vpc_id_8': instance.get('VpcId', 'N/A'),
-        '_snipeit_dns_name_9': instance.get('PrivateDnsName', 'N/A'),
-        '_snipeit_mac_address_1': mac_address,
-        '_snipeit_vendor_support_end_date_15': get_tag_value(tags, 'SupportEnd') or 'N/A',
-        '_snipeit_criticality_16': get_tag_value(tags, 'Criticity') or 'Medium',
-        '_snipeit_asset_owner_12': get_tag_value(tags, 'Owner') or 'Unassigned',
-        '_snipeit_aws_region_17': region_name,
-        '_snipeit_aws_account_18': account_name,
-        '_snipeit_availability_zone_19': instance.get('Placement', {}).get('AvailabilityZone', 'N/A'),
-        '_snipeit_subnet_id_20': instance.get('SubnetId', 'N/A'),
-        '_snipeit_security_groups_21': security_groups,
-        '_snipeit_instance_state_22': instance.get('State', {}).get('Name', 'unknown'),
-        '_snipeit_launch_time_23': launch_time or 'N/A',
-        '_snipeit_ami_id_24': instance.get('ImageId', 'N/A'),
-        '_snipeit_architecture_25': instance.get('Architecture', 'N/A'),
-        '_snipeit_root_device_type_26': instance.get('RootDeviceType', 'N/A'),
-        '_snipeit_virtualization_type_27': instance.get('VirtualizationType', 'N/A'),
-    }
-    
-    return snipeit_payload, asset_tag
-    
+    return build_payload(InstanceRecord(instance, account_name, region_name))
 
+def parse_tag_filters(spec):
+    """Parses 'Key=Value1|Value2;OtherKey' into [(key, values)], values being () for "any value"."""
 
-def get_aws_assets(account_profile):
-    """Connects to AWS account and retrieves EC2 instance data across all regions."""
+    filters = []
+    for item in spec.split(';'):
+        key, _, values = item.partition('=')
+        if key.strip():
+            filters.append((key.strip(), tuple(value.strip() for value in values.split('|') if value.strip())))
+    return filters
+
+def is_excluded(tags, exclude_tags):
+    """Tells whether a resource's tags (a dict) match any of the exclude tag filters."""
+
+    for key, values in exclude_tags:
+        if key in tags and (not values or tags[key] in values):
+            return True
+    return False
+
+def is_included(tags, include_tags):
+    """Tells whether a resource's tags match every include tag filter, for services that cannot filter on tags."""
+
+    for key, values in include_tags:
+        if key not in tags or (values and tags[key] not in values):
+            return False
+    return True
+
+def get_aws_client(account_profile, region, service='ec2'):
+    """
+    Returns a boto3 client for the calling worker thread.
+
+    boto3 Sessions are not thread-safe, so every worker thread keeps its own
+    Session per account (see aws_accounts.account_session) and its own client
+    per (service, region), created on first use and shared by every collector
+    using that service.
+    """
+
+    clients = getattr(_thread_local, 'clients', None)
+    if clients is None:
+        clients = _thread_local.clients = {}
+        _thread_local.sessions = {}
+
+    profile_name = account_profile['profile_name']
+    key = (profile_name, service, region)
+    if key not in clients:
+        session = _thread_local.sessions.get(profile_name)
+        if session is None:
+            session = _thread_local.sessions[profile_name] = account_session(account_profile)
+        clients[key] = session.client(service, region_name=region)
+    return clients[key]
+
+def get_ec2_client(account_profile, region):
+    """Returns an EC2 client for the calling worker thread (see get_aws_client)."""
+
+    return get_aws_client(account_profile, region, 'ec2')
+
+def get_account_regions(account_profile, failures=None, state=None):
+    """
+    Returns the EC2 regions to scan for an account, or an empty list if it has no credentials.
+
+    Anything that makes the account's discovery incomplete (no credentials,
+    errors, falling back to the fixed region list) is appended to failures.
+    With a state store, the list from describe_regions is cached for
+    REGION_LIST_TTL.
+    """
+
+    from botocore.exceptions import ClientError
     
-    print(f"\n--- Starting discovery for {account_profile['name']} ---")
-    all_assets = []
+    account = fields(account=account_profile['name'])
+    log.info("Starting discovery", extra=account)
     
     try:
-        # Create session with profile
-        session = boto3.Session(profile_name=account_profile['profile_name'])
-        
-        # Check if session has credentials
-        credentials = session.get_credentials()
+        # Check if the account has credentials at all before fanning out
+        credentials = account_session(account_profile).get_credentials()
         if not credentials:
-            print(f"  [ERROR] No credentials found for profile '{account_profile['profile_name']}'")
-            return all_assets
+            log.error("No credentials found for profile '%s'", account_profile['profile_name'], extra=account)
+            _record_failure(failures, account_profile, None, 'no credentials')
+            return []
+        
+        if state is not None:
+            regions = state.region_list(account_profile['profile_name'], REGION_LIST_TTL)
+            if regions:
+                log.info("Using cached list of %d regions", len(regions), extra=account)
+                return regions
         
         # Get available regions - explicitly set region for this call
-        # Try to get region from session, otherwise default to us-east-1
         default_region = account_profile['default_region'] or 'eu-south-1'
-        print(f"  Using default region: {default_region}")
+        log.debug("Using default region: %s", default_region, extra=account)
         
-        ec2_client = session.client('ec2', region_name=default_region)
+        ec2_client = get_ec2_client(account_profile, default_region)
         
         # Get all regions where EC2 is available
         try:
-            regions_response = ec2_client.describe_regions()
+            with metrics.timer('aws_api_seconds', operation='DescribeRegions'):
+                regions_response = ec2_client.describe_regions()
             regions = [region['RegionName'] for region in regions_response['Regions']]
-            print(f"  Found {len(regions)} regions to scan")
+            log.info("Found %d regions to scan", len(regions), extra=account)
+            if state is not None:
+                state.record_region_list(account_profile['profile_name'], regions)
         except Exception as e:
-            print(f"  [ERROR] Failed to retrieve regions: {e}")
+            log.error("Failed to retrieve regions: %s", e, extra=account)
             # Fallback to common regions if describe_regions fails
-            regions = ['us-east-1', 'us-west-2', 'eu-west-1', 'eu-central-1', 'ap-southeast-1']
-            print(f"  Using fallback regions: {regions}")
+            regions = list(AWS_FALLBACK_REGIONS)
+            log.warning("Using fallback regions: %s", ', '.join(regions), extra=account)
+            _record_failure(failures, account_profile, None, f'describe_regions failed: {e}')
         
-        for region in regions:
-            print(f"  -> Scanning region: {region}")
-            try:
-                ec2_regional_client = session.client('ec2', region_name=region)
-                paginator = ec2_regional_client.get_paginator('describe_instances')
-                
-                # Use paginator to handle large number of instances
-                pages = paginator.paginate(
-                    Filters=[{'Name': 'instance-state-name', 'Values': ['running', 'stopped']}]
-                )
-                
-                instance_count = 0
-                for page in pages:
-                    for reservation in page['Reservations']:
-                        for instance in reservation['Instances']:
-                            # Skip terminated instances
-                            if instance['State']['Name'] not in ['terminated', 'shutting-down']:
-                                asset_data, asset_tag = process_aws_instance(instance, account_profile['name'], region)
-                                all_assets.append({'payload': asset_data, 'asset_tag': asset_tag})
-                                instance_count += 1
-                
-                if instance_count > 0:
-                    print(f"     Found {instance_count} instances")
-                    
-            except ClientError as e:
-                print(f"  [ERROR] Failed to scan region {region}: {e}")
-            except Exception as e:
-                print(f"  [ERROR] Unexpected error in region {region}: {e}")
-                            
+        return regions
+    
+    except ClientError as e:
+        log.error("AWS API call failed: %s", e, extra=account)
+        _record_failure(failures, account_profile, None, str(e))
+    except Exception as e:
+        log.error("Unexpected error: %s", e, extra=account)
+        _record_failure(failures, account_profile, None, str(e))
+    
+    return []
+
+def _record_failure(failures, account_profile, region, error):
+    if failures is not None:
+        failures.append({'account': account_profile['name'], 'region': region, 'error': error})
+
+def scan_region(account_profile, region, emit, states=SYNC_INSTANCE_STATES, failures=None, state=None,
+                collector=EC2, snapshot=None, on_record=None):
+    """
+    Streams one collector's resources (EC2 instances by default) of one account in one region.
+
+    Each paginator page is processed and handed to emit() as a list of
+    assets as soon as it arrives. Returns the number of resources found;
+    a failed scan is appended to failures. A completed scan is recorded in
+    the state store's region activity, if one is given, and every record
+    emitted is added to snapshot (a SnapshotWriter), if one is given, and
+    passed to on_record(collector name, record), if given.
+    """
+
+    from botocore.exceptions import ClientError
+    
+    resource_count = 0
+    account_name = account_profile['name']
+    labels = {'account': account_name, 'region': region, 'collector': collector.name}
+    include_tags = parse_tag_filters(EC2_INCLUDE_TAGS) if collector.tag_filtering else ()
+    exclude_tags = parse_tag_filters(EC2_EXCLUDE_TAGS) if collector.tag_filtering else ()
+    client_include_tags = include_tags if collector.tag_filtering == 'client' else ()
+    build = payload_builders[collector.name]
+    started = time.monotonic()
+    
+    try:
+        client = get_aws_client(account_profile, region, collector.service)
+        paginator = client.get_paginator(collector.paginator)
+        
+        # Use paginator to handle large number of resources. Where the service
+        # can, it does the state and include-tag filtering itself.
+        pages = paginator.paginate(
+            **collector.params(states, include_tags),
+            PaginationConfig={'PageSize': collector.page_size},
+        )
+        operation = client.meta.method_to_api_mapping.get(collector.paginator, collector.paginator)
+        
+        for page in timed_pages(pages, operation=operation, region=region):
+            batch = []
+            for item in collector.items(page):
+                # Keep only what the field spec reads; the page's dicts are freed with it
+                record = collector.record(item, account_name, region)
+                if client_include_tags and not is_included(record.tags, client_include_tags):
+                    continue
+                if exclude_tags and is_excluded(record.tags, exclude_tags):
+                    continue
+                if snapshot is not None:
+                    snapshot.add(collector.name, record)
+                if on_record is not None:
+                    on_record(collector.name, record)
+                asset_data, asset_tag = build(record)
+                batch.append({'payload': asset_data, 'asset_tag': asset_tag})
+            if batch:
+                emit(batch)
+                resource_count += len(batch)
+        
+        if state is not None:
+            state.record_region_scan(region_scope(states, collector), account_profile['profile_name'], region,
+                                     resource_count)
+        
+        seconds = time.monotonic() - started
+        metrics.observe('aws_region_scan_seconds', seconds, **labels)
+        metrics.inc('aws_resources_total', resource_count, **labels)
+        if resource_count > 0:
+            log.info("Found %d resources", resource_count, extra=fields(seconds=round(seconds, 3), **labels))
+            
     except ClientError as e:
-        print(f"  [ERROR] AWS API call failed for {account_profile['name']}: {e}")
+        log.error("Failed to scan region: %s", e, extra=fields(**labels))
+        metrics.inc('aws_scan_failures_total', **labels)
+        _record_failure(failures, account_profile, region, str(e))
     except Exception as e:
-        print(f"  [ERROR] Unexpected error for {account_profile['name']}: {e}")
+        log.error("Unexpected error scanning region: %s", e, extra=fields(**labels))
+        metrics.inc('aws_scan_failures_total', **labels)
+        _record_failure(failures, account_profile, region, str(e))
+    
+    return resource_count
+
+def timed_pages(pages, **labels):
+    """Yields paginator pages, recording how long each page took to arrive as aws_api_seconds."""
+
+    iterator = iter(pages)
+    while True:
+        started = time.monotonic()
+        try:
+            page = next(iterator)
+        except StopIteration:
+            return
+        metrics.observe('aws_api_seconds', time.monotonic() - started, **labels)
+        yield page
+
+def region_scope(states, collector=EC2):
+    """Identifies the collector and filters a scan ran with, so region activity is only compared like for like."""
+
+    include_tags = parse_tag_filters(EC2_INCLUDE_TAGS) if collector.tag_filtering else ()
+    filters = {'params': collector.params(states, include_tags), 'include_tags': include_tags}
+    return f"{collector.name}:{payload_fingerprint(filters)[:16]}"
+
+def prune_regions(account_profile, regions, activity, collector=EC2):
+    """
+    Splits an account's regions into those to scan and those to skip this run, for one collector.
+
+    A region is skipped when its last REGION_EMPTY_RUNS scans were all empty
+    and it was scanned less than REGION_RECHECK_INTERVAL ago. activity is
+    the account's region activity from the state store.
+    """
+
+    now = time.time()
+    scan, skipped = [], []
+    for region in regions:
+        entry = activity.get(region)
+        if (entry is not None and entry['empty_runs'] >= REGION_EMPTY_RUNS
+                and now - entry['scanned_at'] < REGION_RECHECK_INTERVAL):
+            skipped.append(region)
+        else:
+            scan.append(region)
+    
+    if skipped:
+        log.info("Skipping %d region(s) with no resources in their last %d scans", len(skipped), REGION_EMPTY_RUNS,
+                 extra=fields(account=account_profile['name'], collector=collector.name, regions=','.join(skipped)))
+    return scan, skipped
+
+@metrics.timer('phase_seconds', phase='discovery')
+def discover_aws_assets(accounts, emit, states=SYNC_INSTANCE_STATES, failures=None, state=None, all_regions=False,
+                        skip_regions=(), on_region_done=None, collectors=None, shard=None, snapshot=None,
+                        on_record=None):
+    """
+    Discovers AWS resources across all (account, region, collector) combinations concurrently.
+
+    collectors defaults to the ones enabled in AWS_COLLECTORS (see
+    collectors.py); states only applies to EC2 instances. Region lists are
+    fetched per account first; each account's scans are then run with at most
+    'max_concurrency' (or AWS_MAX_WORKERS_PER_ACCOUNT) requests in flight, all
+    sharing one pool of AWS_DISCOVERY_WORKERS threads. Batches are passed to
+    emit() page by page as they arrive (emit may block to apply backpressure),
+    so total time approaches the slowest scan rather than the sum of all of
+    them. Returns the number of resources discovered.
+
+    Pass a list as failures to learn which accounts and regions could not
+    be fully scanned.
+
+    With a state store, region lists are cached and regions where a collector
+    keeps finding nothing are skipped for it (see prune_regions) unless
+    all_regions is set. Skipped regions are not failures: they were scanned
+    recently enough.
+
+    (profile_name, region, collector name) triples in skip_regions are not
+    scanned at all, and on_region_done(account, region, count, collector) is
+    called after each scan that completed without errors; a resumed sync uses
+    both. With shard, an (index, count) pair, only the scans that shard_of()
+    assigns to shard index are run. The records discovered are added to
+    snapshot (a SnapshotWriter), if given, and passed to
+    on_record(collector name, record), if given, before they are emitted.
+    """
+    
+    total = 0
+    collectors = enabled_collectors() if collectors is None else collectors
+    
+    for collector in [collector for collector in collectors if collector.name not in payload_builders]:
+        log.error("No Snipe-IT model for %s, not discovering it (run setup_snipeit.py or set RESOURCE_MODEL_IDS)",
+                  collector.model_name, extra=fields(collector=collector.name))
+        if failures is not None:
+            failures.append({'account': None, 'region': None, 'error': f'no model for collector {collector.name}'})
+    collectors = [collector for collector in collectors if collector.name in payload_builders]
+    
+    def scan(account, region, collector):
+        region_failures = []
+        count = scan_region(account, region, emit, states, region_failures, state, collector, snapshot,
+                            on_record)
+        if failures is not None:
+            failures.extend(region_failures)
+        if not region_failures and on_region_done is not None:
+            on_region_done(account, region, count, collector)
+        return count
+    
+    def account_scans(account, regions):
+        """Returns the account's (region, collector) scans, each region's collectors next to each other."""
+        
+        to_scan = {}
+        for collector in collectors:
+            selected = regions
+            if state is not None and not all_regions:
+                activity = state.region_activity(region_scope(states, collector), account['profile_name'])
+                selected, _ = prune_regions(account, regions, activity, collector)
+            to_scan[collector.name] = set(selected)
+        return deque(
+            (region, collector) for region in regions for collector in collectors
+            if region in to_scan[collector.name]
+            and (account['profile_name'], region, collector.name) not in skip_regions
+            and (shard is None or shard_of(f"{account['profile_name']}/{region}/{collector.name}", shard[1]) == shard[0])
+        )
+    
+    if not collectors:
+        return total
+    
+    with ThreadPoolExecutor(max_workers=AWS_DISCOVERY_WORKERS) as executor:
+        # future -> (account, scanning); scanning is False for the region listing
+        in_flight = {executor.submit(get_account_regions, account, failures, state): (account, False) for account in accounts}
+        queued_scans = {}
+        
+        def submit_next_scan(account):
+            if queued_scans[account['name']]:
+                region, collector = queued_scans[account['name']].popleft()
+                in_flight[executor.submit(scan, account, region, collector)] = (account, True)
         
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                account, scanning = in_flight.pop(future)
+                
+                if not scanning:
+                    # Region list is in: start the account's scans up to its concurrency limit
+                    queued_scans[account['name']] = account_scans(account, future.result())
+                    limit = account.get('max_concurrency') or AWS_MAX_WORKERS_PER_ACCOUNT
+                    for _ in range(limit):
+                        submit_next_scan(account)
+                else:
+                    total += future.result()
+                    submit_next_scan(account)
+    
+    return total
+
+def get_aws_assets(account_profile):
+    """Connects to AWS account and retrieves the enabled resource types' data across all regions."""
+    
+    all_assets = []
+    discover_aws_assets([account_profile], all_assets.extend)
     return all_assets
 
+def replay_snapshot(path, emit, collectors=None):
+    """
+    Feeds the records of a snapshot (see snapshot.py) to emit() as discovery would, without calling AWS.
+
+    Payloads are built with the current field mapping, page by page.
+    Records of collectors not in collectors (default: AWS_COLLECTORS) or
+    without a Snipe-IT model are skipped. Returns the number of assets
+    replayed; raises ValueError if path is not a snapshot.
+    """
+    
+    collectors = enabled_collectors() if collectors is None else collectors
+    names = {collector.name for collector in collectors if collector.name in payload_builders}
+    header, entries = read_snapshot(path)
+    if not header.get('complete'):
+        log.warning("Snapshot %s is from a run that did not scan everything", path)
+    log.info("Replaying snapshot %s from %s", path, header.get('created_at'))
+    
+    total = 0
+    skipped = 0
+    batch = []
+    for entry in entries:
+        if entry['collector'] not in names:
+            skipped += 1
+            continue
+        asset_data, asset_tag = payload_builders[entry['collector']](restore_record(entry))
+        batch.append({'payload': asset_data, 'asset_tag': asset_tag})
+        if len(batch) >= EC2_PAGE_SIZE:
+            emit(batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        emit(batch)
+        total += len(batch)
+    
+    if skipped:
+        log.info("Skipped %d snapshot record(s) of collectors not enabled", skipped)
+    metrics.inc('snapshot_records_replayed_total', total)
+    return total
+
 
 
+@metrics.timer('phase_seconds', phase='lookup')
 def find_snipeit_asset_by_tag(asset_tag):
     """Checks if an asset with the given tag already exists in Snipe-IT."""
     
-    search_url = f"{SNIPEIT_API_URL}?search={asset_tag}&asset_tag={asset_tag}"
-    
     try:
-        response = requests.get(search_url, headers=SNIPEIT_HEADERS, timeout=10)
-        response.raise_for_status()
-        
-        data = response.json()
+        data = snipeit.search_hardware(asset_tag)
         
         if data and data.get('total') > 0:
             # Found the existing asset
@@ -231,89 +650,787 @@ def find_snipeit_asset_by_tag(asset_tag):
         return None
         
     except requests.exceptions.RequestException as e:
-        print(f"  [ERROR] Failed to search Snipe-IT for asset {asset_tag}: {e}")
+        log.error("Failed to search Snipe-IT for asset: %s", e, extra=fields(asset_tag=asset_tag))
+        return None
+
+def snipeit_row_values(row):
+    """Flattens a Snipe-IT hardware row into payload keys and their current values."""
+
+    values = {
+        'asset_tag': row.get('asset_tag'),
+        'serial': row.get('serial'),
+        'name': row.get('name'),
+        'status_id': (row.get('status_label') or {}).get('id'),
+        'model_id': (row.get('model') or {}).get('id'),
+        'purchase_date': (row.get('purchase_date') or {}).get('date'),
+        'notes': row.get('notes'),
+    }
+
+    # custom_fields is keyed by the field's display name; the payload uses the db column
+    custom_fields = row.get('custom_fields') or {}
+    for field in custom_fields.values():
+        values[field['field']] = field.get('value')
+
+    return values
+
+@metrics.timer('phase_seconds', phase='index_prefetch')
+def build_snipeit_asset_index():
+    """
+    Reads the complete Snipe-IT hardware list once and indexes it by asset tag.
+
+    The first page tells us the total; the remaining pages are fetched in
+    parallel by the client. Returns a dict of asset_tag -> {'id': ..., 'values': {...}}, or
+    None if any page could not be read (an incomplete index would cause
+    duplicate creates, so callers fall back to per-asset searches).
+    """
+
+    log.info("Pre-fetching Snipe-IT hardware list")
+    index = {}
+
+    try:
+        for row in snipeit.iter_hardware(workers=SNIPEIT_PREFETCH_WORKERS):
+            asset_tag = html.unescape(row.get('asset_tag') or '')
+            if asset_tag:
+                index[asset_tag] = {'id': row['id'], 'values': snipeit_row_values(row)}
+
+    except (requests.exceptions.RequestException, ValueError) as e:
+        log.error("Failed to pre-fetch Snipe-IT hardware list: %s", e)
         return None
 
-def create_or_update_snipeit_asset(asset_data, asset_id=None):
-    """Creates a new asset or updates an existing one in Snipe-IT."""
+    log.info("Indexed %d assets", len(index))
+    return index
+
+# Values Snipe-IT (or our own payload) uses to mean "nothing here"
+EMPTY_VALUES = {'', 'n/a', 'none', 'null'}
+DATE_PREFIX = re.compile(r'^(\d{4}-\d{2}-\d{2})(?:[ T]\d{2}:\d{2}(?::\d{2})?.*)?$')
+
+def normalise_value(value):
+    """Normalises a field value so payload and Snipe-IT values compare equal when they mean the same thing."""
+
+    if value is None:
+        return ''
+    if isinstance(value, dict):
+        # Date fields come back as {'date': ..., 'formatted': ...}
+        value = value.get('date')
+        if value is None:
+            return ''
+
+    # The API HTML-escapes strings; whitespace differences are not real changes
+    value = ' '.join(html.unescape(str(value)).split())
+    if value.lower() in EMPTY_VALUES:
+        return ''
+
+    # Compare dates and datetimes on the day only
+    match = DATE_PREFIX.match(value)
+    if match:
+        return match.group(1)
+
+    return value
+
+def diff_snipeit_payload(payload, current_values):
+    """Returns only the payload fields whose normalised value differs from Snipe-IT's current state."""
+
+    changes = {}
+    for key, value in payload.items():
+        if key == 'asset_tag':
+            continue
+        if normalise_value(value) != normalise_value(current_values.get(key)):
+            changes[key] = value
+    return changes
+
+@metrics.timer('phase_seconds', phase='write')
+def create_or_update_snipeit_asset(asset_data, asset_id=None, asset_tag=None):
+    """Creates a new asset or updates an existing one in Snipe-IT.
+
+    When updating, asset_data may be a partial payload; pass asset_tag
+    explicitly if it does not contain one. Returns the Snipe-IT asset ID on
+    success and None on failure.
+    """
     
-    asset_tag = asset_data['asset_tag']
+    asset_tag = asset_tag or asset_data['asset_tag']
     
-    if asset_id:
-        # Update existing asset
-        url = f"{SNIPEIT_API_URL}/{asset_id}"
-        http_method = 'PATCH'  # Changed from PUT to PATCH
-        action = 'Updated'
-    else:
-        # Create new asset
-        url = SNIPEIT_API_URL
-        http_method = 'POST'
-        action = 'Created'
+    action = 'Updated' if asset_id else 'Created'
 
     try:
-        response = requests.request(http_method, url, headers=SNIPEIT_HEADERS, json=asset_data, timeout=15)
-        response.raise_for_status()
+        if asset_id:
+            # Update existing asset
+            response_data = snipeit.update_hardware(asset_id, asset_data)
+        else:
+            # Create new asset
+            response_data = snipeit.create_hardware(asset_data)
         
         # CHECK THE JSON RESPONSE STATUS!
-        response_data = response.json()
         
         if response_data.get('status') == 'success':
-            print(f"  [SUCCESS] Asset {asset_tag} - {action}.")
-            return True
+            snipeit_id = (response_data.get('payload') or {}).get('id') or asset_id
+            log.info("Asset %s", action.lower(), extra=fields(asset_tag=asset_tag, snipeit_id=snipeit_id))
+            return snipeit_id
         else:
             # The API returned 200 but with an error status
             error_messages = response_data.get('messages', 'Unknown error')
-            print(f"  [FAILURE] Asset {asset_tag} - API Error: {error_messages}")
-            return False
+            log.error("Snipe-IT rejected the asset: %s", error_messages, extra=fields(asset_tag=asset_tag))
+            return None
         
     except requests.exceptions.HTTPError as e:
+        response = e.response
         error_message = response.json().get('messages', e) if response.text else str(e)
-        print(f"  [FAILURE] Asset {asset_tag} - Failed to {action.lower()}: {error_message}")
-        return False
+        log.error("Failed to %s asset: %s", "update" if asset_id else "create", error_message, extra=fields(asset_tag=asset_tag))
+        return None
         
     except requests.exceptions.RequestException as e:
-        print(f"  [ERROR] Network error during Snipe-IT API call for {asset_tag}: {e}")
-        return False
+        log.error("Network error during Snipe-IT API call: %s", e, extra=fields(asset_tag=asset_tag))
+        return None
 
 
 # ==============================================================================
 # 4. MAIN EXECUTION
 # ==============================================================================
 
-def main():
-    """Orchestrates the discovery and synchronization process."""
+def sync_asset(asset, get_asset_index, state=None, full_resync=False, bulk=None):
+    """
+    Checks one discovered asset against Snipe-IT and creates or patches it.
+
+    get_asset_index() returns the pre-fetched hardware index (or None when
+    pre-fetching is off or failed). When a state store is given, an asset whose
+    payload fingerprint matches what we last pushed, within the TTL, is skipped
+    without touching the network, and known Snipe-IT IDs are reused instead of
+    searching.
+
+    With a BulkLoader (bulk), a new asset is added to the next CSV import
+    instead of being created, and the outcome is 'deferred'.
     
-    all_aws_assets = []
+    Returns (outcome, snipeit_id), outcome being 'cached', 'created',
+    'patched', 'unchanged', 'deferred' or 'failed' (snipeit_id is then None).
+    """
     
-    # 1. Discover assets from all AWS accounts
-    for account in AWS_ACCOUNTS:
-        assets = get_aws_assets(account)
-        all_aws_assets.extend(assets)
-        
-    print(f"\nTotal unique assets discovered across all AWS accounts: {len(all_aws_assets)}")
+    payload = asset['payload']
+    asset_tag = asset['asset_tag']
     
-    # 2. Sync assets with Snipe-IT
-    print("\n--- Starting Snipe-IT Synchronization ---")
+    fingerprint = payload_fingerprint(payload)
+    known = state.get(asset_tag) if state is not None else None
+    if not full_resync and state is not None and state.is_fresh(known, fingerprint):
+        return 'cached', known['snipeit_id']
     
-    for asset in all_aws_assets:
-        payload = asset['payload']
-        asset_tag = asset['asset_tag']
-        
-        # 2a. Check if asset exists
+    # Check if asset exists (from the pre-fetched index when available)
+    current_values = None
+    asset_index = get_asset_index()
+    if asset_index is not None:
+        existing = asset_index.get(asset_tag)
+        snipeit_id = existing['id'] if existing else None
+        current_values = existing['values'] if existing else None
+    elif known is not None:
+        snipeit_id = known['snipeit_id']
+    else:
         snipeit_id = find_snipeit_asset_by_tag(asset_tag)
+    
+    # Create or Update
+    if snipeit_id:
+        # Without the current state (fallback search) we can only send the full payload
+        changes = diff_snipeit_payload(payload, current_values) if current_values is not None else payload
+        if not changes:
+            outcome = 'unchanged'
+        else:
+            log.debug("Updating existing asset", extra=fields(asset_tag=asset_tag, snipeit_id=snipeit_id, changed_fields=len(changes)))
+            snipeit_id = create_or_update_snipeit_asset(changes, asset_id=snipeit_id, asset_tag=asset_tag)
+            outcome = 'patched' if snipeit_id else 'failed'
+    elif bulk is not None:
+        log.debug("Asset not found, adding it to the bulk import", extra=fields(asset_tag=asset_tag))
+        bulk.add(payload)
+        return 'deferred', None
+    else:
+        log.debug("Asset not found, creating it", extra=fields(asset_tag=asset_tag))
+        snipeit_id = create_or_update_snipeit_asset(payload)
+        outcome = 'created' if snipeit_id else 'failed'
+    
+    if state is not None:
+        if outcome == 'failed':
+            # The remembered ID may be stale (e.g. the asset was deleted); resolve it afresh next time
+            state.forget(asset_tag)
+        else:
+            state.record(asset_tag, snipeit_id, fingerprint)
+    
+    return outcome, snipeit_id
+
+def run_sync_pipeline(accounts, state=None, full_resync=False, all_regions=False, journal=None, resume=None,
+                      bulk_load=False, collectors=None, exchange=None, snapshot=None, replay=None):
+    """
+    Streams discovered assets straight into a pool of Snipe-IT writer threads.
+
+    Discovery workers push each page of assets into a bounded queue and block
+    when it is full, so writes overlap with discovery and memory stays flat
+    regardless of fleet size.
+
+    The hardware index is pre-fetched alongside discovery when the state store
+    is empty (or a full resync was asked for). Otherwise it is only fetched
+    the first time an asset misses the state cache, so a run where nothing
+    changed makes no Snipe-IT requests at all.
+
+    Progress is written to the journal (a SyncJournal), if given. resume is
+    what load_journal() recovered from an interrupted run: its pending assets
+    are synced first without rediscovering them, its completed regions are
+    not scanned again, and assets it already synced are skipped.
+    
+    With bulk_load, new assets are created through Snipe-IT's CSV importer
+    in chunks (see snipeit_import.py) instead of one POST each, and are
+    counted as created once the hardware list shows them.
+
+    collectors are the resource types to discover (default: AWS_COLLECTORS).
+    What was discovered is added to snapshot (a SnapshotWriter), if given.
+    With replay, the path of a snapshot, its records are synced instead and
+    AWS is not called at all.
+
+    In a sharded run, exchange (a ShardExchange) swaps discovered assets with
+    the other shards, so this one only writes the assets it owns, and
+    supplies its part of the hardware index.
+    """
+    
+    asset_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    counts = {'resumed': 0, 'cached': 0, 'created': 0, 'patched': 0, 'unchanged': 0, 'failed': 0}
+    counts_lock = threading.Lock()
+    bulk = BulkLoader(snipeit, payload_columns()) if bulk_load else None
+    deferred = {}  # asset_tag -> payload fingerprint, for assets in bulk imports
+    
+    fetch_index = exchange.fetch_index if exchange is not None else build_snipeit_asset_index
+    
+    with ThreadPoolExecutor(max_workers=1) as prefetcher:
+        index_lock = threading.Lock()
+        index_future = None
+        
+        def get_asset_index():
+            nonlocal index_future
+            if not SNIPEIT_BULK_PREFETCH:
+                return None
+            with index_lock:
+                if index_future is None:
+                    index_future = prefetcher.submit(fetch_index)
+            return index_future.result()
+        
+        if SNIPEIT_BULK_PREFETCH and (state is None or full_resync or state.count() == 0):
+            index_future = prefetcher.submit(fetch_index)
+        
+        def writer():
+            while True:
+                asset = asset_queue.get()
+                if asset is None:
+                    return
+                started = time.monotonic()
+                try:
+                    outcome, snipeit_id = sync_asset(asset, get_asset_index, state, full_resync, bulk)
+                except Exception:
+                    # Never let one bad asset kill a writer; the producers would block forever
+                    log.exception("Unexpected error syncing asset", extra=fields(asset_tag=asset['asset_tag']))
+                    outcome, snipeit_id = 'failed', None
+                if outcome == 'deferred':
+                    # Settled by settle_bulk_load() once the imports have run
+                    with counts_lock:
+                        deferred[asset['asset_tag']] = payload_fingerprint(asset['payload'])
+                    continue
+                metrics.observe('sync_asset_seconds', time.monotonic() - started, outcome=outcome)
+                metrics.inc('sync_assets_total', outcome=outcome)
+                if journal is not None:
+                    journal.record_outcome(asset['asset_tag'], outcome, snipeit_id)
+                with counts_lock:
+                    counts[outcome] += 1
+        
+        writers = [threading.Thread(target=writer, daemon=True) for _ in range(SNIPEIT_WRITE_WORKERS)]
+        for thread in writers:
+            thread.start()
+        
+        # Assets already synced (or queued) by the interrupted run are not queued again
+        skip_tags = set()
+        skip_lock = threading.Lock()
+        if resume is not None:
+            skip_tags.update(resume['done'], resume['pending'])
+            log.info("Resuming interrupted run", extra=fields(
+                pending=len(resume['pending']), done=len(resume['done']),
+                completed_regions=len(resume['completed_regions'])))
+            for asset in resume['pending'].values():
+                asset_queue.put(asset)
+        
+        def enqueue(batch):
+            if skip_tags:
+                with skip_lock:
+                    fresh = [asset for asset in batch if asset['asset_tag'] not in skip_tags]
+                    skip_tags.difference_update(asset['asset_tag'] for asset in batch)
+                with counts_lock:
+                    counts['resumed'] += len(batch) - len(fresh)
+                batch = fresh
+            if journal is not None and batch:
+                journal.record_batch(batch)
+            for asset in batch:
+                asset_queue.put(asset)
+        
+        def region_done(account, region, count, collector):
+            journal.record_region(account['profile_name'], region, count, collector.name)
         
-        # 2b. Create or Update
-        if snipeit_id:
-            print(f"  [MATCH] Found existing asset {asset_tag} (ID: {snipeit_id}). Attempting update...")
-            create_or_update_snipeit_asset(payload, asset_id=snipeit_id)
+        scan_failures = []
+        if exchange is not None:
+            # This shard's assets, from every shard's discovery, arrive here
+            exchange.start(enqueue)
+        if replay is not None:
+            discovered = replay_snapshot(replay, enqueue, collectors)
         else:
-            print(f"  [NEW] Asset {asset_tag} not found. Attempting creation...")
-            create_or_update_snipeit_asset(payload)
-            
-        sleep(0.5) # Be kind to the API and avoid rate limiting
+            discovered = discover_aws_assets(
+                accounts, enqueue if exchange is None else exchange.send, failures=scan_failures, state=state,
+                all_regions=all_regions, skip_regions=resume['completed_regions'] if resume is not None else (),
+                on_region_done=region_done if journal is not None else None, collectors=collectors,
+                shard=(exchange.index, exchange.count) if exchange is not None else None, snapshot=snapshot,
+            )
+        if exchange is not None:
+            exchange.finish()
+        
+        for _ in writers:
+            asset_queue.put(None)
+        for thread in writers:
+            thread.join()
+    
+    if bulk is not None:
+        bulk.finish()
+        for outcome, count in settle_bulk_load(deferred, state, journal).items():
+            counts[outcome] += count
+    
+    counts['scan_failures'] = len(scan_failures)
+    return discovered, counts
+
+def settle_bulk_load(deferred, state=None, journal=None):
+    """
+    Works out which bulk-imported assets Snipe-IT now has, from a fresh read of the hardware list.
+
+    deferred maps asset tags to payload fingerprints. The importer reports
+    no IDs, so an asset counts as created once its tag shows up; one that
+    does not is failed, and --resume will retry it. Records each outcome in
+    the state store and journal and returns {outcome: count}.
+    """
+    
+    counts = {'created': 0, 'failed': 0}
+    if not deferred:
+        return counts
+    
+    index = build_snipeit_asset_index() or {}
+    for asset_tag, fingerprint in deferred.items():
+        existing = index.get(asset_tag)
+        snipeit_id = existing['id'] if existing else None
+        outcome = 'created' if snipeit_id else 'failed'
+        if state is not None and snipeit_id:
+            state.record(asset_tag, snipeit_id, fingerprint)
+        if journal is not None:
+            journal.record_outcome(asset_tag, outcome, snipeit_id)
+        metrics.inc('sync_assets_total', outcome=outcome)
+        counts[outcome] += 1
+    
+    if counts['failed']:
+        log.error("%d bulk-imported asset(s) are not in Snipe-IT", counts['failed'])
+    return counts
+
+def build_run_summary(discovered, counts):
+    """
+    Returns the end-of-run report: the outcome counts, throughput, a
+    per-region breakdown and every metric recorded during the run.
+    """
+    
+    summary = metrics.summary()
+    duration = summary['duration_seconds']
+    resources = metrics.counter_values('aws_resources_total')
+    
+    regions = []
+    for labels, scan in sorted(metrics.histogram_summaries('aws_region_scan_seconds').items()):
+        regions.append(dict(labels, resources=resources.get(labels, 0), scan_seconds=scan['sum']))
+    
+    summary.update({
+        'discovered': discovered,
+        'outcomes': counts,
+        'assets_per_second': round(discovered / duration, 2) if duration else None,
+        'regions': regions,
+    })
+    return summary
+
+def shard_of(key, shards):
+    """Returns the shard (0 .. shards-1) owning a key; stable across processes and runs, unlike hash()."""
+
+    return int(hashlib.blake2b(key.encode('utf-8'), digest_size=8).hexdigest(), 16) % shards
 
-    print("\n--- Synchronization Complete ---")
+def shard_path(path, index, count):
+    """Returns a shard's own variant of a file path: .sync_journal.jsonl -> .sync_journal.shard-1-of-4.jsonl."""
+
+    root, extension = os.path.splitext(path)
+    return f"{root}.shard-{index + 1}-of-{count}{extension}"
+
+class ShardExchange:
+    """
+    One shard's side of a sharded run: its link to the other shards and the parent.
+
+    send() is the discovery emit(): it splits a batch by owning shard and
+    puts each part in that shard's inbox. start() runs a thread feeding this
+    shard's inbox to the pipeline until every shard, this one included, has
+    called finish(). fetch_index() asks the parent for this shard's part of
+    the hardware index.
+    """
+
+    def __init__(self, index, count, inboxes, index_requests, index_reply):
+        self.index = index
+        self.count = count
+        self.inboxes = inboxes
+        self.index_requests = index_requests
+        self.index_reply = index_reply
+        self.receiver = None
+
+    def send(self, batch):
+        parts = {}
+        for asset in batch:
+            parts.setdefault(shard_of(asset['asset_tag'], self.count), []).append(asset)
+        for shard, assets in parts.items():
+            self.inboxes[shard].put(assets)
+
+    def start(self, enqueue):
+        def receive():
+            discovering = self.count
+            while discovering:
+                batch = self.inboxes[self.index].get()
+                if batch is None:
+                    discovering -= 1
+                else:
+                    enqueue(batch)
+
+        self.receiver = threading.Thread(target=receive, daemon=True)
+        self.receiver.start()
+
+    def finish(self):
+        """Tells every shard this one is done discovering, then waits until all of them are."""
+
+        for inbox in self.inboxes:
+            inbox.put(None)
+        self.receiver.join()
+
+    def fetch_index(self):
+        self.index_requests.put(self.index)
+        return self.index_reply.get()
+
+def serve_index(index_requests, index_replies, shards):
+    """
+    Parent-side thread of a sharded run: reads the hardware index once, on the first request, and
+    answers every shard's request with the entries it owns (or None if the index could not be read).
+    """
+
+    parts = None
+    while True:
+        shard = index_requests.get()
+        if shard is None:
+            return
+        if parts is None:
+            index = build_snipeit_asset_index()
+            parts = [None] * shards if index is None else [{} for _ in range(shards)]
+            if index is not None:
+                for asset_tag, entry in index.items():
+                    parts[shard_of(asset_tag, shards)][asset_tag] = entry
+        index_replies[shard].put(parts[shard])
+
+def run_journaled(accounts, args, journal_path=SYNC_JOURNAL_PATH, exchange=None):
+    """
+    Runs the sync pipeline with the state store and checkpoint journal args asks for.
+
+    The journal is marked finished when nothing failed, so a later --resume
+    starts afresh. Unless args replays a snapshot, what was discovered is
+    written to args.snapshot (a shard writes its own part, which run_sharded
+    merges). Returns (discovered, counts).
+    """
+
+    if args.no_state:
+        state = None
+    else:
+        # Shards share the store; each commits every write so none holds SQLite's write lock for long
+        state = SyncStateStore(commit_every=1) if exchange is not None else SyncStateStore()
+    
+    resume = None
+    if args.resume:
+        resume = load_journal(journal_path)
+        if resume is None:
+            log.info("No interrupted run to resume; starting a full run")
+    journal = SyncJournal(journal_path, resume=resume is not None)
+    
+    snapshot = None
+    if args.snapshot and not args.from_snapshot:
+        if exchange is None:
+            snapshot = SnapshotWriter(args.snapshot)
+        else:
+            snapshot = SnapshotWriter(snapshot_part_path(args.snapshot, exchange.index, exchange.count),
+                                      keep_previous=False)
+    
+    try:
+        discovered, counts = run_sync_pipeline(accounts, state, full_resync=args.full_resync,
+                                               all_regions=args.all_regions, journal=journal, resume=resume,
+                                               bulk_load=args.bulk_load, collectors=args.collectors,
+                                               exchange=exchange, snapshot=snapshot, replay=args.from_snapshot)
+        if not counts['failed'] and not counts['scan_failures']:
+            journal.finish()
+        if snapshot is not None:
+            # A resumed run does not rescan the regions the interrupted one finished
+            written = snapshot.close(complete=resume is None and not counts['scan_failures'])
+            log.info("Wrote %d record(s) to snapshot %s", written, snapshot.path)
+            snapshot = None
+    finally:
+        if snapshot is not None:
+            snapshot.discard()
+        journal.close()
+        if state is not None:
+            state.close()
+    return discovered, counts
+
+def snapshot_part_path(path, index, count):
+    """Returns the snapshot part a shard writes: .inventory_snapshot.jsonl.gz -> .inventory_snapshot.shard-1-of-4.jsonl.gz."""
+
+    return variant_path(path, f"shard-{index + 1}-of-{count}")
+
+def run_shard(index, count, accounts, options, rate_limiter, inboxes, index_requests, index_reply, results):
+    """Entry point of a shard process (see run_sharded); puts (index, discovered, counts, metrics) in results."""
+
+    args = argparse.Namespace(**options)
+    args.collectors = [COLLECTORS[name] for name in args.collectors]
+    configure_logging(args.log_level, args.log_format)
+    # The parent has just refreshed the metadata cache if asked to
+    configure_payload_builder()
+    snipeit.rate_limiter = rate_limiter
+    
+    exchange = ShardExchange(index, count, inboxes, index_requests, index_reply)
+    discovered, counts = run_journaled(accounts, args, shard_path(SYNC_JOURNAL_PATH, index, count), exchange)
+    results.put((index, discovered, counts, metrics.export()))
+
+def run_sharded(accounts, args):
+    """
+    Runs the sync as args.shards processes and adds up their results.
+
+    Shards are spawned rather than forked, so none inherits the parent's
+    sockets, and exchange discovered assets through queues (see
+    ShardExchange). The hardware index is read once, here, and handed out in
+    parts. Each shard keeps its own journal, so --resume needs the same
+    number of shards as the interrupted run. If a shard dies, the others
+    are stopped and the run counts as failed.
+    """
+
+    shards = args.shards
+    context = multiprocessing.get_context('spawn')
+    rate_limiter = SharedRateLimiter(context=context)
+    snipeit.rate_limiter = rate_limiter
+    
+    inboxes = [context.Queue(maxsize=SHARD_QUEUE_BATCHES) for _ in range(shards)]
+    index_requests = context.Queue()
+    index_replies = [context.Queue() for _ in range(shards)]
+    results = context.Queue()
+    
+    options = dict(vars(args), collectors=[collector.name for collector in args.collectors])
+    processes = [
+        context.Process(target=run_shard, name=f'shard-{index + 1}', args=(
+            index, shards, accounts, options, rate_limiter, inboxes, index_requests, index_replies[index], results))
+        for index in range(shards)
+    ]
+    server = threading.Thread(target=serve_index, args=(index_requests, index_replies, shards), daemon=True)
+    server.start()
+    log.info("Starting %d shards", shards)
+    for process in processes:
+        process.start()
+    
+    discovered = 0
+    counts = {'shard_failures': 0}
+    reported = set()
+    while len(reported) < shards:
+        try:
+            index, shard_discovered, shard_counts, shard_metrics = results.get(timeout=1)
+        except queue.Empty:
+            dead = [index for index, process in enumerate(processes)
+                    if index not in reported and not process.is_alive()]
+            if dead:
+                # The others would wait forever for the dead shard's assets
+                log.error("Shard(s) %s exited without finishing; stopping the others",
+                          ', '.join(str(index + 1) for index in dead))
+                for process in processes:
+                    process.terminate()
+                counts['shard_failures'] = shards - len(reported)
+                break
+            continue
+        reported.add(index)
+        discovered += shard_discovered
+        for outcome, count in shard_counts.items():
+            counts[outcome] = counts.get(outcome, 0) + count
+        metrics.merge(shard_metrics)
+        log.info("Shard %d finished", index + 1, extra=fields(discovered=shard_discovered, **shard_counts))
+    
+    for process in processes:
+        process.join()
+    index_requests.put(None)
+    server.join()
+    
+    if args.snapshot and not args.from_snapshot:
+        parts = [snapshot_part_path(args.snapshot, index, shards) for index in range(shards)]
+        if not counts['shard_failures']:
+            written = merge_snapshots(parts, args.snapshot)
+            log.info("Wrote %d record(s) to snapshot %s", written, args.snapshot)
+        for part in parts:
+            if os.path.exists(part):
+                os.remove(part)
+    for key in ('resumed', 'cached', 'created', 'patched', 'unchanged', 'failed', 'scan_failures'):
+        counts.setdefault(key, 0)
+    return discovered, counts
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Sync AWS EC2 instances (and other resources) into Snipe-IT.")
+    parser.add_argument('--full-resync', action='store_true',
+                        help="ignore the local sync-state cache and check every asset against Snipe-IT")
+    parser.add_argument('--no-state', action='store_true',
+                        help="do not read or write the local sync-state cache")
+    parser.add_argument('--all-regions', action='store_true',
+                        help="scan every region, including ones skipped for having been empty lately")
+    parser.add_argument('--refresh-metadata', action='store_true',
+                        help="re-read custom fields and models from Snipe-IT instead of the local cache")
+    parser.add_argument('--resume', action='store_true',
+                        help="continue an interrupted run from its checkpoint journal, retrying only failures")
+    parser.add_argument('--collectors', default=AWS_COLLECTORS, metavar='NAMES',
+                        help=f"resource types to discover, comma-separated, out of {', '.join(COLLECTORS)} "
+                             f"(default: {AWS_COLLECTORS})")
+    parser.add_argument('--bulk-load', action='store_true',
+                        help="create new assets through Snipe-IT's CSV importer, in chunks, instead of one request each")
+    parser.add_argument('--shards', type=int, default=SYNC_SHARDS, metavar='N',
+                        help=f"split the run across N processes by asset tag (default: {SYNC_SHARDS})")
+    parser.add_argument('--snapshot', default=SYNC_SNAPSHOT_PATH, metavar='PATH',
+                        help=f"where to write the snapshot of what was discovered, '' for nowhere "
+                             f"(default: {SYNC_SNAPSHOT_PATH})")
+    parser.add_argument('--from-snapshot', metavar='PATH',
+                        help="sync the records of a snapshot instead of discovering them; makes no AWS calls")
+    parser.add_argument('--metrics-json', default=SYNC_METRICS_JSON, metavar='PATH',
+                        help=f"where to write the end-of-run metrics summary, '' for nowhere (default: {SYNC_METRICS_JSON})")
+    parser.add_argument('--prometheus-textfile', default=SYNC_PROMETHEUS_TEXTFILE, metavar='PATH',
+                        help="also write the run's metrics in Prometheus text format to PATH")
+    parser.add_argument('--log-level', default=LOG_LEVEL,
+                        help=f"DEBUG, INFO, WARNING or ERROR (default: {LOG_LEVEL})")
+    parser.add_argument('--log-format', default=LOG_FORMAT, choices=('text', 'json'),
+                        help=f"log as plain text or one JSON object per line (default: {LOG_FORMAT})")
+    args = parser.parse_args(argv)
+    try:
+        args.collectors = enabled_collectors(args.collectors)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.shards > 1 and args.bulk_load:
+        # The importer runs one file at a time anyway, and settling needs the whole hardware list
+        parser.error("--bulk-load cannot be combined with --shards")
+    if args.shards > 1 and args.from_snapshot:
+        parser.error("--from-snapshot cannot be combined with --shards")
+    return args
+
+def main(argv=None):
+    """Orchestrates the discovery and synchronization process."""
+    
+    args = parse_args(argv)
+    configure_logging(args.log_level, args.log_format)
+    configure_payload_builder(refresh=args.refresh_metadata)
+    if args.from_snapshot:
+        # Replaying needs no accounts; fail now rather than mid-pipeline on a bad file
+        accounts = []
+        try:
+            read_snapshot(args.from_snapshot)
+        except (OSError, ValueError) as e:
+            log.error("Cannot replay snapshot: %s", e)
+            return 1
+    else:
+        from botocore.exceptions import BotoCoreError, ClientError
+
+        try:
+            accounts = load_accounts(AWS_ACCOUNTS)
+        except (BotoCoreError, ClientError, ValueError) as e:
+            log.error("Could not load the AWS accounts: %s", e)
+            return 1
+    
+    # Discovery and Snipe-IT writes run as one streaming pipeline
+    log.info("Starting AWS discovery and Snipe-IT synchronization")
+    
+    try:
+        with RunLock(), metrics.timer('phase_seconds', phase='run'):
+            if args.shards > 1:
+                discovered, counts = run_sharded(accounts, args)
+            else:
+                discovered, counts = run_journaled(accounts, args)
+    except RunLockHeld as e:
+        log.error("Not starting: %s", e)
+        return 1
+    
+    log.info("Synchronization complete", extra=fields(discovered=discovered, **counts))
+    if counts['scan_failures']:
+        log.warning("%d account(s)/region(s)/collector(s) could not be scanned", counts['scan_failures'])
+    if counts['failed'] or counts['scan_failures'] or counts.get('shard_failures'):
+        log.warning("Re-run with --resume to retry the failures only")
+    
+    summary = build_run_summary(discovered, counts)
+    if args.metrics_json:
+        write_json(args.metrics_json, summary)
+    if args.prometheus_textfile:
+        write_atomically(args.prometheus_textfile, metrics.to_prometheus())
+    return 0
+
+def discover_main(argv=None):
+    """Discovers AWS resources and writes the snapshot, without reading or writing Snipe-IT."""
+    
+    global payload_builders
+    
+    parser = argparse.ArgumentParser(description="Discover AWS resources into an inventory snapshot, without touching Snipe-IT.")
+    parser.add_argument('--all-regions', action='store_true',
+                        help="scan every region, including ones skipped for having been empty lately")
+    parser.add_argument('--no-state', action='store_true',
+                        help="do not read or write the local region cache")
+    parser.add_argument('--collectors', default=AWS_COLLECTORS, metavar='NAMES',
+                        help=f"resource types to discover, comma-separated, out of {', '.join(COLLECTORS)} "
+                             f"(default: {AWS_COLLECTORS})")
+    parser.add_argument('--snapshot', default=SYNC_SNAPSHOT_PATH, metavar='PATH',
+                        help=f"where to write the snapshot (default: {SYNC_SNAPSHOT_PATH})")
+    parser.add_argument('--log-level', default=LOG_LEVEL,
+                        help=f"DEBUG, INFO, WARNING or ERROR (default: {LOG_LEVEL})")
+    parser.add_argument('--log-format', default=LOG_FORMAT, choices=('text', 'json'),
+                        help=f"log as plain text or one JSON object per line (default: {LOG_FORMAT})")
+    args = parser.parse_args(argv)
+    try:
+        args.collectors = enabled_collectors(args.collectors)
+    except ValueError as e:
+        parser.error(str(e))
+    configure_logging(args.log_level, args.log_format)
+    
+    # The payloads are thrown away, so no collector needs its Snipe-IT model
+    payload_builders = compile_payload_builders(CUSTOM_FIELD_MAP, {name: DEFAULT_MODEL_ID for name in COLLECTORS})
+
+    from botocore.exceptions import BotoCoreError, ClientError
+
+    try:
+        accounts = load_accounts(AWS_ACCOUNTS)
+    except (BotoCoreError, ClientError, ValueError) as e:
+        log.error("Could not load the AWS accounts: %s", e)
+        return 1
+    
+    failures = []
+    try:
+        with RunLock():
+            state = None if args.no_state else SyncStateStore()
+            snapshot = SnapshotWriter(args.snapshot)
+            try:
+                discovered = discover_aws_assets(accounts, lambda batch: None, failures=failures, state=state,
+                                                 all_regions=args.all_regions, collectors=args.collectors,
+                                                 snapshot=snapshot)
+                written = snapshot.close(complete=not failures)
+                snapshot = None
+            finally:
+                if snapshot is not None:
+                    snapshot.discard()
+                if state is not None:
+                    state.close()
+    except RunLockHeld as e:
+        log.error("Not starting: %s", e)
+        return 1
+    
+    by_collector = {}
+    for labels, count in metrics.counter_values('aws_resources_total').items():
+        collector = dict(labels)['collector']
+        by_collector[collector] = by_collector.get(collector, 0) + count
+    log.info("Discovery complete", extra=fields(discovered=discovered, failures=len(failures), **by_collector))
+    log.info("Wrote %d record(s) to snapshot %s", written, args.snapshot)
+    if failures:
+        log.warning("%d account(s)/region(s)/collector(s) could not be scanned", len(failures))
+        return 1
+    return 0
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    raise SystemExit(main())
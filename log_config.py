@@ -0,0 +1,65 @@
+import json
+import logging
+import os
+import sys
+import time
+
+# ==============================================================================
+# CONFIGURATION
+# ==============================================================================
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # 'text' or 'json'
+
+# ==============================================================================
+# STRUCTURED LOGGING
+# ==============================================================================
+
+def fields(**values):
+    """
+    Attaches structured fields to a log call: log.info("...", extra=fields(asset_tag=tag)).
+
+    They are appended as key=value pairs in text output and become top-level
+    keys in JSON output.
+    """
+
+    return {'fields': values}
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)-7s %(name)s: %(message)s')
+
+    def format(self, record):
+        line = super().format(record)
+        values = getattr(record, 'fields', None)
+        if values:
+            line += ' ' + ' '.join(f'{key}={value}' for key, value in values.items())
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level=LOG_LEVEL, log_format=LOG_FORMAT, stream=None):
+    """Sends all log records to stderr (or stream) at the given level, as text or JSON lines."""
+
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(JsonFormatter() if log_format == 'json' else TextFormatter())
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level.upper() if isinstance(level, str) else level)
@@ -0,0 +1,227 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# ==============================================================================
+# CONFIGURATION
+# ==============================================================================
+
+# Upper bounds (seconds) of the latency histogram buckets, as in Prometheus
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+# ==============================================================================
+# METRICS
+# ==============================================================================
+
+def series_name(name, labels):
+    """Formats a metric and its labels the Prometheus way: name{key="value",...}."""
+
+    if not labels:
+        return name
+    rendered = ','.join(f'{key}="{_escape(value)}"' for key, value in labels)
+    return f'{name}{{{rendered}}}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Histogram:
+    """Latency histogram with fixed buckets, plus exact count, sum, min and max."""
+
+    __slots__ = ('buckets', 'counts', 'count', 'sum', 'min', 'max')
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        index = 0
+        while index < len(self.buckets) and value > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q):
+        """Estimates a quantile by interpolating within its bucket, like Prometheus' histogram_quantile()."""
+
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for index, bucket_count in enumerate(self.counts):
+            upper = self.buckets[index] if index < len(self.buckets) else self.max
+            if seen + bucket_count >= rank and bucket_count:
+                estimate = lower + (upper - lower) * (rank - seen) / bucket_count
+                return min(max(estimate, self.min), self.max)
+            seen += bucket_count
+            lower = upper
+        return self.max
+
+    def merge(self, counts, count, total, minimum, maximum):
+        """Adds the observations of a histogram with the same buckets, as exported by Metrics.export()."""
+
+        self.counts = [mine + theirs for mine, theirs in zip(self.counts, counts)]
+        self.count += count
+        self.sum += total
+        if minimum is not None:
+            self.min = minimum if self.min is None else min(self.min, minimum)
+        if maximum is not None:
+            self.max = maximum if self.max is None else max(self.max, maximum)
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'min': self.min,
+            'max': self.max,
+            'mean': round(self.sum / self.count, 6) if self.count else None,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+        }
+
+
+class Metrics:
+    """
+    Thread-safe registry of labelled counters and latency histograms for one run.
+
+    Series are created on first use, keyed by metric name and labels, so
+    instrumenting a call site is a single inc(), observe() or timer() call.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forgets every series and restarts the clock, e.g. between runs in one process."""
+
+        with self.lock:
+            self.started_at = time.time()
+            self.counters = {}
+            self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observes how long the with-block took, whether or not it raised."""
+
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - started, **labels)
+
+    def export(self):
+        """Returns every series as plain data, e.g. to send it from a worker process to merge() into the parent's."""
+
+        with self.lock:
+            return {
+                'counters': list(self.counters.items()),
+                'histograms': [(key, histogram.counts, histogram.count, histogram.sum, histogram.min, histogram.max)
+                               for key, histogram in self.histograms.items()],
+            }
+
+    def merge(self, exported):
+        """Adds the series exported by another registry to this one."""
+
+        with self.lock:
+            for key, value in exported['counters']:
+                self.counters[key] = self.counters.get(key, 0) + value
+            for key, *observations in exported['histograms']:
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = Histogram()
+                histogram.merge(*observations)
+
+    def counter_values(self, name):
+        """Returns {labels dict as a sorted tuple: value} for one counter."""
+
+        with self.lock:
+            return {labels: value for (metric, labels), value in self.counters.items() if metric == name}
+
+    def histogram_summaries(self, name):
+        """Returns {labels tuple: summary dict} for one histogram."""
+
+        with self.lock:
+            return {labels: histogram.summary() for (metric, labels), histogram in self.histograms.items()
+                    if metric == name}
+
+    def summary(self):
+        """Returns every series as a JSON-serialisable dict."""
+
+        with self.lock:
+            return {
+                'started_at': self.started_at,
+                'duration_seconds': round(time.time() - self.started_at, 3),
+                'counters': {series_name(name, labels): value
+                             for (name, labels), value in sorted(self.counters.items())},
+                'histograms': {series_name(name, labels): histogram.summary()
+                               for (name, labels), histogram in sorted(self.histograms.items())},
+            }
+
+    def to_prometheus(self):
+        """Renders every series in the Prometheus text exposition format."""
+
+        lines = []
+        with self.lock:
+            typed = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                if name not in typed:
+                    lines.append(f'# TYPE {name} counter')
+                    typed.add(name)
+                lines.append(f'{series_name(name, labels)} {value}')
+
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                if name not in typed:
+                    lines.append(f'# TYPE {name} histogram')
+                    typed.add(name)
+                cumulative = 0
+                for index, bucket_count in enumerate(histogram.counts):
+                    cumulative += bucket_count
+                    bound = repr(histogram.buckets[index]) if index < len(histogram.buckets) else '+Inf'
+                    lines.append(f'{series_name(name + "_bucket", labels + (("le", bound),))} {cumulative}')
+                lines.append(f'{series_name(name + "_sum", labels)} {histogram.sum}')
+                lines.append(f'{series_name(name + "_count", labels)} {histogram.count}')
+
+        return '\n'.join(lines) + '\n'
+
+
+def write_atomically(path, text):
+    """Writes then renames, so readers (e.g. node_exporter's textfile collector) never see a partial file."""
+
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as handle:
+        handle.write(text)
+    os.replace(temp_path, path)
+
+
+def write_json(path, data):
+    write_atomically(path, json.dumps(data, indent=2, default=str) + '\n')
+
+
+# Shared by every module of a run
+metrics = Metrics()
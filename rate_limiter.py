@@ -0,0 +1,198 @@
+import logging
+import multiprocessing
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import requests
+
+from log_config import fields
+from metrics import metrics
+
+log = logging.getLogger(__name__)
+
+# ==============================================================================
+# CONFIGURATION
+# ==============================================================================
+
+# Ceiling for Snipe-IT requests per second across every thread of a run. The
+# limiter lowers this on its own when the server advertises a smaller limit
+# (X-RateLimit-Limit, per minute) or answers with HTTP 429.
+SNIPEIT_MAX_RPS = float(os.getenv("SNIPEIT_MAX_RPS", "10"))
+SNIPEIT_MIN_RPS = float(os.getenv("SNIPEIT_MIN_RPS", "0.2"))
+SNIPEIT_MAX_RETRIES = int(os.getenv("SNIPEIT_MAX_RETRIES", "5"))
+SNIPEIT_BACKOFF_BASE = float(os.getenv("SNIPEIT_BACKOFF_BASE", "1.0"))  # seconds, doubled per retry
+
+# ==============================================================================
+# RATE LIMITER
+# ==============================================================================
+
+class RateLimiter:
+    """
+    Token bucket shared by every Snipe-IT call, with an adaptive refill rate.
+
+    The rate starts at the configured ceiling, is halved on every 429 and
+    creeps back up by 5% of the ceiling per successful response. A 429 also
+    blocks all callers until the server's Retry-After / X-RateLimit-Reset (or
+    an exponential backoff with jitter when neither is sent) has passed.
+    """
+
+    def __init__(self, max_rate=SNIPEIT_MAX_RPS, min_rate=SNIPEIT_MIN_RPS):
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.ceiling = max_rate
+        self.rate = max_rate
+        self.capacity = max(1.0, max_rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until the caller may send one request."""
+
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now >= self.blocked_until:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+                else:
+                    wait = self.blocked_until - now
+            time.sleep(wait)
+
+    def observe(self, response):
+        """Adapts the rate to a non-throttled response and its X-RateLimit-* headers."""
+
+        with self.lock:
+            limit = _header_number(response, 'X-RateLimit-Limit')
+            if limit:
+                # Laravel advertises its limit per minute
+                self.ceiling = max(self.min_rate, min(self.max_rate, limit / 60.0))
+                self.capacity = max(1.0, self.ceiling)
+
+            self.rate = min(self.ceiling, self.rate + self.ceiling * 0.05)
+
+            remaining = _header_number(response, 'X-RateLimit-Remaining')
+            if remaining is not None and remaining <= 0:
+                # The window is spent; don't burn requests finding that out
+                self.tokens = 0.0
+
+    def throttled(self, response, attempt):
+        """Backs off after a 429 and returns the delay imposed on all callers."""
+
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+
+            delay = _retry_after(response)
+            if delay is None:
+                delay = SNIPEIT_BACKOFF_BASE * (2 ** attempt)
+            # Jitter keeps the writer threads from retrying in lockstep
+            delay += random.uniform(0, max(0.1, delay * 0.25))
+
+            now = time.monotonic()
+            self.blocked_until = max(self.blocked_until, now + delay)
+            self.tokens = 0.0
+            self.updated = self.blocked_until
+            return delay
+
+
+def _shared(index):
+    """Property stored in slot index of the limiter's shared array."""
+
+    def get(self):
+        return self.values[index]
+
+    def set(self, value):
+        self.values[index] = value
+
+    return property(get, set)
+
+
+class SharedRateLimiter(RateLimiter):
+    """
+    RateLimiter whose bucket lives in shared memory, for the processes of a sharded run.
+
+    Every process then draws from one budget of SNIPEIT_MAX_RPS and backs off
+    together on a 429, instead of each sending its own SNIPEIT_MAX_RPS.
+    Create it in the parent (context being a multiprocessing context) and hand
+    it to the worker processes when starting them.
+    """
+
+    ceiling, rate, capacity, tokens, updated, blocked_until = (_shared(index) for index in range(6))
+
+    def __init__(self, max_rate=SNIPEIT_MAX_RPS, min_rate=SNIPEIT_MIN_RPS, context=None):
+        context = context or multiprocessing
+        self.values = context.Array('d', 6, lock=False)
+        super().__init__(max_rate, min_rate)
+        # time.monotonic() is system-wide, so 'updated' and 'blocked_until' mean the same in every process
+        self.lock = context.Lock()
+
+
+def _header_number(response, name):
+    """Returns a numeric response header, or None if it is missing or malformed."""
+
+    value = response.headers.get(name)
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+def _retry_after(response):
+    """Returns how long the server asked us to wait, in seconds, if it said so."""
+
+    retry_after = response.headers.get('Retry-After')
+    if retry_after:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+
+    reset = _header_number(response, 'X-RateLimit-Reset')
+    if reset:
+        return max(0.0, reset - time.time())
+
+    return None
+
+
+# Shared by every Snipe-IT call in the process
+limiter = RateLimiter()
+
+def snipeit_request(method, url, rate_limiter=None, session=None, **kwargs):
+    """
+    Sends a Snipe-IT API request through the shared rate limiter.
+
+    Pass a requests.Session to reuse its pooled connections.
+
+    HTTP 429 responses are retried up to SNIPEIT_MAX_RETRIES times after the
+    limiter's backoff; any other response (or the final 429) is returned as is.
+    """
+
+    rate_limiter = rate_limiter or limiter
+    send = session.request if session is not None else requests.request
+
+    for attempt in range(SNIPEIT_MAX_RETRIES + 1):
+        with metrics.timer('snipeit_rate_limit_wait_seconds'):
+            rate_limiter.acquire()
+        response = send(method, url, **kwargs)
+
+        if response.status_code != 429:
+            rate_limiter.observe(response)
+            return response
+
+        metrics.inc('snipeit_throttled_total')
+        if attempt < SNIPEIT_MAX_RETRIES:
+            delay = rate_limiter.throttled(response, attempt)
+            log.warning("Snipe-IT returned 429, retrying in %.1fs", delay,
+                        extra=fields(method=method, url=url, attempt=attempt + 1))
+
+    return response
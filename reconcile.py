@@ -0,0 +1,249 @@
+import argparse
+import csv
+import html
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import requests
+
+from aws_accounts import load_accounts
+from collectors import EC2
+from inventory import (
+    ARCHIVED_STATUS_ID,
+    AWS_ACCOUNTS,
+    LIVE_INSTANCE_STATES,
+    discover_aws_assets,
+    snipeit,
+)
+from log_config import LOG_FORMAT, LOG_LEVEL, configure_logging, fields
+from run_lock import RunLock, RunLockHeld
+from sync_state import SYNC_STATE_PATH, SyncStateStore
+
+log = logging.getLogger('reconcile')
+
+# ==============================================================================
+# CONFIGURATION
+# ==============================================================================
+
+# Snipe-IT assets whose tag starts with this prefix are treated as EC2 instances
+EC2_TAG_PREFIX = os.getenv("RECONCILE_TAG_PREFIX", "i-")
+RECONCILE_ARCHIVE_WORKERS = int(os.getenv("RECONCILE_ARCHIVE_WORKERS", "4"))
+
+# ==============================================================================
+# RECONCILIATION
+# ==============================================================================
+
+def collect_aws_instance_ids(accounts, failures):
+    """Returns the set of live EC2 instance IDs across all accounts and regions."""
+
+    instance_ids = set()
+    lock = threading.Lock()
+
+    def add(batch):
+        with lock:
+            instance_ids.update(asset['asset_tag'] for asset in batch)
+
+    discover_aws_assets(accounts, add, states=LIVE_INSTANCE_STATES, failures=failures, collectors=[EC2])
+    return instance_ids
+
+
+def collect_snipeit_instances():
+    """
+    Returns {asset_tag: {'id': ..., 'status_id': ...}} for every EC2 asset in Snipe-IT's hardware list.
+
+    The list leaves archived assets out (unless show_archived_in_list is
+    on), so these are the assets that could still need archiving.
+    """
+
+    instances = {}
+    for row in snipeit.iter_hardware(workers=8):
+        asset_tag = html.unescape(row.get('asset_tag') or '')
+        if asset_tag.startswith(EC2_TAG_PREFIX):
+            instances[asset_tag] = {'id': row['id'], 'status_id': (row.get('status_label') or {}).get('id')}
+    return instances
+
+
+def archive_assets(orphans):
+    """Moves orphaned assets to ARCHIVED_STATUS_ID concurrently. Returns (archived, failed) tag lists."""
+
+    archived, failed = [], []
+
+    def archive(item):
+        asset_tag, asset_id = item
+        try:
+            response_data = snipeit.update_hardware(asset_id, {'status_id': ARCHIVED_STATUS_ID})
+        except requests.exceptions.RequestException as e:
+            log.error("Failed to archive asset: %s", e, extra=fields(asset_tag=asset_tag))
+            return asset_tag, False
+        if response_data.get('status') != 'success':
+            log.error("Snipe-IT rejected the archive: %s", response_data.get('messages', 'Unknown error'),
+                      extra=fields(asset_tag=asset_tag))
+            return asset_tag, False
+        log.info("Asset archived", extra=fields(asset_tag=asset_tag, snipeit_id=asset_id))
+        return asset_tag, True
+
+    with ThreadPoolExecutor(max_workers=RECONCILE_ARCHIVE_WORKERS) as executor:
+        for asset_tag, success in executor.map(archive, orphans.items()):
+            (archived if success else failed).append(asset_tag)
+
+    return archived, failed
+
+
+def reconcile(accounts, archive=False, force=False):
+    """
+    Compares live EC2 instances with the EC2 assets in Snipe-IT.
+
+    Both sides are read concurrently and reduced to sets keyed on instance ID,
+    so the comparison itself is O(n). Orphans (in Snipe-IT but no longer in
+    EC2) are archived when asked to, unless discovery was incomplete, since a
+    region we could not scan would make all of its instances look terminated.
+    Returns the report as a dict.
+    """
+
+    timings = {}
+    failures = []
+
+    def timed(name, func, *args):
+        started = time.monotonic()
+        result = func(*args)
+        timings[name] = round(time.monotonic() - started, 3)
+        return result
+
+    log.info("Reading EC2 and Snipe-IT")
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        aws_future = executor.submit(timed, 'aws_discovery', collect_aws_instance_ids, accounts, failures)
+        snipeit_future = executor.submit(timed, 'snipeit_fetch', collect_snipeit_instances)
+        aws_ids = aws_future.result()
+        snipeit_assets = snipeit_future.result()
+
+    started = time.monotonic()
+    snipeit_tags = snipeit_assets.keys()
+    matched = aws_ids & snipeit_tags
+    missing = aws_ids - snipeit_tags
+    orphaned = snipeit_tags - aws_ids
+    # Only with show_archived_in_list on does the list include archived assets
+    to_archive = {tag: snipeit_assets[tag]['id'] for tag in orphaned
+                  if snipeit_assets[tag]['status_id'] != ARCHIVED_STATUS_ID}
+    timings['diff'] = round(time.monotonic() - started, 3)
+
+    archived, archive_failed = [], []
+    if archive and to_archive:
+        if failures and not force:
+            log.warning("Not archiving %d orphan(s): discovery was incomplete (%d failure(s)). "
+                        "Re-run with --force to archive anyway.", len(to_archive), len(failures))
+        else:
+            log.info("Archiving %d orphaned asset(s)", len(to_archive))
+            archived, archive_failed = timed('archive', archive_assets, to_archive)
+            forget_archived(archived)
+
+    return {
+        'generated_at': datetime.now(timezone.utc).isoformat(),
+        'discovery_complete': not failures,
+        'discovery_failures': failures,
+        'counts': {
+            'aws_instances': len(aws_ids),
+            'snipeit_instances': len(snipeit_assets),
+            'matched': len(matched),
+            'missing_in_snipeit': len(missing),
+            'orphaned': len(orphaned),
+            'to_archive': len(to_archive),
+            'archived': len(archived),
+            'archive_failed': len(archive_failed),
+        },
+        'timings': timings,
+        'assets': {
+            'missing_in_snipeit': sorted(missing),
+            'orphaned': sorted(to_archive),
+            'archived': sorted(archived),
+            'archive_failed': sorted(archive_failed),
+        },
+    }
+
+
+def forget_archived(asset_tags):
+    """Drops archived assets from the local sync-state cache, if there is one."""
+
+    if not asset_tags or not os.path.exists(SYNC_STATE_PATH):
+        return
+    state = SyncStateStore()
+    try:
+        for asset_tag in asset_tags:
+            state.forget(asset_tag)
+    finally:
+        state.close()
+
+
+def write_report(report, path):
+    """Writes the report as JSON, or as one CSV row per asset and category if path ends in .csv."""
+
+    if path.endswith('.csv'):
+        with open(path, 'w', newline='') as handle:
+            writer = csv.writer(handle)
+            writer.writerow(['category', 'asset_tag'])
+            for category, asset_tags in report['assets'].items():
+                for asset_tag in asset_tags:
+                    writer.writerow([category, asset_tag])
+    else:
+        with open(path, 'w') as handle:
+            json.dump(report, handle, indent=2)
+
+
+def print_summary(report):
+    print("\n--- Reconciliation Summary ---")
+    for category, count in report['counts'].items():
+        print(f"  {category}: {count}")
+    for stage, seconds in report['timings'].items():
+        print(f"  {stage}: {seconds:.2f}s")
+    if not report['discovery_complete']:
+        log.warning("Discovery was incomplete: %d failure(s)", len(report['discovery_failures']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reconcile EC2 instances with the assets in Snipe-IT.")
+    parser.add_argument('--archive', action='store_true',
+                        help=f"move Snipe-IT assets whose instance no longer exists to status {ARCHIVED_STATUS_ID}")
+    parser.add_argument('--force', action='store_true',
+                        help="archive even if some accounts or regions could not be scanned")
+    parser.add_argument('--report', action='append', default=[],
+                        help="write the report to this path (.json or .csv); may be given more than once")
+    parser.add_argument('--log-level', default=LOG_LEVEL,
+                        help=f"DEBUG, INFO, WARNING or ERROR (default: {LOG_LEVEL})")
+    parser.add_argument('--log-format', default=LOG_FORMAT, choices=('text', 'json'),
+                        help=f"log as plain text or one JSON object per line (default: {LOG_FORMAT})")
+    args = parser.parse_args(argv)
+    configure_logging(args.log_level, args.log_format)
+    from botocore.exceptions import BotoCoreError, ClientError
+
+    try:
+        accounts = load_accounts(AWS_ACCOUNTS)
+    except (BotoCoreError, ClientError, ValueError) as e:
+        log.error("Could not load the AWS accounts: %s", e)
+        return 1
+
+    if args.archive:
+        # From reading EC2 to the last archive, no sync may run: an asset it
+        # created for an instance launched after the read would look orphaned
+        try:
+            with RunLock():
+                report = reconcile(accounts, archive=True, force=args.force)
+        except RunLockHeld as e:
+            log.error("Not starting: %s", e)
+            return 1
+    else:
+        report = reconcile(accounts)
+    print_summary(report)
+
+    for path in args.report:
+        write_report(report, path)
+        log.info("Report written to %s", path)
+
+    return 0 if not report['counts']['archive_failed'] else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,57 @@
+import fcntl
+import os
+
+# ==============================================================================
+# CONFIGURATION
+# ==============================================================================
+
+# Lock file held for the whole of an inventory.py run, so two runs (e.g.
+# overlapping cron jobs) never sync the same assets at the same time. The lock
+# is an flock on the file, which the OS drops when its process exits, so a
+# crashed run never leaves a stale lock behind.
+SYNC_LOCK_PATH = os.getenv("SYNC_LOCK_PATH", ".sync.lock")
+
+# ==============================================================================
+# RUN LOCK
+# ==============================================================================
+
+class RunLockHeld(Exception):
+    """Another run holds the lock."""
+
+
+class RunLock:
+    """
+    Exclusive, non-blocking lock on a file, used as a context manager.
+
+    Entering raises RunLockHeld (naming the holder's PID when it wrote one)
+    if another process holds it.
+    """
+
+    def __init__(self, path=SYNC_LOCK_PATH):
+        self.path = path
+        self.handle = None
+
+    def __enter__(self):
+        handle = open(self.path, 'a+', encoding='utf-8')
+        try:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.seek(0)
+            holder = handle.read().strip()
+            handle.close()
+            raise RunLockHeld(f"{self.path} is held by another run" + (f" (PID {holder})" if holder else ""))
+
+        handle.seek(0)
+        handle.truncate()
+        handle.write(f"{os.getpid()}\n")
+        handle.flush()
+        self.handle = handle
+        return self
+
+    def __exit__(self, *exc_info):
+        # Emptied first: a PID left in an unlocked file would only mislead
+        self.handle.truncate(0)
+        fcntl.flock(self.handle.fileno(), fcntl.LOCK_UN)
+        self.handle.close()
+        self.handle = None
+        return False
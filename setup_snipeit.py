@@ -1,253 +1,327 @@
 # setup_snipeit_fixed.py
-import requests
+import argparse
 import os
-from dotenv import load_dotenv
-import json
-
-load_dotenv()
-
-SNIPEIT_API_TOKEN = os.getenv("APP_KEY", "")
-SNIPEIT_BASE_URL = "http://localhost:8000"
-
-headers = {
-    'Authorization': f'Bearer {SNIPEIT_API_TOKEN}',
-    'Accept': 'application/json',
-    'Content-Type': 'application/json'
-}
-
-print("Setting up Snipe-IT for AWS EC2 Assets...\n")
-
-# Step 1: Check/Create Category
-print("1. Checking for existing Asset Category...")
-cat_list_response = requests.get(f"{SNIPEIT_BASE_URL}/api/v1/categories", headers=headers)
-category_id = None
-
-if cat_list_response.status_code == 200:
-    categories = cat_list_response.json()
-    print(f"   Found {categories.get('total', 0)} categories")
-    for cat in categories.get('rows', []):
-        if cat['name'] == 'Cloud Infrastructure':
-            category_id = cat['id']
-            print(f"   ✅ Will use existing category ID: {category_id}")
-            break
-
-if not category_id:
-    print("   Creating new Asset Category...")
-    category_payload = {
-        'name': 'Cloud Infrastructure',
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import requests
+from collectors import AWS_COLLECTORS, EC2, enabled_collectors
+from field_mapping import FIELD_SPECS
+from snipeit_client import SnipeITClient
+from snipeit_metadata import (
+    SNIPEIT_CATEGORY_NAME,
+    SNIPEIT_MANUFACTURER_NAME,
+    SNIPEIT_MODEL_NAME,
+    fetch_listings,
+    index_by_name,
+    invalidate_metadata_cache,
+)
+
+# ==============================================================================
+# CONFIGURATION
+# ==============================================================================
+
+# APP_URL / APP_KEY are read from .env by the shared client
+client = SnipeITClient.from_env()
+
+SNIPEIT_FIELDSET_NAME = os.getenv("SNIPEIT_FIELDSET_NAME", "AWS EC2 Instance")
+SETUP_WORKERS = int(os.getenv("SETUP_WORKERS", "4"))
+
+# The first few fields are shown as columns in Snipe-IT's asset list
+LISTVIEW_FIELDS = 5
+
+# ==============================================================================
+# PLAN
+# ==============================================================================
+
+# One thing to create or link in Snipe-IT.
+#   key      - what the step resolves, e.g. 'model' or 'field:vpc_id'
+#   depends  - keys that must be resolved before the step can run
+#   run      - callable(ids) -> the resolved ID, or None on failure
+Step = namedtuple('Step', 'key description depends run')
+
+SINGULAR = {'categories': 'category', 'manufacturers': 'manufacturer', 'models': 'model',
+            'fields': 'field', 'fieldsets': 'fieldset'}
+
+
+def read_existing():
+    """Reads every category, manufacturer, model, field and fieldset (all pages, concurrently), indexed by name."""
+
+    listings = fetch_listings(client, ('categories', 'manufacturers', 'models', 'fields', 'fieldsets'))
+    return {path: index_by_name(listing['rows']) for path, listing in listings.items()}
+
+
+def succeeded(response_data, description):
+    """Tells whether Snipe-IT reported success, reporting its error messages if not."""
+
+    if response_data.get('status') == 'success':
+        return True
+    print(f"   ❌ {description}: {response_data.get('messages')}")
+    return False
+
+
+def created_id(response_data, description):
+    """Returns the new object's ID from a create response, or None after reporting the error."""
+
+    return response_data['payload']['id'] if succeeded(response_data, description) else None
+
+
+def build_plan(existing, collectors=()):
+    """
+    Works out what has to be created or linked, given what already exists.
+
+    Returns (ids, steps): ids maps keys to the IDs of things that already
+    exist; steps are what is left to do, each naming the keys it depends on.
+    The category, manufacturer, fieldset and custom fields do not depend on
+    each other; the model needs the first three, and every field is linked to
+    the fieldset once both exist. Besides the EC2 model, every other collector
+    in collectors gets a model ('model:<name>') using the same fieldset.
+    """
+
+    ids = {}
+    steps = []
+
+    def ensure(key, path, name, create, depends=()):
+        row = existing[path].get(name)
+        if row is not None:
+            ids[key] = row['id']
+            return row
+        description = f"Create {SINGULAR[path]} '{name}'"
+        steps.append(Step(key, description, depends, lambda ids: created_id(create(ids), description)))
+        return None
+
+    ensure('category', 'categories', SNIPEIT_CATEGORY_NAME, lambda ids: client.create_category({
+        'name': SNIPEIT_CATEGORY_NAME,
         'category_type': 'asset',
-        'eula': False
-    }
-    
-    cat_response = requests.post(
-        f"{SNIPEIT_BASE_URL}/api/v1/categories",
-        headers=headers,
-        json=category_payload
-    )
-    
-    if cat_response.status_code == 200:
-        cat_data = cat_response.json()
-        if cat_data.get('status') == 'success':
-            category_id = cat_data['payload']['id']
-            print(f"   ✅ Category created with ID: {category_id}")
-        else:
-            print(f"   ❌ Error: {cat_data}")
-            exit(1)
-
-# Step 2: Check/Create Manufacturer
-print("\n2. Checking for existing Manufacturer...")
-mfg_list_response = requests.get(f"{SNIPEIT_BASE_URL}/api/v1/manufacturers", headers=headers)
-manufacturer_id = None
-
-if mfg_list_response.status_code == 200:
-    manufacturers = mfg_list_response.json()
-    for mfg in manufacturers.get('rows', []):
-        if mfg['name'] == 'Amazon Web Services':
-            manufacturer_id = mfg['id']
-            print(f"   ✅ Found existing manufacturer with ID: {manufacturer_id}")
-            break
-
-if not manufacturer_id:
-    print("   Creating new Manufacturer...")
-    mfg_payload = {
-        'name': 'Amazon Web Services',
-        'url': 'https://aws.amazon.com'
-    }
-    
-    mfg_response = requests.post(
-        f"{SNIPEIT_BASE_URL}/api/v1/manufacturers",
-        headers=headers,
-        json=mfg_payload
-    )
-    
-    if mfg_response.status_code == 200:
-        mfg_data = mfg_response.json()
-        if mfg_data.get('status') == 'success':
-            manufacturer_id = mfg_data['payload']['id']
-            print(f"   ✅ Manufacturer created with ID: {manufacturer_id}")
-
-# Step 3: Check/Create Model
-print("\n3. Checking for existing Asset Model...")
-model_list_response = requests.get(f"{SNIPEIT_BASE_URL}/api/v1/models", headers=headers)
-model_id = None
-
-if model_list_response.status_code == 200:
-    models = model_list_response.json()
-    for model in models.get('rows', []):
-        if model['name'] == 'EC2 Instance':
-            model_id = model['id']
-            print(f"   ✅ Found existing model with ID: {model_id}")
-            break
-
-if not model_id:
-    print("   Creating new Asset Model...")
-    model_payload = {
-        'name': 'EC2 Instance',
-        'manufacturer_id': manufacturer_id,
-        'category_id': category_id,
-        'model_number': 'EC2'
-    }
-    
-    model_response = requests.post(
-        f"{SNIPEIT_BASE_URL}/api/v1/models",
-        headers=headers,
-        json=model_payload
-    )
-    
-    if model_response.status_code == 200:
-        model_data = model_response.json()
-        if model_data.get('status') == 'success':
-            model_id = model_data['payload']['id']
-            print(f"   ✅ Model created with ID: {model_id}")
-
-# Step 4: Create Custom Fields
-print("\n4. Creating Custom Fields...")
-
-custom_fields = [
-    {'name': 'Instance Type', 'format': 'ANY', 'element': 'text'},
-    {'name': 'Description', 'format': 'ANY', 'element': 'textarea'},
-    {'name': 'Private IP Address', 'format': 'IP', 'element': 'text'},
-    {'name': 'Public IP Address', 'format': 'IP', 'element': 'text'},
-    {'name': 'Platform', 'format': 'ANY', 'element': 'text'},
-    {'name': 'VPC ID', 'format': 'ANY', 'element': 'text'},
-    {'name': 'DNS Name', 'format': 'ANY', 'element': 'text'},
-    {'name': 'MAC Address', 'format': 'MAC', 'element': 'text'},
-    {'name': 'Vendor Support End Date', 'format': 'ANY', 'element': 'text'},
-    {'name': 'Criticality', 'format': 'ANY', 'element': 'text'},
-    {'name': 'Asset Owner', 'format': 'ANY', 'element': 'text'},
-    {'name': 'AWS Region', 'format': 'ANY', 'element': 'text'},
-    {'name': 'AWS Account', 'format': 'ANY', 'element': 'text'},
-    {'name': 'Availability Zone', 'format': 'ANY', 'element': 'text'},
-    {'name': 'Subnet ID', 'format': 'ANY', 'element': 'text'},
-    {'name': 'Security Groups', 'format': 'ANY', 'element': 'textarea'},
-    {'name': 'Instance State', 'format': 'ANY', 'element': 'text'},
-    {'name': 'Launch Time', 'format': 'ANY', 'element': 'text'},
-    {'name': 'AMI ID', 'format': 'ANY', 'element': 'text'},
-    {'name': 'Architecture', 'format': 'ANY', 'element': 'text'},
-    {'name': 'Root Device Type', 'format': 'ANY', 'element': 'text'},
-    {'name': 'Virtualization Type', 'format': 'ANY', 'element': 'text'},
-]
-
-# Get existing custom fields first
-existing_fields = {}
-fields_list_response = requests.get(f"{SNIPEIT_BASE_URL}/api/v1/fields", headers=headers)
-if fields_list_response.status_code == 200:
-    fields_data = fields_list_response.json()
-    for field in fields_data.get('rows', []):
-        # Use .get() to safely access db_column
-        existing_fields[field['name']] = {
-            'id': field['id'],
-            'db_column': field.get('db_column', field.get('db_column_name', f"_snipeit_{field['name'].lower().replace(' ', '_')}_{field['id']}"))
-        }
-    print(f"   Found {len(existing_fields)} existing custom fields")
-
-field_ids = {}
-
-for idx, field in enumerate(custom_fields, 1):
-    # Check if field already exists
-    if field['name'] in existing_fields:
-        field_id = existing_fields[field['name']]['id']
-        db_column = existing_fields[field['name']]['db_column']
-        field_ids[field['name']] = {'id': field_id, 'db_column': db_column}
-        print(f"   ✅ Using existing '{field['name']}' (ID: {field_id})")
-        continue
-    
-    # Create new field
-    field_payload = {
-        'name': field['name'],
-        'element': field['element'],
-        'format': field['format'],
+        'eula': False,
+    }))
+
+    ensure('manufacturer', 'manufacturers', SNIPEIT_MANUFACTURER_NAME, lambda ids: client.create_manufacturer({
+        'name': SNIPEIT_MANUFACTURER_NAME,
+        'url': 'https://aws.amazon.com',
+    }))
+
+    # An existing model keeps the fieldset it already has
+    model = existing['models'].get(SNIPEIT_MODEL_NAME)
+    model_fieldset_id = ((model or {}).get('fieldset') or {}).get('id')
+    if model_fieldset_id:
+        ids['fieldset'] = model_fieldset_id
+        fieldset = next((row for row in existing['fieldsets'].values() if row['id'] == model_fieldset_id), None)
+    else:
+        fieldset = ensure('fieldset', 'fieldsets', SNIPEIT_FIELDSET_NAME, lambda ids: client.create_fieldset({
+            'name': SNIPEIT_FIELDSET_NAME,
+        }))
+
+    if model is None:
+        ensure('model', 'models', SNIPEIT_MODEL_NAME, lambda ids: client.create_model({
+            'name': SNIPEIT_MODEL_NAME,
+            'manufacturer_id': ids['manufacturer'],
+            'category_id': ids['category'],
+            'fieldset_id': ids['fieldset'],
+            'model_number': 'EC2',
+        }), depends=('category', 'manufacturer', 'fieldset'))
+    else:
+        ids['model'] = model['id']
+        if not model_fieldset_id:
+            description = f"Attach fieldset '{SNIPEIT_FIELDSET_NAME}' to model '{SNIPEIT_MODEL_NAME}'"
+            steps.append(Step('model_fieldset', description, ('fieldset',),
+                              lambda ids: update_model_fieldset(ids, 'model', description)))
+
+    for collector in collectors:
+        if collector is EC2:
+            continue
+        key = f'model:{collector.name}'
+        resource_model = ensure(key, 'models', collector.model_name, model_creator(collector),
+                                depends=('category', 'manufacturer', 'fieldset'))
+        if resource_model is not None and not (resource_model.get('fieldset') or {}).get('id'):
+            description = f"Attach the fieldset to model '{collector.model_name}'"
+            steps.append(Step(f'{key}_fieldset', description, ('fieldset',),
+                              lambda ids, key=key, description=description: update_model_fieldset(ids, key, description)))
+
+    linked = {field['id'] for field in ((fieldset or {}).get('fields') or {}).get('rows', [])}
+    for position, spec in enumerate(FIELD_SPECS):
+        field = ensure(f'field:{spec.key}', 'fields', spec.name, field_creator(spec, position))
+        if field is None or field['id'] not in linked:
+            # The field's place in the fieldset is fixed here, not by whichever link lands first
+            description = f"Link field '{spec.name}' to the fieldset"
+            steps.append(Step(f'link:{spec.key}', description, (f'field:{spec.key}', 'fieldset'),
+                              lambda ids, key=spec.key, order=position, description=description:
+                              link_field(ids, key, order, description)))
+
+    return ids, steps
+
+
+def field_creator(spec, position):
+    return lambda ids: client.create_field({
+        'name': spec.name,
+        'element': spec.element,
+        'format': spec.format,
         'custom_format': '',
         'field_encrypted': False,
-        'show_in_listview': True if idx <= 5 else False,
-    }
-    
-    field_response = requests.post(
-        f"{SNIPEIT_BASE_URL}/api/v1/fields",
-        headers=headers,
-        json=field_payload
-    )
-    
-    if field_response.status_code == 200:
-        field_data = field_response.json()
-        if field_data.get('status') == 'success':
-            field_id = field_data['payload']['id']
-            db_column = field_data['payload'].get('db_column_name', field_data['payload'].get('db_column', f"_snipeit_{field['name'].lower().replace(' ', '_')}_{field_id}"))
-            field_ids[field['name']] = {'id': field_id, 'db_column': db_column}
-            print(f"   ✅ Created '{field['name']}' (ID: {field_id})")
-        else:
-            print(f"   ⚠️  Field '{field['name']}': {field_data.get('messages')}")
-    else:
-        print(f"   ❌ Error creating '{field['name']}': {field_response.status_code}")
-
-# Merge existing and new fields
-all_fields = {**existing_fields, **field_ids}
-
-# Print Summary
-print(f"\n{'='*70}")
-print("✅ SETUP COMPLETE!")
-print(f"{'='*70}")
-print(f"\n🔧 Copy this configuration to your inventory.py:\n")
-print(f"DEFAULT_CATEGORY_ID = {category_id}  # Cloud Infrastructure")
-print(f"DEFAULT_MODEL_ID = {model_id}  # EC2 Instance")
-print(f"DEFAULT_STATUS_ID = 2  # Ready to Deploy\n")
-print("CUSTOM_FIELD_MAP = {")
-
-# Create the mapping in order
-mapping_keys = [
-    ('instance_type', 'Instance Type'),
-    ('description', 'Description'),
-    ('private_ip', 'Private IP Address'),
-    ('public_ip', 'Public IP Address'),
-    ('platform', 'Platform'),
-    ('vpc_id', 'VPC ID'),
-    ('dns_name', 'DNS Name'),
-    ('mac_address', 'MAC Address'),
-    ('vendor_support_end', 'Vendor Support End Date'),
-    ('criticity', 'Criticality'),
-    ('asset_owner', 'Asset Owner'),
-    ('aws_region', 'AWS Region'),
-    ('aws_account', 'AWS Account'),
-    ('availability_zone', 'Availability Zone'),
-    ('subnet_id', 'Subnet ID'),
-    ('security_groups', 'Security Groups'),
-    ('instance_state', 'Instance State'),
-    ('launch_time', 'Launch Time'),
-    ('ami_id', 'AMI ID'),
-    ('architecture', 'Architecture'),
-    ('root_device_type', 'Root Device Type'),
-    ('virtualization_type', 'Virtualization Type'),
-]
-
-for key, field_name in mapping_keys:
-    if field_name in all_fields:
-        print(f"    '{key}': {all_fields[field_name]['id']},")
-
-print("}")
-
-print(f"\n{'='*70}")
-print("Field IDs Summary:")
-print(f"{'='*70}")
-for key, field_name in mapping_keys:
-    if field_name in all_fields:
-        print(f"{field_name}: ID={all_fields[field_name]['id']}, Column={all_fields[field_name]['db_column']}")
\ No newline at end of file
+        'show_in_listview': position < LISTVIEW_FIELDS,
+    })
+
+
+def model_creator(collector):
+    return lambda ids: client.create_model({
+        'name': collector.model_name,
+        'manufacturer_id': ids['manufacturer'],
+        'category_id': ids['category'],
+        'fieldset_id': ids['fieldset'],
+        'model_number': collector.name.upper(),
+    })
+
+
+def update_model_fieldset(ids, model_key, description):
+    response_data = client.update_model(ids[model_key], {'fieldset_id': ids['fieldset']})
+    return ids['fieldset'] if succeeded(response_data, description) else None
+
+
+def link_field(ids, key, order, description):
+    # Snipe-IT answers success without duplicating if the field is already linked
+    response_data = client.associate_field(ids[f'field:{key}'], ids['fieldset'], order)
+    return ids['fieldset'] if succeeded(response_data, description) else None
+
+
+def print_plan(ids, steps):
+    print("Already in Snipe-IT:")
+    for key, object_id in ids.items():
+        print(f"   ✅ {key} (ID: {object_id})")
+
+    if not steps:
+        print("\nNothing to do.")
+        return
+
+    print(f"\nPlan ({len(steps)} step(s)):")
+    for number, step in enumerate(steps, 1):
+        after = f"  [after {', '.join(step.depends)}]" if step.depends else ""
+        print(f"   {number}. {step.description}{after}")
+
+# ==============================================================================
+# EXECUTION
+# ==============================================================================
+
+def run_plan(ids, steps, workers=SETUP_WORKERS):
+    """
+    Runs the plan's steps concurrently, each as soon as its dependencies are resolved.
+
+    Resolved IDs are added to ids. A step that raises a request error or
+    gets a malformed response (not JSON, or missing its payload) fails, and
+    a step whose dependency failed is skipped. Returns the keys of the steps that failed or were skipped.
+    """
+
+    pending = {step.key: step for step in steps}
+    failed = set()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        in_flight = {}
+
+        def submit_ready():
+            progress = True
+            while progress:
+                progress = False
+                for key, step in list(pending.items()):
+                    if any(dep in failed for dep in step.depends):
+                        print(f"   ⏭️  Skipped: {step.description}")
+                        failed.add(pending.pop(key).key)
+                        progress = True
+                    elif all(dep in ids for dep in step.depends):
+                        in_flight[executor.submit(step.run, ids)] = pending.pop(key)
+
+        submit_ready()
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                step = in_flight.pop(future)
+                try:
+                    result = future.result()
+                except requests.exceptions.HTTPError as e:
+                    print(f"   ❌ {step.description}: {e.response.status_code}")
+                    result = None
+                except requests.exceptions.RequestException as e:
+                    print(f"   ❌ {step.description}: {e}")
+                    result = None
+                except ValueError as e:
+                    print(f"   ❌ {step.description}: the response is not JSON ({e})")
+                    result = None
+                except (KeyError, TypeError) as e:
+                    print(f"   ❌ {step.description}: unexpected response ({type(e).__name__}: {e})")
+                    result = None
+
+                if result is None:
+                    failed.add(step.key)
+                else:
+                    ids[step.key] = result
+                    print(f"   ✅ {step.description} (ID: {result})")
+            submit_ready()
+
+    # Anything still pending depends on a key nothing resolves
+    failed.update(pending)
+    return failed
+
+
+def print_summary(ids):
+    print(f"\n{'='*70}")
+    print("✅ SETUP COMPLETE!")
+    print(f"{'='*70}")
+    print("\ninventory.py resolves these IDs from Snipe-IT by name at startup.")
+    print(f"🔧 Only needed with SNIPEIT_AUTO_RESOLVE=false - copy this configuration to your inventory.py:\n")
+    print(f"DEFAULT_CATEGORY_ID = {ids.get('category')}  # {SNIPEIT_CATEGORY_NAME}")
+    print(f"DEFAULT_MODEL_ID = {ids.get('model')}  # {SNIPEIT_MODEL_NAME}")
+    print(f"DEFAULT_STATUS_ID = 2  # Ready to Deploy\n")
+    resource_models = {key.split(':', 1)[1]: object_id for key, object_id in ids.items() if key.startswith('model:')}
+    if resource_models:
+        print("RESOURCE_MODEL_IDS = {")
+        for name, object_id in resource_models.items():
+            print(f"    '{name}': {object_id},")
+        print("}\n")
+    print("CUSTOM_FIELD_MAP = {")
+    for spec in FIELD_SPECS:
+        if f'field:{spec.key}' in ids:
+            print(f"    '{spec.key}': {ids[f'field:{spec.key}']},")
+    print("}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Create the Snipe-IT category, model, custom fields and fieldset for EC2 assets.")
+    parser.add_argument('--dry-run', action='store_true', help="print the plan without changing anything")
+    parser.add_argument('--collectors', default=AWS_COLLECTORS, metavar='NAMES',
+                        help=f"resource types to create models for, comma-separated (default: {AWS_COLLECTORS})")
+    parser.add_argument('--workers', type=int, default=SETUP_WORKERS,
+                        help=f"steps run concurrently (default: {SETUP_WORKERS})")
+    args = parser.parse_args(argv)
+    try:
+        collectors = enabled_collectors(args.collectors)
+    except ValueError as e:
+        parser.error(str(e))
+
+    print("Setting up Snipe-IT for AWS EC2 Assets...\n")
+
+    try:
+        existing = read_existing()
+    except requests.exceptions.RequestException as e:
+        print(f"❌ Error reading Snipe-IT: {e}")
+        return 1
+
+    ids, steps = build_plan(existing, collectors)
+    print_plan(ids, steps)
+    if args.dry_run:
+        return 0
+
+    if steps:
+        print("\nApplying plan...")
+        failed = run_plan(ids, steps, workers=args.workers)
+
+        # inventory.py caches these lookups; make its next run see what was just created
+        invalidate_metadata_cache()
+
+        if failed:
+            print(f"\n❌ {len(failed)} step(s) failed or were skipped; re-run to retry them.")
+            return 1
+
+    print_summary(ids)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
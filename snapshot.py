@@ -0,0 +1,349 @@
+import argparse
+import gzip
+import heapq
+import json
+import os
+import sys
+import tempfile
+import threading
+from datetime import datetime, timezone
+
+from field_mapping import InstanceRecord, ResourceRecord
+
+# ==============================================================================
+# CONFIGURATION
+# ==============================================================================
+
+# Every inventory.py run writes what it discovered to SYNC_SNAPSHOT_PATH, as
+# gzipped JSON lines sorted by asset tag: one header line, then one line per
+# record with the attributes the field spec reads. The previous run's snapshot
+# is kept next to it (.inventory_snapshot.previous.jsonl.gz), so
+# `python snapshot.py diff` shows what changed between the last two runs, and
+# `inventory.py --from-snapshot` replays one into Snipe-IT without calling AWS.
+SYNC_SNAPSHOT_PATH = os.getenv("SYNC_SNAPSHOT_PATH", ".inventory_snapshot.jsonl.gz")
+
+# Records kept in memory before a sorted run is spilled to a temporary file
+SNAPSHOT_SORT_CHUNK = int(os.getenv("SNAPSHOT_SORT_CHUNK", "50000"))
+
+SNAPSHOT_FORMAT = 'aws-inventory-snapshot'
+SNAPSHOT_VERSION = 1
+
+RECORD_TYPES = {record_type.__name__: record_type for record_type in (InstanceRecord, ResourceRecord)}
+
+# ==============================================================================
+# RECORDS
+# ==============================================================================
+
+def record_values(record):
+    """Returns a record's attributes as a dict."""
+
+    return {name: getattr(record, name) for name in type(record).__slots__}
+
+
+def restore_record(entry):
+    """Rebuilds the InstanceRecord or ResourceRecord of a snapshot entry; attributes it lacks are None."""
+
+    record_type = RECORD_TYPES[entry['type']]
+    record = record_type.__new__(record_type)
+    values = entry['values']
+    for name in record_type.__slots__:
+        setattr(record, name, values.get(name))
+    record.tags = record.tags or {}
+    if record_type is InstanceRecord:
+        record.security_group_ids = tuple(record.security_group_ids or ())
+    return record
+
+
+def variant_path(path, label):
+    """Returns a labelled sibling of a snapshot path: x.jsonl.gz -> x.<label>.jsonl.gz."""
+
+    for extension in ('.jsonl.gz', '.gz'):
+        if path.endswith(extension):
+            return f"{path[:-len(extension)]}.{label}{extension}"
+    return f"{path}.{label}"
+
+
+def previous_path(path):
+    return variant_path(path, 'previous')
+
+# ==============================================================================
+# WRITING
+# ==============================================================================
+
+def _write_snapshot(path, header, lines, keep_previous):
+    """Writes header and the (already sorted) lines to path through a temporary file; returns the line count."""
+
+    count = 0
+    temp_path = f"{path}.tmp"
+    with gzip.open(temp_path, 'wt', encoding='utf-8') as handle:
+        handle.write(json.dumps(header, separators=(',', ':')) + '\n')
+        for line in lines:
+            handle.write(line)
+            handle.write('\n')
+            count += 1
+    if keep_previous and os.path.exists(path):
+        os.replace(path, previous_path(path))
+    os.replace(temp_path, path)
+    return count
+
+
+def _unique(lines_by_tag):
+    """Drops repeated asset tags from sorted (asset_tag, line) pairs, keeping the first."""
+
+    previous = None
+    for asset_tag, line in lines_by_tag:
+        if asset_tag != previous:
+            previous = asset_tag
+            yield line
+
+
+class SnapshotWriter:
+    """
+    Collects a run's records and writes them as one snapshot sorted by asset tag.
+
+    Shared by all discovery threads. Records are serialised as they arrive;
+    every SNAPSHOT_SORT_CHUNK of them are sorted and spilled to a temporary
+    file next to the snapshot, and close() merges those runs into it (an
+    external merge sort), so memory stays bounded whatever the fleet size.
+    """
+
+    def __init__(self, path=SYNC_SNAPSHOT_PATH, chunk=SNAPSHOT_SORT_CHUNK, keep_previous=True):
+        self.path = path
+        self.chunk = chunk
+        self.keep_previous = keep_previous
+        self.lock = threading.Lock()
+        self.buffer = []
+        self.runs = []
+        self.collectors = set()
+
+    def add(self, collector, record):
+        line = json.dumps({'asset_tag': record.asset_tag, 'collector': collector, 'type': type(record).__name__,
+                           'values': record_values(record)}, sort_keys=True, separators=(',', ':'))
+        with self.lock:
+            self.collectors.add(collector)
+            self.buffer.append((record.asset_tag, line))
+            if len(self.buffer) >= self.chunk:
+                self._spill()
+
+    def _spill(self):
+        # Called with self.lock held. json.dumps() escapes tabs, so the first one ends the tag.
+        self.buffer.sort()
+        descriptor, run_path = tempfile.mkstemp(prefix=os.path.basename(self.path) + '.', suffix='.run',
+                                                dir=os.path.dirname(os.path.abspath(self.path)))
+        with os.fdopen(descriptor, 'w', encoding='utf-8') as handle:
+            for asset_tag, line in self.buffer:
+                handle.write(f"{json.dumps(asset_tag)}\t{line}\n")
+        self.runs.append(run_path)
+        self.buffer = []
+
+    @staticmethod
+    def _read_run(run_path):
+        with open(run_path, encoding='utf-8') as handle:
+            for raw in handle:
+                separator = raw.index('\t')
+                yield json.loads(raw[:separator]), raw[separator + 1:-1]
+
+    def close(self, complete=True):
+        """
+        Writes the snapshot and removes the temporary runs; returns the number of records written.
+
+        complete=False marks a snapshot of a run that did not scan everything
+        (failures, --resume), so diff can warn that its removals are unreliable.
+        """
+
+        with self.lock:
+            self.buffer.sort()
+            sources = [iter(self.buffer)] + [self._read_run(run_path) for run_path in self.runs]
+            header = {
+                'format': SNAPSHOT_FORMAT, 'version': SNAPSHOT_VERSION,
+                'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                'complete': complete, 'collectors': sorted(self.collectors),
+            }
+            try:
+                return _write_snapshot(self.path, header, _unique(heapq.merge(*sources)), self.keep_previous)
+            finally:
+                self._remove_runs()
+
+    def discard(self):
+        """Drops everything collected without writing a snapshot."""
+
+        with self.lock:
+            self._remove_runs()
+
+    def _remove_runs(self):
+        for run_path in self.runs:
+            try:
+                os.remove(run_path)
+            except OSError:
+                pass
+        self.runs = []
+        self.buffer = []
+
+# ==============================================================================
+# READING, MERGING AND DIFFING
+# ==============================================================================
+
+def read_snapshot(path):
+    """
+    Opens a snapshot; returns (header, entries).
+
+    entries yields {'asset_tag', 'collector', 'type', 'values'} in asset tag
+    order, one line at a time, and raises ValueError if the file turns out
+    not to be sorted. Raises ValueError for a file that is not a snapshot.
+    """
+
+    handle = gzip.open(path, 'rt', encoding='utf-8')
+    try:
+        header = json.loads(handle.readline() or 'null')
+    except (OSError, ValueError) as e:
+        handle.close()
+        raise ValueError(f"{path} is not a snapshot: {e}")
+    if not isinstance(header, dict) or header.get('format') != SNAPSHOT_FORMAT:
+        handle.close()
+        raise ValueError(f"{path} is not a snapshot")
+
+    def entries():
+        with handle:
+            previous = None
+            for line in handle:
+                entry = json.loads(line)
+                if previous is not None and entry['asset_tag'] <= previous:
+                    raise ValueError(f"{path} is not sorted by asset tag (at {entry['asset_tag']})")
+                previous = entry['asset_tag']
+                yield entry
+
+    return header, entries()
+
+
+def merge_snapshots(paths, path, keep_previous=True):
+    """Merges sorted snapshots (e.g. the parts written by the shards of a run) into one; returns its record count."""
+
+    opened = [read_snapshot(part) for part in paths]
+    header = {
+        'format': SNAPSHOT_FORMAT, 'version': SNAPSHOT_VERSION,
+        'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'complete': all(part_header.get('complete') for part_header, _ in opened),
+        'collectors': sorted({name for part_header, _ in opened for name in part_header.get('collectors', ())}),
+    }
+    merged = heapq.merge(*(entries for _, entries in opened), key=lambda entry: entry['asset_tag'])
+    lines = ((entry['asset_tag'], json.dumps(entry, sort_keys=True, separators=(',', ':'))) for entry in merged)
+    return _write_snapshot(path, header, _unique(lines), keep_previous)
+
+
+def diff_entries(old, new):
+    """
+    Yields (change, old entry, new entry) for every asset added, removed or changed between two entry streams.
+
+    Both must be sorted by asset tag; they are walked once, side by side,
+    so time is linear and memory constant in the snapshots' size. change is
+    'added' (old entry None), 'removed' (new entry None) or 'changed'.
+    """
+
+    old_entry = next(old, None)
+    new_entry = next(new, None)
+    while old_entry is not None or new_entry is not None:
+        if new_entry is None or (old_entry is not None and old_entry['asset_tag'] < new_entry['asset_tag']):
+            yield 'removed', old_entry, None
+            old_entry = next(old, None)
+        elif old_entry is None or new_entry['asset_tag'] < old_entry['asset_tag']:
+            yield 'added', None, new_entry
+            new_entry = next(new, None)
+        else:
+            if old_entry != new_entry:
+                yield 'changed', old_entry, new_entry
+            old_entry = next(old, None)
+            new_entry = next(new, None)
+
+
+def changed_fields(old_entry, new_entry):
+    """Returns [(field, old value, new value)] between two entries of one asset; tags are compared one by one."""
+
+    changes = []
+    if old_entry['collector'] != new_entry['collector']:
+        changes.append(('collector', old_entry['collector'], new_entry['collector']))
+    old_values = old_entry['values']
+    new_values = new_entry['values']
+    for name in sorted(set(old_values) | set(new_values)):
+        if name == 'tags':
+            continue
+        if old_values.get(name) != new_values.get(name):
+            changes.append((name, old_values.get(name), new_values.get(name)))
+    old_tags = old_values.get('tags') or {}
+    new_tags = new_values.get('tags') or {}
+    for key in sorted(set(old_tags) | set(new_tags)):
+        if old_tags.get(key) != new_tags.get(key):
+            changes.append((f"tags.{key}", old_tags.get(key), new_tags.get(key)))
+    return changes
+
+# ==============================================================================
+# MAIN
+# ==============================================================================
+
+def print_diff(old_path, new_path, summary_only=False, as_json=False):
+    """Prints the differences between two snapshots; returns {'added', 'removed', 'changed'} counts."""
+
+    old_header, old_entries = read_snapshot(old_path)
+    new_header, new_entries = read_snapshot(new_path)
+    for path, header in ((old_path, old_header), (new_path, new_header)):
+        if not header.get('complete'):
+            print(f"[WARNING] {path} is from a run that did not scan everything; "
+                  f"its missing assets show up as added/removed", file=sys.stderr)
+
+    counts = {'added': 0, 'removed': 0, 'changed': 0}
+    for change, old_entry, new_entry in diff_entries(old_entries, new_entries):
+        counts[change] += 1
+        if summary_only:
+            continue
+        entry = new_entry or old_entry
+        fields = changed_fields(old_entry, new_entry) if change == 'changed' else []
+        if as_json:
+            print(json.dumps({'change': change, 'asset_tag': entry['asset_tag'], 'collector': entry['collector'],
+                              'fields': [{'field': name, 'old': old, 'new': new} for name, old, new in fields]}))
+        elif change == 'changed':
+            details = '; '.join(f"{name}: {old} -> {new}" for name, old, new in fields)
+            print(f"~ {entry['asset_tag']}  {details}")
+        else:
+            values = entry['values']
+            print(f"{'+' if change == 'added' else '-'} {entry['asset_tag']}  "
+                  f"({entry['collector']}, {values.get('account_name')}, {values.get('region_name')})")
+
+    if not as_json:
+        print(f"{counts['added']} added, {counts['removed']} removed, {counts['changed']} changed")
+    return counts
+
+
+def add_diff_arguments(parser):
+    parser.add_argument('old', nargs='?', default=previous_path(SYNC_SNAPSHOT_PATH),
+                        help=f"older snapshot (default: {previous_path(SYNC_SNAPSHOT_PATH)})")
+    parser.add_argument('new', nargs='?', default=SYNC_SNAPSHOT_PATH,
+                        help=f"newer snapshot (default: {SYNC_SNAPSHOT_PATH})")
+    parser.add_argument('--summary', action='store_true', help="only print the counts")
+    parser.add_argument('--json', action='store_true', help="print one JSON object per difference")
+
+
+def diff_main(argv=None):
+    parser = argparse.ArgumentParser(description="Show the assets added, removed and changed between two snapshots.")
+    add_diff_arguments(parser)
+    return run_diff(parser.parse_args(argv))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect the inventory snapshots written by inventory.py.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    add_diff_arguments(subparsers.add_parser(
+        'diff', help="show the assets added, removed and changed between two snapshots"))
+    return run_diff(parser.parse_args(argv))
+
+
+def run_diff(args):
+    try:
+        counts = print_diff(args.old, args.new, summary_only=args.summary, as_json=args.json)
+    except (OSError, ValueError) as e:
+        print(f"[ERROR] {e}", file=sys.stderr)
+        return 2
+    # Like diff(1): 0 if the snapshots match, 1 if they differ
+    return 1 if any(counts.values()) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,265 @@
+import os
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from metrics import metrics
+from rate_limiter import limiter, snipeit_request
+
+# Load environment variables from .env file
+load_dotenv()
+
+# ==============================================================================
+# CONFIGURATION
+# ==============================================================================
+
+SNIPEIT_URL = os.getenv("APP_URL", "http://localhost:8000").rstrip('/')
+SNIPEIT_API_KEY = os.getenv("APP_KEY", "")
+
+SNIPEIT_TIMEOUT = float(os.getenv("SNIPEIT_TIMEOUT", "30"))
+SNIPEIT_POOL_SIZE = int(os.getenv("SNIPEIT_POOL_SIZE", "16"))  # keep >= the number of threads sharing a client
+SNIPEIT_PAGE_SIZE = int(os.getenv("SNIPEIT_PAGE_SIZE", "500"))  # Snipe-IT caps this at MAX_RESULTS (500 by default)
+
+# Status label that terminated instances' assets are moved to (reconcile.py,
+# event_sync.py, sync_plan.py) and that check_assets.py counts separately.
+# Retrieve the ID from your Snipe-IT Admin interface.
+ARCHIVED_STATUS_ID = 3   # Archived
+
+# Numeric path segments (hardware/123) are replaced in metric labels
+ENDPOINT_ID = re.compile(r'/\d+(?=/|$)')
+
+# ==============================================================================
+# CLIENT
+# ==============================================================================
+
+class SnipeITClient:
+    """
+    Thin Snipe-IT API client shared by inventory.py, check_assets.py and setup_snipeit.py.
+
+    One requests.Session with a pooled, keep-alive HTTPAdapter serves every
+    call, so TCP/TLS setup happens once per connection instead of once per
+    request. Idempotent methods are retried on connection errors and 5xx
+    gateway responses; HTTP 429 is left to the shared rate limiter.
+    """
+
+    def __init__(self, base_url=SNIPEIT_URL, api_key=SNIPEIT_API_KEY, timeout=SNIPEIT_TIMEOUT,
+                 pool_size=SNIPEIT_POOL_SIZE, rate_limiter=limiter):
+        self.base_url = base_url.rstrip('/')
+        self.api_url = f"{self.base_url}/api/v1"
+        self.timeout = timeout
+        self.rate_limiter = rate_limiter
+
+        retry = Retry(
+            total=3,
+            backoff_factor=0.5,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({
+            'Authorization': f'Bearer {api_key}',
+            'Accept': 'application/json',
+            'Accept-Encoding': 'gzip, deflate',
+            'Connection': 'keep-alive',
+        })
+
+    @classmethod
+    def from_env(cls):
+        """Builds a client from APP_URL / APP_KEY and the SNIPEIT_* settings."""
+        return cls()
+
+    # --------------------------------------------------------------------------
+    # Generic requests
+    # --------------------------------------------------------------------------
+
+    def request(self, method, path, **kwargs):
+        """
+        Sends a rate-limited request to an /api/v1 path and returns the raw response.
+
+        Latency (including rate-limit waits and 429 retries) and response
+        codes are recorded per endpoint, with IDs folded into '{id}'.
+        """
+
+        kwargs.setdefault('timeout', self.timeout)
+        path = path.lstrip('/')
+        endpoint = ENDPOINT_ID.sub('/{id}', '/' + path)[1:]
+        status = 'error'
+        try:
+            with metrics.timer('snipeit_request_seconds', method=method, endpoint=endpoint):
+                response = snipeit_request(method, f"{self.api_url}/{path}",
+                                           rate_limiter=self.rate_limiter, session=self.session, **kwargs)
+            status = response.status_code
+            return response
+        finally:
+            metrics.inc('snipeit_requests_total', method=method, endpoint=endpoint, status=status)
+
+    def get(self, path, params=None):
+        """GETs an /api/v1 path and returns the decoded JSON, raising on HTTP errors."""
+
+        response = self.request('GET', path, params=params)
+        response.raise_for_status()
+        return response.json()
+
+    def post(self, path, payload):
+        """POSTs a JSON payload and returns the decoded JSON, raising on HTTP errors."""
+
+        response = self.request('POST', path, json=payload)
+        response.raise_for_status()
+        return response.json()
+
+    def patch(self, path, payload):
+        """PATCHes a JSON payload and returns the decoded JSON, raising on HTTP errors."""
+
+        response = self.request('PATCH', path, json=payload)
+        response.raise_for_status()
+        return response.json()
+
+    def iter_pages(self, path, params=None, page_size=SNIPEIT_PAGE_SIZE, workers=4):
+        """
+        Yields every page ({'total': ..., 'rows': [...]}) of a paginated list endpoint, in order.
+
+        The first page reports the total; the remaining offsets are then
+        fetched concurrently, with at most 2 * workers pages in flight so a
+        slow consumer never buffers more than that. Results are sorted by id
+        so offsets stay stable while pages are in flight.
+        """
+
+        params = {'sort': 'id', 'order': 'asc', **(params or {})}
+
+        first_page = self.get(path, {**params, 'limit': page_size, 'offset': 0})
+        total = first_page.get('total', 0)
+        yield first_page
+
+        # The server may cap 'limit' below what we asked for, so step by what it actually returned
+        page_size = len(first_page.get('rows', [])) or page_size
+        offsets = iter(range(page_size, total, page_size))
+
+        def fetch(offset):
+            return self.get(path, {**params, 'limit': page_size, 'offset': offset})
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            in_flight = deque(executor.submit(fetch, offset) for offset in islice(offsets, workers * 2))
+            while in_flight:
+                page = in_flight.popleft().result()
+                for offset in islice(offsets, 1):
+                    in_flight.append(executor.submit(fetch, offset))
+                yield page
+
+    def iter_rows(self, path, params=None, page_size=SNIPEIT_PAGE_SIZE, workers=4):
+        """Yields every row of a paginated list endpoint (see iter_pages)."""
+
+        for page in self.iter_pages(path, params, page_size, workers):
+            yield from page.get('rows', [])
+
+    # --------------------------------------------------------------------------
+    # Hardware
+    # --------------------------------------------------------------------------
+
+    def iter_hardware(self, params=None, workers=4):
+        return self.iter_rows('hardware', params, workers=workers)
+
+    def search_hardware(self, asset_tag):
+        return self.get('hardware', {'search': asset_tag, 'asset_tag': asset_tag})
+
+    def create_hardware(self, payload):
+        return self.post('hardware', payload)
+
+    def update_hardware(self, asset_id, payload):
+        return self.patch(f'hardware/{asset_id}', payload)
+
+    # --------------------------------------------------------------------------
+    # Custom fields, fieldsets, models, categories and manufacturers
+    # --------------------------------------------------------------------------
+
+    def list_fields(self):
+        return list(self.iter_rows('fields'))
+
+    def create_field(self, payload):
+        return self.post('fields', payload)
+
+    def associate_field(self, field_id, fieldset_id, order=None):
+        # Without an order, Snipe-IT appends the field: concurrent calls can get the same position
+        payload = {'fieldset_id': fieldset_id}
+        if order is not None:
+            payload['order'] = order
+        return self.post(f'fields/{field_id}/associate', payload)
+
+    def list_fieldsets(self):
+        return list(self.iter_rows('fieldsets'))
+
+    def create_fieldset(self, payload):
+        return self.post('fieldsets', payload)
+
+    def list_models(self):
+        return list(self.iter_rows('models'))
+
+    def create_model(self, payload):
+        return self.post('models', payload)
+
+    def update_model(self, model_id, payload):
+        return self.patch(f'models/{model_id}', payload)
+
+    def list_categories(self):
+        return list(self.iter_rows('categories'))
+
+    def create_category(self, payload):
+        return self.post('categories', payload)
+
+    def list_manufacturers(self):
+        return list(self.iter_rows('manufacturers'))
+
+    def create_manufacturer(self, payload):
+        return self.post('manufacturers', payload)
+
+    def get_status_label(self, status_id):
+        return self.get(f'statuslabels/{status_id}')
+
+    # --------------------------------------------------------------------------
+    # CSV imports
+    # --------------------------------------------------------------------------
+
+    def upload_import(self, path):
+        """Uploads a CSV file to the importer; the response lists it under 'files' with its import ID."""
+
+        # Sent from memory, so a retry after a 429 sends the whole file again
+        with open(path, 'rb') as handle:
+            content = handle.read()
+        response = self.request('POST', 'imports', files={'files[]': (os.path.basename(path), content, 'text/csv')})
+        response.raise_for_status()
+        return response.json()
+
+    def process_import(self, import_id, payload, timeout=None):
+        """
+        Runs an uploaded import and returns the decoded JSON.
+
+        Snipe-IT answers HTTP 500 with status 'import-errors' when some rows
+        failed; that is returned like a success. The import runs within the
+        request, so pass a timeout long enough for the whole file.
+        """
+
+        response = self.request('POST', f'imports/process/{import_id}', json=payload, timeout=timeout or self.timeout)
+        if response.status_code == 500:
+            try:
+                data = response.json()
+            except ValueError:
+                data = {}
+            if data.get('status') == 'import-errors':
+                return data
+        response.raise_for_status()
+        return response.json()
+
+    def delete_import(self, import_id):
+        response = self.request('DELETE', f'imports/{import_id}')
+        response.raise_for_status()
+        return response.json()
@@ -0,0 +1,228 @@
+import csv
+import html
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from log_config import fields
+from metrics import metrics
+from snipeit_metadata import SNIPEIT_CATEGORY_NAME, SNIPEIT_MANUFACTURER_NAME, SNIPEIT_MODEL_NAME, load_metadata
+
+log = logging.getLogger(__name__)
+
+# ==============================================================================
+# CONFIGURATION
+# ==============================================================================
+
+# Bulk-load mode (inventory.py --bulk-load) creates new assets through
+# Snipe-IT's CSV importer, SNIPEIT_IMPORT_CHUNK_SIZE rows per import, instead
+# of one POST per asset. The importer processes a whole file in one request,
+# bounded on the server by IMPORT_TIME_LIMIT (600s by default), so keep chunks
+# small enough to finish well within it.
+SNIPEIT_IMPORT_CHUNK_SIZE = int(os.getenv("SNIPEIT_IMPORT_CHUNK_SIZE", "2000"))
+SNIPEIT_IMPORT_TIMEOUT = float(os.getenv("SNIPEIT_IMPORT_TIMEOUT", "600"))  # seconds
+SNIPEIT_IMPORT_DIR = os.getenv("SNIPEIT_IMPORT_DIR", "")  # default: a temporary directory
+
+# Payload key -> (CSV header, importer field). Custom fields are matched by
+# the importer on their name, so their headers are the field names.
+IMPORT_COLUMNS = {
+    'asset_tag': ('Asset Tag', 'asset_tag'),
+    'name': ('Name', 'item_name'),
+    'serial': ('Serial', 'serial'),
+    'status_id': ('Status', 'status'),
+    'model_id': ('Model', 'asset_model'),
+    'category': ('Category', 'category'),
+    'manufacturer': ('Manufacturer', 'manufacturer'),
+    'purchase_date': ('Purchase Date', 'purchase_date'),
+    'notes': ('Notes', 'asset_notes'),
+}
+
+# ==============================================================================
+# BULK LOADER
+# ==============================================================================
+
+class BulkLoader:
+    """
+    Creates new assets through Snipe-IT's CSV importer instead of one POST each.
+
+    add() appends a payload to the current chunk file, from any thread. A full
+    chunk is handed to a background thread that uploads and processes it
+    while the next one fills up; imports run one at a time, as the importer
+    holds a database transaction for the whole file. finish() imports the
+    last chunk and waits for all of them.
+
+    custom_columns are the custom field db columns the payloads may fill
+    (payloads of different resource types fill different ones); when not
+    given, the first payload's are used.
+
+    The importer does not report the IDs it created, so callers find out
+    which assets made it by reading the hardware list afterwards.
+    """
+
+    # Payload keys sent as the names of what their IDs resolve to, per row
+    NAMED_KEYS = ('status_id', 'model_id', 'category', 'manufacturer')
+
+    def __init__(self, client, custom_columns=(), chunk_size=SNIPEIT_IMPORT_CHUNK_SIZE, directory=SNIPEIT_IMPORT_DIR,
+                 timeout=SNIPEIT_IMPORT_TIMEOUT):
+        self.client = client
+        self.custom_columns = list(custom_columns)
+        self.chunk_size = chunk_size
+        self.directory = directory or tempfile.mkdtemp(prefix='snipeit_import_')
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.futures = []
+        self.columns = None
+        self.models = None
+        self.names = {}  # (model_id, status_id) -> {payload key: name}
+        self.chunk = None
+        self.chunk_number = 0
+
+    def add(self, payload):
+        with self.lock:
+            if self.columns is None:
+                self.columns = self._plan_columns(payload)
+            if self.chunk is None:
+                self._open_chunk()
+            self.chunk['writer'].writerow(self._row(payload))
+            self.chunk['rows'] += 1
+            if self.chunk['rows'] >= self.chunk_size:
+                self._submit_chunk()
+
+    def finish(self):
+        """Imports what is left and waits; returns how many rows are known not to have been imported."""
+
+        with self.lock:
+            if self.chunk is not None:
+                self._submit_chunk()
+        failed_rows = sum(future.result() for future in self.futures)
+        self.executor.shutdown()
+        return failed_rows
+
+    # --------------------------------------------------------------------------
+    # CSV chunks
+    # --------------------------------------------------------------------------
+
+    def _plan_columns(self, payload):
+        """
+        Works out the CSV columns: [(payload key, header, importer field)].
+
+        Status and model are sent by name, which the importer looks up; the
+        category and manufacturer are only used if it has to create the model.
+        """
+
+        metadata = load_metadata(self.client)
+        field_names = {row['db_column_name']: html.unescape(row['name']) for row in metadata['fields']}
+        self.models = {row['id']: row for row in metadata['models']}
+
+        columns = []
+        for key, (header, field) in IMPORT_COLUMNS.items():
+            # IDs are only ever sent as the names they resolve to
+            if key in self.NAMED_KEYS or key in payload:
+                columns.append((key, header, field))
+
+        unknown = []
+        for key in self.custom_columns or [key for key in payload if key not in IMPORT_COLUMNS]:
+            if key in field_names:
+                columns.append((key, field_names[key], None))
+            else:
+                unknown.append(key)
+        if unknown:
+            log.warning("Left out of the import, not custom fields in Snipe-IT: %s", ', '.join(unknown))
+        return columns
+
+    def _resolve_names(self, payload):
+        """Returns the status, model, category and manufacturer names for a payload's IDs (cached)."""
+
+        key = (payload.get('model_id'), payload.get('status_id'))
+        names = self.names.get(key)
+        if names is not None:
+            return names
+
+        model = self.models.get(payload.get('model_id'))
+        names = {
+            'model_id': html.unescape(model['name']) if model else SNIPEIT_MODEL_NAME,
+            'category': html.unescape(((model or {}).get('category') or {}).get('name') or SNIPEIT_CATEGORY_NAME),
+            'manufacturer': html.unescape(((model or {}).get('manufacturer') or {}).get('name')
+                                          or SNIPEIT_MANUFACTURER_NAME),
+        }
+        try:
+            names['status_id'] = html.unescape(self.client.get_status_label(payload['status_id'])['name'])
+        except (requests.exceptions.RequestException, KeyError, ValueError) as e:
+            # Without it the importer picks the first deployable status
+            log.warning("Could not read status label %s, leaving the status to the importer: %s",
+                        payload.get('status_id'), e)
+        self.names[key] = names
+        return names
+
+    def _row(self, payload):
+        names = self._resolve_names(payload)
+        row = []
+        for key, _, _ in self.columns:
+            value = names.get(key) if key in self.NAMED_KEYS else payload.get(key)
+            row.append('' if value is None else value)
+        return row
+
+    def _open_chunk(self):
+        self.chunk_number += 1
+        path = os.path.join(self.directory, f'aws-assets-{os.getpid()}-{self.chunk_number:04d}.csv')
+        handle = open(path, 'w', newline='', encoding='utf-8')
+        writer = csv.writer(handle)
+        writer.writerow([header for _, header, _ in self.columns])
+        self.chunk = {'path': path, 'handle': handle, 'writer': writer, 'rows': 0}
+
+    def _submit_chunk(self):
+        chunk, self.chunk = self.chunk, None
+        chunk['handle'].close()
+        self.futures.append(self.executor.submit(self._import_chunk, chunk['path'], chunk['rows']))
+
+    # --------------------------------------------------------------------------
+    # Import API
+    # --------------------------------------------------------------------------
+
+    def _import_chunk(self, path, rows):
+        """Uploads and processes one chunk; returns how many of its rows did not make it (as far as we know)."""
+
+        context = fields(file=path, rows=rows)
+        mappings = {header: field for _, header, field in self.columns if field}
+
+        with metrics.timer('phase_seconds', phase='bulk_import'):
+            try:
+                upload = self.client.upload_import(path)
+                import_id = upload['files'][0]['id']
+                log.info("Uploaded import %s", import_id, extra=context)
+
+                response = self.client.process_import(import_id, {
+                    'import-type': 'asset',
+                    'import-update': False,
+                    'send-welcome': False,
+                    'run-backup': False,
+                    'column-mappings': mappings,
+                }, timeout=self.timeout)
+            except (requests.exceptions.RequestException, KeyError, IndexError, ValueError) as e:
+                log.error("Import failed, its assets were not created: %s", e, extra=context)
+                metrics.inc('snipeit_import_rows_total', rows, status='failed')
+                return rows
+
+        if response.get('status') == 'success':
+            log.info("Imported %d assets", rows, extra=context)
+            metrics.inc('snipeit_import_rows_total', rows, status='success')
+            os.remove(path)
+            try:
+                # Snipe-IT keeps every uploaded file until its import is deleted
+                self.client.delete_import(import_id)
+            except requests.exceptions.RequestException as e:
+                log.warning("Could not delete import %s from Snipe-IT: %s", import_id, e)
+            return 0
+
+        # 'import-errors': the rows without errors were still imported
+        errors = response.get('messages') or {}
+        failed = len(errors) if isinstance(errors, dict) else rows
+        log.error("Import finished with errors for %d row(s): %s", failed, str(errors)[:500], extra=context)
+        metrics.inc('snipeit_import_rows_total', rows - failed, status='success')
+        metrics.inc('snipeit_import_rows_total', failed, status='failed')
+        return failed
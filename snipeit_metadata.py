@@ -0,0 +1,211 @@
+import html
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from field_mapping import FIELD_SPECS
+from log_config import fields
+from snipeit_client import SNIPEIT_PAGE_SIZE
+
+log = logging.getLogger('snipeit_metadata')
+
+# ==============================================================================
+# CONFIGURATION
+# ==============================================================================
+
+# Snipe-IT custom fields, models and categories are looked up once per run and
+# cached locally. Within the TTL the cache is used as is; after that each list
+# is revalidated with If-None-Match when the server sent an ETag for it, and
+# re-read otherwise. If Snipe-IT cannot be read, an expired cache is used
+# anyway (with a warning) rather than failing the run.
+SNIPEIT_METADATA_CACHE = os.getenv("SNIPEIT_METADATA_CACHE", ".snipeit_metadata.json")
+SNIPEIT_METADATA_TTL = int(os.getenv("SNIPEIT_METADATA_TTL", "3600"))  # seconds
+
+SNIPEIT_CATEGORY_NAME = os.getenv("SNIPEIT_CATEGORY_NAME", "Cloud Infrastructure")
+SNIPEIT_MANUFACTURER_NAME = os.getenv("SNIPEIT_MANUFACTURER_NAME", "Amazon Web Services")
+SNIPEIT_MODEL_NAME = os.getenv("SNIPEIT_MODEL_NAME", "EC2 Instance")
+
+METADATA_ENDPOINTS = ('fields', 'models', 'categories')
+
+# ==============================================================================
+# FETCHING AND CACHING
+# ==============================================================================
+
+def fetch_listing(client, path, etag=None):
+    """
+    Reads a complete Snipe-IT list endpoint.
+
+    Returns {'rows': [...], 'etag': ...}, or None if the server answered 304
+    to the given ETag. ETags are only kept for single-page lists, since the
+    first page's ETag says nothing about the pages after it.
+    """
+
+    headers = {'If-None-Match': etag} if etag else {}
+    params = {'sort': 'id', 'order': 'asc', 'limit': SNIPEIT_PAGE_SIZE, 'offset': 0}
+    response = client.request('GET', path, params=params, headers=headers)
+    if response.status_code == 304:
+        return None
+    response.raise_for_status()
+
+    first_page = response.json()
+    rows = first_page.get('rows', [])
+    if len(rows) >= first_page.get('total', 0):
+        return {'rows': rows, 'etag': response.headers.get('ETag')}
+
+    return {'rows': list(client.iter_rows(path)), 'etag': None}
+
+
+def fetch_listings(client, paths, cached=None):
+    """Reads several list endpoints concurrently, reusing cached listings the server says are unchanged."""
+
+    cached = cached or {}
+
+    def fetch(path):
+        previous = cached.get(path)
+        listing = fetch_listing(client, path, previous.get('etag') if previous else None)
+        return path, listing if listing is not None else previous
+
+    with ThreadPoolExecutor(max_workers=len(paths)) as executor:
+        return dict(executor.map(fetch, paths))
+
+
+def load_metadata(client, cache_path=SNIPEIT_METADATA_CACHE, ttl=SNIPEIT_METADATA_TTL, refresh=False):
+    """
+    Returns {'fields': [...], 'models': [...], 'categories': [...]} for the client's server.
+
+    Served from the cache file while it is younger than ttl (and was written
+    for the same server); otherwise re-read or revalidated and written back.
+    If that fails, an expired cache for the same server is served instead;
+    without one the requests.exceptions.RequestException propagates.
+    """
+
+    cache = _read_cache(cache_path)
+    if cache.get('base_url') != client.base_url:
+        cache = {}
+
+    if not refresh and cache and time.time() - cache.get('fetched_at', 0) < ttl:
+        return {path: cache['listings'][path]['rows'] for path in METADATA_ENDPOINTS}
+
+    try:
+        listings = fetch_listings(client, METADATA_ENDPOINTS, None if refresh else cache.get('listings'))
+    except requests.exceptions.RequestException as e:
+        if not cache:
+            raise
+        age = time.time() - cache.get('fetched_at', 0)
+        log.warning("Could not read Snipe-IT metadata, using the expired cache: %s", e,
+                    extra=fields(cache_path=cache_path, age_seconds=round(age)))
+        return {path: cache['listings'][path]['rows'] for path in METADATA_ENDPOINTS}
+    _write_cache(cache_path, {'base_url': client.base_url, 'fetched_at': time.time(), 'listings': listings})
+    return {path: listings[path]['rows'] for path in METADATA_ENDPOINTS}
+
+
+def invalidate_metadata_cache(cache_path=SNIPEIT_METADATA_CACHE):
+    """Drops the cache, e.g. after setup_snipeit.py created fields or models."""
+
+    try:
+        os.remove(cache_path)
+    except FileNotFoundError:
+        pass
+
+
+def _read_cache(cache_path):
+    try:
+        with open(cache_path) as handle:
+            cache = json.load(handle)
+    except (OSError, ValueError):
+        return {}
+    if not all(path in cache.get('listings', {}) for path in METADATA_ENDPOINTS):
+        return {}
+    return cache
+
+
+def _write_cache(cache_path, cache):
+    # Write then rename so a concurrent run never reads a half-written file
+    temp_path = f"{cache_path}.tmp"
+    with open(temp_path, 'w') as handle:
+        json.dump(cache, handle)
+    os.replace(temp_path, cache_path)
+
+# ==============================================================================
+# RESOLUTION
+# ==============================================================================
+
+def index_by_name(rows):
+    """
+    Indexes list rows by their (HTML-unescaped) name.
+
+    Rows are read in ID order, so when a name is duplicated the oldest row
+    wins, the same one every time.
+    """
+
+    index = {}
+    for row in rows:
+        index.setdefault(html.unescape(row.get('name') or ''), row)
+    return index
+
+
+def find_by_name(rows, name):
+    """Returns the first row with exactly this name, or None."""
+
+    return index_by_name(rows).get(name)
+
+
+def resolve_field_mapping(fields, specs=FIELD_SPECS):
+    """
+    Matches the field spec against Snipe-IT's custom fields by name.
+
+    Returns (field_ids, field_columns, missing): spec key -> field ID, spec
+    key -> db column as reported by Snipe-IT, and the names of spec fields
+    that do not exist in Snipe-IT.
+    """
+
+    by_name = index_by_name(fields)
+    field_ids, field_columns, missing = {}, {}, []
+    for spec in specs:
+        field = by_name.get(spec.name)
+        if field is None:
+            missing.append(spec.name)
+            continue
+        field_ids[spec.key] = field['id']
+        column = field.get('db_column_name') or field.get('db_column')
+        if column:
+            field_columns[spec.key] = column
+    return field_ids, field_columns, missing
+
+
+def resolve_model_id(metadata, model_name=SNIPEIT_MODEL_NAME, category_name=SNIPEIT_CATEGORY_NAME):
+    """Returns the ID of the named model, preferring one in the named category, or None."""
+
+    category = find_by_name(metadata['categories'], category_name)
+    candidates = [model for model in metadata['models'] if html.unescape(model.get('name') or '') == model_name]
+    if category is not None:
+        in_category = [model for model in candidates if (model.get('category') or {}).get('id') == category['id']]
+        candidates = in_category or candidates
+    return candidates[0]['id'] if candidates else None
+
+
+def resolve_snipeit_ids(client, refresh=False, model_names=()):
+    """
+    Resolves everything inventory.py needs from Snipe-IT in one go.
+
+    Returns {'field_ids', 'field_columns', 'missing_fields', 'model_id',
+    'model_ids'}: model_id is the EC2 model's, model_ids maps each of
+    model_names to its model's ID (or None). Raises
+    requests.exceptions.RequestException if Snipe-IT cannot be read and
+    there is no usable cache.
+    """
+
+    metadata = load_metadata(client, refresh=refresh)
+    field_ids, field_columns, missing = resolve_field_mapping(metadata['fields'])
+    return {
+        'field_ids': field_ids,
+        'field_columns': field_columns,
+        'missing_fields': missing,
+        'model_id': resolve_model_id(metadata),
+        'model_ids': {name: resolve_model_id(metadata, name) for name in model_names},
+    }
+
@@ -0,0 +1,130 @@
+import json
+import os
+import threading
+import time
+
+# ==============================================================================
+# CONFIGURATION
+# ==============================================================================
+
+# Append-only JSON-lines record of a sync run's progress, so an interrupted run
+# can be picked up with --resume instead of starting over. Entries are buffered
+# and written + fsynced every SYNC_JOURNAL_FLUSH_EVERY entries or
+# SYNC_JOURNAL_FLUSH_INTERVAL seconds, whichever comes first; a crash loses at
+# most that much progress, which the resumed run simply redoes.
+SYNC_JOURNAL_PATH = os.getenv("SYNC_JOURNAL_PATH", ".sync_journal.jsonl")
+SYNC_JOURNAL_FLUSH_EVERY = int(os.getenv("SYNC_JOURNAL_FLUSH_EVERY", "500"))
+SYNC_JOURNAL_FLUSH_INTERVAL = float(os.getenv("SYNC_JOURNAL_FLUSH_INTERVAL", "2"))  # seconds
+
+# Outcomes that mean an asset needs no more work; anything else is retried
+DONE_OUTCOMES = {'cached', 'created', 'patched', 'unchanged'}
+
+# ==============================================================================
+# JOURNAL
+# ==============================================================================
+
+class SyncJournal:
+    """
+    Checkpoint journal of one sync run, shared by all threads.
+
+    Records every discovered batch (with payloads), every completed
+    (account, region, collector) scan and every per-asset outcome with its Snipe-IT ID.
+    A fresh run truncates the file; a resumed run appends to it.
+    """
+
+    def __init__(self, path=SYNC_JOURNAL_PATH, resume=False):
+        self.path = path
+        self.lock = threading.Lock()
+        self.buffer = []
+        self.last_flush = time.monotonic()
+        self.handle = open(path, 'a' if resume else 'w', encoding='utf-8')
+        self._append({'type': 'start', 'resume': resume, 'at': time.time()})
+
+    def record_batch(self, batch):
+        self._append({'type': 'batch', 'assets': batch})
+
+    def record_region(self, account, region, resource_count, collector='ec2'):
+        self._append({'type': 'region', 'account': account, 'region': region, 'collector': collector,
+                      'count': resource_count})
+
+    def record_outcome(self, asset_tag, outcome, snipeit_id):
+        self._append({'type': 'asset', 'asset_tag': asset_tag, 'outcome': outcome, 'snipeit_id': snipeit_id})
+
+    def finish(self):
+        """Marks the run as complete, so --resume has nothing left to pick up."""
+
+        self._append({'type': 'finished', 'at': time.time()})
+        self.flush()
+
+    def _append(self, entry):
+        line = json.dumps(entry, separators=(',', ':'), default=str)
+        with self.lock:
+            self.buffer.append(line)
+            if (len(self.buffer) >= SYNC_JOURNAL_FLUSH_EVERY
+                    or time.monotonic() - self.last_flush >= SYNC_JOURNAL_FLUSH_INTERVAL):
+                self._flush_locked()
+
+    def flush(self):
+        with self.lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if self.buffer:
+            self.handle.write('\n'.join(self.buffer) + '\n')
+            self.buffer = []
+        self.handle.flush()
+        os.fsync(self.handle.fileno())
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            self.handle.close()
+
+
+def load_journal(path=SYNC_JOURNAL_PATH):
+    """
+    Reads the journal of an interrupted run.
+
+    Returns None if there is no journal or its run finished. Otherwise returns
+    {'completed_regions': {(account, region, collector), ...}, 'pending': {asset_tag: asset},
+    'done': {asset_tag, ...}}: pending are discovered assets without a
+    successful outcome (never synced, or failed), done are assets that need
+    nothing more. A line cut short by a crash is ignored.
+    """
+
+    try:
+        handle = open(path, encoding='utf-8')
+    except FileNotFoundError:
+        return None
+
+    completed_regions, pending, done = set(), {}, set()
+    finished = False
+    with handle:
+        for line in handle:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+
+            kind = entry.get('type')
+            if kind == 'batch':
+                for asset in entry['assets']:
+                    if asset['asset_tag'] not in done:
+                        pending[asset['asset_tag']] = asset
+            elif kind == 'region':
+                completed_regions.add((entry['account'], entry['region'], entry['collector']))
+            elif kind == 'asset':
+                if entry['outcome'] in DONE_OUTCOMES:
+                    done.add(entry['asset_tag'])
+                    pending.pop(entry['asset_tag'], None)
+                else:
+                    done.discard(entry['asset_tag'])
+            elif kind == 'start':
+                finished = False
+            elif kind == 'finished':
+                finished = True
+
+    if finished:
+        return None
+    return {'completed_regions': completed_regions, 'pending': pending, 'done': done}
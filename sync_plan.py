@@ -0,0 +1,593 @@
+"""
+Plan a sync before running it, and apply a saved plan later.
+
+    python sync_plan.py plan [--archive] [--show]     (or: aws_inventory.py plan)
+    python sync_plan.py apply [PATH]                  (or: aws_inventory.py apply)
+
+`plan` discovers AWS (or replays a snapshot) and compares it with one
+read-only pass over the Snipe-IT hardware list: nothing is written to
+Snipe-IT. The result is every create, field-level update, archive and no-op
+the sync would perform, with the number of requests that takes and an
+estimate of how long, saved to SYNC_PLAN_PATH. `apply` then performs
+exactly those requests - e.g. in an off-peak window - without discovering
+or diffing anything again.
+"""
+import argparse
+import gzip
+import html
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import requests
+
+from aws_accounts import load_accounts
+from collectors import AWS_COLLECTORS, COLLECTORS, EC2, enabled_collectors
+from inventory import (
+    ARCHIVED_STATUS_ID,
+    AWS_ACCOUNTS,
+    LIVE_INSTANCE_STATES,
+    SNIPEIT_PREFETCH_WORKERS,
+    SNIPEIT_WRITE_WORKERS,
+    SYNC_INSTANCE_STATES,
+    SYNC_METRICS_JSON,
+    build_run_summary,
+    configure_payload_builder,
+    create_or_update_snipeit_asset,
+    diff_snipeit_payload,
+    discover_aws_assets,
+    replay_snapshot,
+    snipeit,
+    snipeit_row_values,
+)
+from log_config import LOG_FORMAT, LOG_LEVEL, configure_logging, fields
+from metrics import metrics, write_json
+from reconcile import EC2_TAG_PREFIX
+from run_lock import RunLock, RunLockHeld
+from snapshot import read_snapshot
+from sync_state import SyncStateStore, payload_fingerprint
+
+log = logging.getLogger('sync_plan')
+
+# ==============================================================================
+# CONFIGURATION
+# ==============================================================================
+
+# Where `plan` saves the plan and `apply` reads it from: gzipped JSON lines,
+# one header line (counts, estimate, Snipe-IT URL, creation time) and then
+# one line per asset, sorted by asset tag.
+SYNC_PLAN_PATH = os.getenv("SYNC_PLAN_PATH", ".sync_plan.jsonl.gz")
+
+# `apply` refuses plans older than this (without --force): Snipe-IT may have
+# been changed by hand or by another sync since they were made.
+SYNC_PLAN_MAX_AGE = int(os.getenv("SYNC_PLAN_MAX_AGE", str(24 * 3600)))  # seconds
+
+PLAN_FORMAT = 'aws-inventory-plan'
+PLAN_VERSION = 1
+
+# Actions that send one Snipe-IT request each when applied
+WRITE_ACTIONS = ('create', 'update', 'archive')
+ACTIONS = WRITE_ACTIONS + ('noop',)
+
+# ==============================================================================
+# PLANNING
+# ==============================================================================
+
+def collect_payloads(accounts, collectors, archive=False, replay=None, all_regions=False, state=None):
+    """
+    Discovers (or replays) every asset; returns ({asset_tag: payload}, live asset tags, failures).
+
+    An archiving plan discovers LIVE_INSTANCE_STATES, so that pending and
+    stopping instances are not taken for terminated ones; they count as
+    live, but their payloads are left out, as a sync would leave them. It
+    also scans every region without the state store: a region skipped for
+    having been empty would make instances launched there since look
+    terminated.
+    """
+
+    payloads = {}
+    transient = set()
+    failures = []
+    lock = threading.Lock()
+
+    def collect(batch):
+        with lock:
+            for asset in batch:
+                payloads[asset['asset_tag']] = asset['payload']
+
+    def note_state(collector, record):
+        if collector == EC2.name and record.state not in SYNC_INSTANCE_STATES:
+            with lock:
+                transient.add(record.instance_id)
+
+    if replay is not None:
+        replay_snapshot(replay, collect, collectors)
+        return payloads, set(payloads), failures
+
+    if archive:
+        discover_aws_assets(accounts, collect, states=LIVE_INSTANCE_STATES, failures=failures, all_regions=True,
+                            collectors=collectors, on_record=note_state)
+    else:
+        discover_aws_assets(accounts, collect, failures=failures, state=state, all_regions=all_regions,
+                            collectors=collectors)
+    live = set(payloads)
+    for asset_tag in transient:
+        payloads.pop(asset_tag, None)
+    return payloads, live, failures
+
+
+def fetch_snipeit_assets():
+    """
+    Reads the whole Snipe-IT hardware list once.
+
+    Returns {asset_tag: {'id', 'status_id', 'values'}}. Unlike
+    build_snipeit_asset_index() a failed page is raised: a plan made from
+    part of the list would create duplicates.
+    """
+
+    assets = {}
+    with metrics.timer('phase_seconds', phase='index_prefetch'):
+        for row in snipeit.iter_hardware(workers=SNIPEIT_PREFETCH_WORKERS):
+            asset_tag = html.unescape(row.get('asset_tag') or '')
+            if asset_tag:
+                values = snipeit_row_values(row)
+                assets[asset_tag] = {'id': row['id'], 'status_id': values['status_id'], 'values': values}
+    return assets
+
+
+def plan_actions(payloads, live, snipeit_assets, archive=False):
+    """
+    Returns the plan's actions, sorted by asset tag.
+
+    Each is a dict with 'action' (create, update, archive or noop) and
+    'asset_tag'; creates carry the payload, updates the asset ID, the
+    changed fields and their current values, archives the asset ID. Creates,
+    updates and no-ops carry the payload fingerprint the state store is
+    updated with on apply.
+    """
+
+    actions = []
+    for asset_tag, payload in payloads.items():
+        existing = snipeit_assets.get(asset_tag)
+        fingerprint = payload_fingerprint(payload)
+        if existing is None:
+            actions.append({'action': 'create', 'asset_tag': asset_tag, 'payload': payload,
+                            'fingerprint': fingerprint})
+            continue
+        changes = diff_snipeit_payload(payload, existing['values'])
+        if changes:
+            actions.append({'action': 'update', 'asset_tag': asset_tag, 'asset_id': existing['id'],
+                            'changes': changes, 'current': {key: existing['values'].get(key) for key in changes},
+                            'fingerprint': fingerprint})
+        else:
+            actions.append({'action': 'noop', 'asset_tag': asset_tag, 'asset_id': existing['id'],
+                            'fingerprint': fingerprint})
+
+    if archive:
+        for asset_tag, existing in snipeit_assets.items():
+            if (asset_tag.startswith(EC2_TAG_PREFIX) and asset_tag not in live
+                    and existing['status_id'] != ARCHIVED_STATUS_ID):
+                actions.append({'action': 'archive', 'asset_tag': asset_tag, 'asset_id': existing['id']})
+
+    actions.sort(key=lambda action: action['asset_tag'])
+    return actions
+
+
+def count_actions(actions):
+    counts = dict.fromkeys(ACTIONS, 0)
+    for action in actions:
+        counts[action['action']] += 1
+    return counts
+
+# ==============================================================================
+# ESTIMATE
+# ==============================================================================
+
+def request_seconds(histograms, methods=None):
+    """
+    Returns the mean Snipe-IT response time in a metrics summary's histograms, or None.
+
+    snipeit_request_seconds includes the time spent waiting for the rate
+    limiter, which the estimate accounts for separately, so the mean wait is
+    taken off. methods limits it to those HTTP methods.
+    """
+
+    count = total = 0
+    for series, histogram in histograms.items():
+        if not series.startswith('snipeit_request_seconds{'):
+            continue
+        if methods is None or any(f'method="{method}"' in series for method in methods):
+            count += histogram['count']
+            total += histogram['sum']
+    if not count:
+        return None
+    waits = histograms.get('snipeit_rate_limit_wait_seconds')
+    mean_wait = waits['sum'] / waits['count'] if waits and waits['count'] else 0.0
+    return max(0.0, total / count - mean_wait)
+
+
+def expected_request_seconds(metrics_path=SYNC_METRICS_JSON):
+    """
+    Returns the expected response time of a Snipe-IT write, or None if nothing was measured.
+
+    The POSTs and PATCHes of the last sync (its metrics summary) are what
+    applying a plan will see; failing those, the GETs of this plan's own
+    hardware fetch.
+    """
+
+    try:
+        with open(metrics_path, encoding='utf-8') as handle:
+            latency = request_seconds(json.load(handle).get('histograms', {}), methods=('POST', 'PATCH'))
+    except (OSError, ValueError):
+        latency = None
+    if latency is None:
+        latency = request_seconds(metrics.summary()['histograms'])
+    return latency
+
+
+def estimate_duration(counts, rate, latency, workers=SNIPEIT_WRITE_WORKERS):
+    """
+    Estimates how long applying a plan takes.
+
+    Every create, update and archive is one request. The writers send them
+    workers at a time, so the run takes the longer of what the rate limit
+    allows and what the latency allows; 429s and retries come on top.
+    """
+
+    write_requests = sum(counts[action] for action in WRITE_ACTIONS)
+    rate_bound = write_requests / rate if rate else 0.0
+    latency_bound = write_requests * (latency or 0.0) / workers
+    return {
+        'requests': write_requests,
+        'max_rps': round(rate, 3),
+        'request_seconds': round(latency, 4) if latency is not None else None,
+        'workers': workers,
+        'seconds': round(max(rate_bound, latency_bound), 1),
+        'bound': 'rate limit' if rate_bound >= latency_bound else 'latency',
+    }
+
+# ==============================================================================
+# PLAN FILE
+# ==============================================================================
+
+def write_plan(path, header, actions):
+    """Writes the plan through a temporary file, so an interrupted plan never replaces a good one."""
+
+    temp_path = f"{path}.tmp"
+    with gzip.open(temp_path, 'wt', encoding='utf-8') as handle:
+        handle.write(json.dumps(header, separators=(',', ':')) + '\n')
+        for action in actions:
+            handle.write(json.dumps(action, separators=(',', ':'), default=str))
+            handle.write('\n')
+    os.replace(temp_path, path)
+
+
+def read_plan(path):
+    """Returns (header, actions) of a plan file; raises ValueError for a file that is not a plan."""
+
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as handle:
+            header = json.loads(handle.readline() or 'null')
+            if not isinstance(header, dict) or header.get('format') != PLAN_FORMAT:
+                raise ValueError(f"{path} is not a sync plan")
+            if header.get('version') != PLAN_VERSION:
+                raise ValueError(f"{path} is a version {header.get('version')} plan; expected {PLAN_VERSION}")
+            actions = [json.loads(line) for line in handle]
+    except (EOFError, gzip.BadGzipFile, UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ValueError(f"{path} is not a sync plan: {e}")
+    if len(actions) != sum(header['counts'].values()):
+        raise ValueError(f"{path} is truncated: {len(actions)} of {sum(header['counts'].values())} actions")
+    return header, actions
+
+
+def plan_age(header):
+    return time.time() - datetime.fromisoformat(header['created_at']).timestamp()
+
+
+def format_seconds(seconds):
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m{seconds:02d}s" if hours else f"{minutes}m{seconds:02d}s"
+
+
+def print_plan(header, actions, show=False):
+    if show:
+        for action in actions:
+            if action['action'] == 'create':
+                print(f"+ {action['asset_tag']}  {action['payload'].get('name')}")
+            elif action['action'] == 'update':
+                details = '; '.join(f"{key}: {action['current'].get(key)} -> {value}"
+                                    for key, value in action['changes'].items())
+                print(f"~ {action['asset_tag']}  {details}")
+            elif action['action'] == 'archive':
+                print(f"- {action['asset_tag']}  (ID: {action['asset_id']}, to status {ARCHIVED_STATUS_ID})")
+
+    counts = header['counts']
+    estimate = header['estimate']
+    print("\n--- Sync Plan ---")
+    print(f"  create: {counts['create']}, update: {counts['update']}, archive: {counts['archive']}, "
+          f"no change: {counts['noop']}")
+    if header['archives_skipped']:
+        print(f"  [SKIPPED] {header['archives_skipped']} archive(s): discovery was incomplete")
+    if not header['complete']:
+        print(f"  [WARNING] Discovery was incomplete: {len(header['discovery_failures'])} failure(s)")
+    latency = (f", {estimate['request_seconds'] * 1000:.0f} ms per request"
+               if estimate['request_seconds'] is not None else "")
+    print(f"  Snipe-IT requests: {estimate['requests']} at up to {estimate['max_rps']:g}/s{latency}, "
+          f"{estimate['workers']} writers")
+    print(f"  Estimated duration: {format_seconds(estimate['seconds'])} (bound by {estimate['bound']})")
+
+# ==============================================================================
+# APPLYING
+# ==============================================================================
+
+def apply_action(action):
+    """Sends one action's request; returns (outcome, snipeit_id), snipeit_id None on failure."""
+
+    asset_tag = action['asset_tag']
+    if action['action'] == 'create':
+        snipeit_id = create_or_update_snipeit_asset(action['payload'])
+        return ('created' if snipeit_id else 'failed'), snipeit_id
+    if action['action'] == 'update':
+        snipeit_id = create_or_update_snipeit_asset(action['changes'], asset_id=action['asset_id'], asset_tag=asset_tag)
+        return ('patched' if snipeit_id else 'failed'), snipeit_id
+
+    try:
+        response_data = snipeit.update_hardware(action['asset_id'], {'status_id': ARCHIVED_STATUS_ID})
+    except requests.exceptions.RequestException as e:
+        log.error("Failed to archive asset: %s", e, extra=fields(asset_tag=asset_tag))
+        return 'failed', None
+    if response_data.get('status') != 'success':
+        log.error("Snipe-IT rejected the archive: %s", response_data.get('messages', 'Unknown error'),
+                  extra=fields(asset_tag=asset_tag))
+        return 'failed', None
+    log.info("Asset archived", extra=fields(asset_tag=asset_tag, snipeit_id=action['asset_id']))
+    return 'archived', action['asset_id']
+
+
+def apply_plan(actions, state=None, workers=SNIPEIT_WRITE_WORKERS):
+    """
+    Performs a plan's creates, updates and archives, workers at a time.
+
+    No-ops send nothing. The state store, if given, is updated as a sync
+    would update it, so the next sync skips what was just applied. Returns
+    the outcome counts.
+    """
+
+    counts = {'created': 0, 'patched': 0, 'archived': 0, 'unchanged': 0, 'failed': 0}
+    lock = threading.Lock()
+
+    def apply(action):
+        started = time.monotonic()
+        if action['action'] == 'noop':
+            outcome, snipeit_id = 'unchanged', action['asset_id']
+        else:
+            try:
+                outcome, snipeit_id = apply_action(action)
+            except Exception:
+                log.exception("Unexpected error applying action", extra=fields(asset_tag=action['asset_tag']))
+                outcome, snipeit_id = 'failed', None
+            metrics.observe('sync_asset_seconds', time.monotonic() - started, outcome=outcome)
+        metrics.inc('sync_assets_total', outcome=outcome)
+
+        if state is not None:
+            if outcome == 'failed' or outcome == 'archived':
+                state.forget(action['asset_tag'])
+            else:
+                state.record(action['asset_tag'], snipeit_id, action['fingerprint'])
+        with lock:
+            counts[outcome] += 1
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(apply, actions))
+    return counts
+
+# ==============================================================================
+# MAIN EXECUTION
+# ==============================================================================
+
+def add_logging_arguments(parser):
+    parser.add_argument('--log-level', default=LOG_LEVEL,
+                        help=f"DEBUG, INFO, WARNING or ERROR (default: {LOG_LEVEL})")
+    parser.add_argument('--log-format', default=LOG_FORMAT, choices=('text', 'json'),
+                        help=f"log as plain text or one JSON object per line (default: {LOG_FORMAT})")
+
+
+def add_plan_arguments(parser):
+    parser.add_argument('--output', default=SYNC_PLAN_PATH, metavar='PATH',
+                        help=f"where to save the plan (default: {SYNC_PLAN_PATH})")
+    parser.add_argument('--archive', action='store_true',
+                        help=f"also plan to move EC2 assets whose instance is gone to status {ARCHIVED_STATUS_ID} "
+                             f"(needs the ec2 collector; skipped if any account or region could not be scanned)")
+    parser.add_argument('--show', action='store_true', help="print every create, update and archive")
+    parser.add_argument('--all-regions', action='store_true',
+                        help="scan every region, including ones skipped for having been empty lately")
+    parser.add_argument('--no-state', action='store_true',
+                        help="do not read or write the local region cache (--archive never uses it)")
+    parser.add_argument('--refresh-metadata', action='store_true',
+                        help="re-read custom fields and models from Snipe-IT instead of the local cache")
+    parser.add_argument('--collectors', default=AWS_COLLECTORS, metavar='NAMES',
+                        help=f"resource types to discover, comma-separated, out of {', '.join(COLLECTORS)} "
+                             f"(default: {AWS_COLLECTORS})")
+    parser.add_argument('--from-snapshot', metavar='PATH',
+                        help="plan from the records of a snapshot instead of discovering them; makes no AWS calls")
+    add_logging_arguments(parser)
+
+
+def add_apply_arguments(parser):
+    parser.add_argument('plan', nargs='?', default=SYNC_PLAN_PATH,
+                        help=f"the plan to apply (default: {SYNC_PLAN_PATH})")
+    parser.add_argument('--force', action='store_true',
+                        help=f"apply a plan older than {SYNC_PLAN_MAX_AGE} seconds or made for another Snipe-IT")
+    parser.add_argument('--no-state', action='store_true',
+                        help="do not update the local sync-state cache")
+    parser.add_argument('--metrics-json', default=SYNC_METRICS_JSON, metavar='PATH',
+                        help=f"where to write the end-of-run metrics summary, '' for nowhere (default: {SYNC_METRICS_JSON})")
+    add_logging_arguments(parser)
+
+
+def check_plan_arguments(parser, args):
+    try:
+        args.collectors = enabled_collectors(args.collectors)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.archive and args.from_snapshot:
+        # A snapshot only holds running and stopped instances: the others would look terminated
+        parser.error("--archive cannot be combined with --from-snapshot")
+    if args.archive and EC2 not in args.collectors:
+        # Without EC2 discovery every instance in Snipe-IT would look terminated
+        parser.error("--archive needs the ec2 collector")
+
+
+def run_plan(args):
+    configure_logging(args.log_level, args.log_format)
+    configure_payload_builder(refresh=args.refresh_metadata)
+    if args.from_snapshot:
+        accounts = []
+        try:
+            read_snapshot(args.from_snapshot)
+        except (OSError, ValueError) as e:
+            log.error("Cannot replay snapshot: %s", e)
+            return 1
+    else:
+        from botocore.exceptions import BotoCoreError, ClientError
+
+        try:
+            accounts = load_accounts(AWS_ACCOUNTS)
+        except (BotoCoreError, ClientError, ValueError) as e:
+            log.error("Could not load the AWS accounts: %s", e)
+            return 1
+
+    log.info("Planning: reading AWS and Snipe-IT, writing nothing to Snipe-IT")
+    try:
+        # The region cache is the only thing written, and a sync may be writing it too
+        with RunLock():
+            state = None if args.no_state or args.from_snapshot else SyncStateStore()
+            try:
+                with ThreadPoolExecutor(max_workers=2) as executor:
+                    aws_future = executor.submit(collect_payloads, accounts, args.collectors, args.archive,
+                                                 args.from_snapshot, args.all_regions, state)
+                    snipeit_future = executor.submit(fetch_snipeit_assets)
+                    try:
+                        snipeit_assets = snipeit_future.result()
+                    except (requests.exceptions.RequestException, ValueError) as e:
+                        log.error("Could not read the Snipe-IT hardware list: %s", e)
+                        return 1
+                    try:
+                        payloads, live, failures = aws_future.result()
+                    except (OSError, ValueError) as e:
+                        # Discovery reports its own errors as failures; this is a bad snapshot
+                        log.error("Cannot replay snapshot: %s", e)
+                        return 1
+            finally:
+                if state is not None:
+                    state.close()
+    except RunLockHeld as e:
+        log.error("Not starting: %s", e)
+        return 1
+
+    actions = plan_actions(payloads, live, snipeit_assets, archive=args.archive)
+    archives_skipped = 0
+    if failures:
+        # A region we could not scan would make all of its instances look terminated. The
+        # plan may be applied much later and unattended, so unlike reconcile there is no --force.
+        archives_skipped = sum(1 for action in actions if action['action'] == 'archive')
+        actions = [action for action in actions if action['action'] != 'archive']
+
+    counts = count_actions(actions)
+    # The hardware fetch has taught the limiter the server's advertised limit, if it has one
+    rate = snipeit.rate_limiter.ceiling if snipeit.rate_limiter is not None else 0.0
+    header = {
+        'format': PLAN_FORMAT,
+        'version': PLAN_VERSION,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'snipeit_url': snipeit.base_url,
+        'complete': not failures,
+        'discovery_failures': failures,
+        'archives_skipped': archives_skipped,
+        'counts': counts,
+        'estimate': estimate_duration(counts, rate, expected_request_seconds()),
+    }
+    write_plan(args.output, header, actions)
+    print_plan(header, actions, show=args.show)
+    print(f"  Plan written to {args.output}; run `apply` to perform it")
+    return 0
+
+
+def run_apply(args):
+    configure_logging(args.log_level, args.log_format)
+    try:
+        header, actions = read_plan(args.plan)
+    except (OSError, ValueError) as e:
+        log.error("Cannot read the plan: %s", e)
+        return 1
+
+    if not args.force:
+        if header['snipeit_url'] != snipeit.base_url:
+            log.error("The plan was made for %s, not %s (use --force to apply it anyway)",
+                      header['snipeit_url'], snipeit.base_url)
+            return 1
+        if plan_age(header) > SYNC_PLAN_MAX_AGE:
+            log.error("The plan is %s old, more than SYNC_PLAN_MAX_AGE; make a new one or use --force",
+                      format_seconds(plan_age(header)))
+            return 1
+
+    estimate = header['estimate']
+    log.info("Applying plan from %s: %d request(s), estimated %s", header['created_at'], estimate['requests'],
+             format_seconds(estimate['seconds']))
+    try:
+        with RunLock(), metrics.timer('phase_seconds', phase='run'):
+            state = None if args.no_state else SyncStateStore()
+            try:
+                started = time.monotonic()
+                counts = apply_plan(actions, state)
+                seconds = time.monotonic() - started
+            finally:
+                if state is not None:
+                    state.close()
+    except RunLockHeld as e:
+        log.error("Not starting: %s", e)
+        return 1
+
+    print("\n--- Apply Summary ---")
+    for outcome, count in counts.items():
+        print(f"  {outcome}: {count}")
+    print(f"  took {format_seconds(seconds)} (estimated {format_seconds(estimate['seconds'])})")
+    if args.metrics_json:
+        write_json(args.metrics_json, build_run_summary(len(actions), counts))
+    return 1 if counts['failed'] else 0
+
+
+def plan_main(argv=None):
+    parser = argparse.ArgumentParser(description="Work out what a sync would change in Snipe-IT, without changing it.")
+    add_plan_arguments(parser)
+    args = parser.parse_args(argv)
+    check_plan_arguments(parser, args)
+    return run_plan(args)
+
+
+def apply_main(argv=None):
+    parser = argparse.ArgumentParser(description="Perform the changes of a plan saved by `plan`.")
+    add_apply_arguments(parser)
+    return run_apply(parser.parse_args(argv))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Plan a sync into Snipe-IT, then apply the plan.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    plan_parser = subparsers.add_parser('plan', help="work out what a sync would change, without changing it")
+    add_plan_arguments(plan_parser)
+    add_apply_arguments(subparsers.add_parser('apply', help="perform the changes of a saved plan"))
+    args = parser.parse_args(argv)
+    if args.command == 'plan':
+        check_plan_arguments(plan_parser, args)
+        return run_plan(args)
+    return run_apply(args)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,184 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# ==============================================================================
+# CONFIGURATION
+# ==============================================================================
+
+# Local record of what each asset looked like when we last pushed it to
+# Snipe-IT. Entries older than the TTL are revalidated against Snipe-IT even if
+# the payload did not change, so edits made in the Snipe-IT UI are corrected.
+SYNC_STATE_PATH = os.getenv("SYNC_STATE_PATH", ".sync_state.sqlite3")
+SYNC_STATE_TTL = int(os.getenv("SYNC_STATE_TTL", str(24 * 3600)))  # seconds
+SYNC_STATE_COMMIT_EVERY = int(os.getenv("SYNC_STATE_COMMIT_EVERY", "200"))
+
+# ==============================================================================
+# STATE STORE
+# ==============================================================================
+
+def payload_fingerprint(payload):
+    """Returns a stable hash of a Snipe-IT payload."""
+
+    encoded = json.dumps(payload, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+class SyncStateStore:
+    """
+    SQLite store of asset_tag -> (Snipe-IT id, payload fingerprint, last sync time).
+
+    Also keeps each account's region list and per-region activity, which
+    inventory.py uses to skip regions that keep coming back empty. Shared by
+    all threads; writes are committed in batches of SYNC_STATE_COMMIT_EVERY
+    and on close() so the store never becomes the bottleneck of a run. The
+    processes of a sharded run share one store with commit_every=1, so none
+    of them holds SQLite's write lock for longer than one write.
+    """
+
+    def __init__(self, path=SYNC_STATE_PATH, ttl=SYNC_STATE_TTL, commit_every=SYNC_STATE_COMMIT_EVERY):
+        self.path = path
+        self.ttl = ttl
+        self.commit_every = commit_every
+        self.lock = threading.Lock()
+        self.pending_writes = 0
+
+        self.connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS assets ('
+            '  asset_tag TEXT PRIMARY KEY,'
+            '  snipeit_id INTEGER NOT NULL,'
+            '  payload_hash TEXT NOT NULL,'
+            '  synced_at REAL NOT NULL'
+            ')'
+        )
+        # Per account and region: how many instances the last scan found, and
+        # for how many consecutive scans the region has been empty. scope
+        # identifies the collector and the filters the scans ran with.
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS region_activity ('
+            '  scope TEXT NOT NULL,'
+            '  account TEXT NOT NULL,'
+            '  region TEXT NOT NULL,'
+            '  instance_count INTEGER NOT NULL,'
+            '  empty_runs INTEGER NOT NULL,'
+            '  scanned_at REAL NOT NULL,'
+            '  PRIMARY KEY (scope, account, region)'
+            ')'
+        )
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS region_lists ('
+            '  account TEXT PRIMARY KEY,'
+            '  regions TEXT NOT NULL,'
+            '  fetched_at REAL NOT NULL'
+            ')'
+        )
+        self.connection.commit()
+
+    def count(self):
+        with self.lock:
+            return self.connection.execute('SELECT COUNT(*) FROM assets').fetchone()[0]
+
+    def get(self, asset_tag):
+        """Returns {'snipeit_id', 'payload_hash', 'synced_at'} for an asset, or None."""
+
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT snipeit_id, payload_hash, synced_at FROM assets WHERE asset_tag = ?', (asset_tag,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {'snipeit_id': row[0], 'payload_hash': row[1], 'synced_at': row[2]}
+
+    def is_fresh(self, entry, fingerprint):
+        """True if an entry matches the fingerprint and is younger than the TTL."""
+
+        return (
+            entry is not None
+            and entry['payload_hash'] == fingerprint
+            and time.time() - entry['synced_at'] < self.ttl
+        )
+
+    def record(self, asset_tag, snipeit_id, fingerprint):
+        """Remembers that asset_tag is in sync as Snipe-IT asset snipeit_id."""
+
+        with self.lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO assets (asset_tag, snipeit_id, payload_hash, synced_at) VALUES (?, ?, ?, ?)',
+                (asset_tag, snipeit_id, fingerprint, time.time())
+            )
+            self._maybe_commit()
+
+    def forget(self, asset_tag):
+        """Drops an asset so the next run resolves it from Snipe-IT again."""
+
+        with self.lock:
+            self.connection.execute('DELETE FROM assets WHERE asset_tag = ?', (asset_tag,))
+            self._maybe_commit()
+
+    def region_list(self, account, max_age):
+        """Returns the account's cached region list if younger than max_age seconds, else None."""
+
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT regions, fetched_at FROM region_lists WHERE account = ?', (account,)
+            ).fetchone()
+        if row is None or time.time() - row[1] >= max_age:
+            return None
+        return json.loads(row[0])
+
+    def record_region_list(self, account, regions):
+        with self.lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO region_lists (account, regions, fetched_at) VALUES (?, ?, ?)',
+                (account, json.dumps(regions), time.time())
+            )
+            self._maybe_commit()
+
+    def region_activity(self, scope, account):
+        """Returns {region: {'instance_count', 'empty_runs', 'scanned_at'}} for an account."""
+
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT region, instance_count, empty_runs, scanned_at FROM region_activity '
+                'WHERE scope = ? AND account = ?', (scope, account)
+            ).fetchall()
+        return {row[0]: {'instance_count': row[1], 'empty_runs': row[2], 'scanned_at': row[3]} for row in rows}
+
+    def record_region_scan(self, scope, account, region, instance_count):
+        """Records a completed scan; an empty one extends the region's run of empty scans."""
+
+        with self.lock:
+            self.connection.execute(
+                'INSERT INTO region_activity (scope, account, region, instance_count, empty_runs, scanned_at) '
+                'VALUES (?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (scope, account, region) DO UPDATE SET '
+                '  instance_count = excluded.instance_count,'
+                '  empty_runs = CASE WHEN excluded.instance_count > 0 THEN 0 ELSE empty_runs + 1 END,'
+                '  scanned_at = excluded.scanned_at',
+                (scope, account, region, instance_count, 0 if instance_count else 1, time.time())
+            )
+            self._maybe_commit()
+
+    def _maybe_commit(self):
+        self.pending_writes += 1
+        if self.pending_writes >= self.commit_every:
+            self.connection.commit()
+            self.pending_writes = 0
+
+    def commit(self):
+        """Commits pending writes now, e.g. after each batch of a long-running process."""
+
+        with self.lock:
+            self.connection.commit()
+            self.pending_writes = 0
+
+    def close(self):
+        with self.lock:
+            self.connection.commit()
+            self.connection.close()